@@ -1,4 +1,4 @@
-from typing import Dict, Any, Annotated, TypeAlias
+from typing import Dict, Any, Annotated, TypeAlias, List
 
 from pydantic import BaseModel, Field
 
@@ -21,6 +21,12 @@ class NvidiaOutput(BaseModel):
     """
 
     output: str
+    # Every generated image when the request produced a batch, output is the first of them
+    outputs: List[str] = []
+    # Extra versions of the outputs by derivative name (e.g. thumbnails), in the same order as outputs
+    derivatives: Dict[str, List[str]] = {}
+    # Seed of every output when the request generated variants, in the same order as outputs
+    seeds: List[int] = []
 
     profile: Dict[str, Any] = {}
 
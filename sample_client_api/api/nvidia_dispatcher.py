@@ -1,3 +1,6 @@
+from fastapi import Depends, HTTPException
+from starlette import status
+
 from sample_client_api.api.network_models import (
     NvidiaOutput,
 )
@@ -5,8 +8,18 @@ from sample_client_api.config import (
     NVCF_SDXL_DIFFUSION_FUNCTION_ID,
     NVCF_UPSCALER_FUNCTION_ID,
 )
+from sample_client_api.bootup.nvidia_objects import IMMUTABLE_BOOTUP_MANAGER
+from sample_client_api.custom_api_route import (
+    DisconnectCancellingAPIRoute,
+    CLIENT_DISCONNECT_CANCELLATIONS,
+)
 from sample_client_api.custom_router import CustomAPIRouter
-from sample_client_api.nvidia.nvidia_multi_client_request import multi_client_request
+from sample_client_api.nvidia.nvidia_multi_client_request import (
+    multi_client_request,
+    progressive_multi_client_request,
+)
+from sample_client_api.nvidia.nvidia_upload_encoding import upload_encoding_stats
+from sample_client_api.tracing import InMemorySpanExporter, span_exporter
 from sample_client_api.nvidia.nvidia_service import (
     process_image_to_image,
     process_inpaint,
@@ -17,8 +30,14 @@ from sample_client_api.nvidia.nvidia_service import (
     process_avatar,
     process_diffusion,
     process_upscaler,
+    process_sdxl,
+    process_text_to_video,
+    handle_video_request,
     NvidiaUpscalerRequest,
-    __upload_to_s3,
+    build_output_response,
+    with_default_priority,
+    read_request_timeout,
+    read_request_route,
 )
 from sample_client_api.nvidia_request_models.final_models import (
     GuidanceNvidiaClientRequest,
@@ -29,18 +48,34 @@ from sample_client_api.nvidia_request_models.final_models import (
     FaceswapIpNvidiaClientRequest,
     AvatarNvidiaClientRequest,
     DiffusionNvidiaClientRequest,
+    SDXLNvidiaClientRequest,
+    TextToVideoNvidiaClientRequest,
+    NvidiaPriority,
+    NvidiaResponseMode,
 )
 
-nvidia_dispatcher = CustomAPIRouter()
+nvidia_dispatcher = CustomAPIRouter(
+    route_class=DisconnectCancellingAPIRoute,
+    dependencies=[Depends(read_request_timeout), Depends(read_request_route)],
+)
 
 
 @nvidia_dispatcher.post("/txt2img", response_model=NvidiaOutput)
 async def text_to_image_and_upscale(
     request: GuidanceNvidiaClientRequest,
 ) -> NvidiaOutput:
+    request = with_default_priority(request, NvidiaPriority.INTERACTIVE)
+    if request.response_mode == NvidiaResponseMode.PROGRESSIVE:
+        return await progressive_multi_client_request(request)
     output_bytes = await multi_client_request(request)
-    result = await __upload_to_s3(output_bytes, request)
-    return NvidiaOutput(output=result)
+    return await build_output_response([output_bytes.getvalue()], request, {})
+
+
+@nvidia_dispatcher.post("/txt2vid", response_model=NvidiaOutput)
+async def text_to_video(
+    request: TextToVideoNvidiaClientRequest,
+) -> NvidiaOutput:
+    return await handle_video_request(request, process_text_to_video)
 
 
 @nvidia_dispatcher.post("/img2img", response_model=NvidiaOutput)
@@ -57,7 +92,9 @@ async def inpaint(request: InpaintNvidiaClientRequest) -> NvidiaOutput:
 
 @nvidia_dispatcher.post("/instruct", response_model=NvidiaOutput)
 async def instruct(request: InstructNvidiaClientRequest) -> NvidiaOutput:
-    return await handle_request(request, process_instruct)
+    return await handle_request(
+        with_default_priority(request, NvidiaPriority.INTERACTIVE), process_instruct
+    )
 
 
 @nvidia_dispatcher.post("/faceswap", response_model=NvidiaOutput)
@@ -86,18 +123,83 @@ async def sdxl_diffusion(
     request: DiffusionNvidiaClientRequest, 
 ) -> NvidiaOutput:
     return await handle_request(
-        request,
+        with_default_priority(request, NvidiaPriority.BULK),
         lambda r: process_diffusion(
             r, NVCF_SDXL_DIFFUSION_FUNCTION_ID
         ),
     )
 
 
+@nvidia_dispatcher.post("/sdxl", response_model=NvidiaOutput)
+async def sdxl(
+    request: SDXLNvidiaClientRequest,
+) -> NvidiaOutput:
+    return await handle_request(request, process_sdxl)
+
+
 @nvidia_dispatcher.post("/upscaler", response_model=NvidiaOutput)
 async def upscaler(
     request: NvidiaUpscalerRequest, 
 ) -> NvidiaOutput:
     return await handle_request(
-        request, lambda r: process_upscaler(r, NVCF_UPSCALER_FUNCTION_ID)
+        with_default_priority(request, NvidiaPriority.BULK),
+        lambda r: process_upscaler(r, NVCF_UPSCALER_FUNCTION_ID),
     )
 
+
+@nvidia_dispatcher.get("/resolution_buckets")
+async def resolution_buckets():
+    from sample_client_api.synth.synth_resolution_buckets import get_resolution_bucket_planner
+
+    return get_resolution_bucket_planner().stats()
+
+
+@nvidia_dispatcher.get("/accounts")
+async def accounts():
+    return IMMUTABLE_BOOTUP_MANAGER.nvidia_account_pool.stats()
+
+
+@nvidia_dispatcher.get("/scheduler")
+async def scheduler():
+    return await IMMUTABLE_BOOTUP_MANAGER.nvidia_scheduler.stats()
+
+
+@nvidia_dispatcher.get("/input_cache")
+async def input_cache():
+    return IMMUTABLE_BOOTUP_MANAGER.input_image_cache.stats()
+
+
+@nvidia_dispatcher.get("/disconnects")
+async def disconnects():
+    return dict(CLIENT_DISCONNECT_CANCELLATIONS)
+
+
+@nvidia_dispatcher.get("/latency_model")
+async def latency_model():
+    return IMMUTABLE_BOOTUP_MANAGER.latency_model.to_json()
+
+
+@nvidia_dispatcher.get("/upload_encoding")
+async def upload_encoding():
+    return upload_encoding_stats()
+
+
+@nvidia_dispatcher.get("/task_journal")
+async def task_journal():
+    if IMMUTABLE_BOOTUP_MANAGER.task_journal is None:
+        raise HTTPException(
+            detail="The task journal is disabled, set NVCF_TASK_JOURNAL_PATH to enable it",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return await IMMUTABLE_BOOTUP_MANAGER.task_journal.stats()
+
+
+@nvidia_dispatcher.get("/traces")
+async def traces():
+    exporter = span_exporter()
+    if not isinstance(exporter, InMemorySpanExporter):
+        raise HTTPException(
+            detail="Traces are only kept in memory with TRACING_EXPORTER=memory",
+            status_code=status.HTTP_404_NOT_FOUND,
+        )
+    return exporter.traces()
@@ -0,0 +1,23 @@
+import asyncio
+import importlib
+import time
+
+from sample_client_api.log_handling import get_logger_for_file
+
+logger = get_logger_for_file(__name__)
+
+# Imported on first use instead of when the app is imported, they make up most of the startup time of a worker
+HEAVY_MODULES = ("aioboto3", "numpy", "PIL.Image", "jwt")
+
+
+def import_heavy_modules():
+    for module_name in HEAVY_MODULES:
+        start_time = time.perf_counter()
+        importlib.import_module(module_name)
+        logger.info(f"Imported {module_name} in {(time.perf_counter() - start_time) * 1000:.1f}ms")
+
+
+def warm_up_heavy_imports() -> asyncio.Future:
+    # The worker keeps serving while the modules load, a request needing one of them just waits on the import lock
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(None, import_heavy_modules)
@@ -1,13 +1,55 @@
+import asyncio
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Dict, Any
+
 from sample_client_api.log_handling import get_logger_for_file
 
 from sample_client_api import config
+from sample_client_api.nvidia.nvidia_account_pool import NvidiaAccount, NvidiaAccountPool
+from sample_client_api.bootup.lazy_imports import warm_up_heavy_imports
+from sample_client_api.nvidia.client.nvidia_latency_model import NvidiaLatencyModel
+from sample_client_api.nvidia.client.nvidia_request import configured_function_ids, validate_function_maps
+from sample_client_api.nvidia.nvidia_input_cache import NvidiaInputImageCache
+from sample_client_api.nvidia.nvidia_output_derivatives import initialize_derivative_executor
+from sample_client_api.nvidia.nvidia_scheduler import NvidiaPriorityScheduler
+from sample_client_api.nvidia.nvidia_shared_state import (
+    SharedStateDirectory,
+    SharedInFlightCounter,
+)
 from sample_client_api.nvidia.nvidia_task_handler import NvidiaImageGenerationTaskHandler
+from sample_client_api.nvidia.nvidia_task_journal import NvidiaTaskJournal
 from sample_client_api.nvidia.nvidia_token_manager import NvidiaAuthConfig
+from sample_client_api.nvidia_request_models.final_models import NvidiaPriority
+from sample_client_api.tracing import shutdown_tracing
 
 logger = get_logger_for_file(__name__)
 
 
-def initialize_nvidia_service() -> NvidiaImageGenerationTaskHandler:
+def initialize_shared_state() -> Optional[SharedStateDirectory]:
+    if not config.NVCF_SHARED_STATE_DIR:
+        return None
+    logger.info(f"Sharing state between workers through {config.NVCF_SHARED_STATE_DIR}")
+    return SharedStateDirectory(config.NVCF_SHARED_STATE_DIR)
+
+
+def initialize_latency_model() -> NvidiaLatencyModel:
+    return NvidiaLatencyModel(config.NVCF_LATENCY_MODEL_PATH)
+
+
+def initialize_task_journal() -> Optional[NvidiaTaskJournal]:
+    if not config.NVCF_TASK_JOURNAL_PATH:
+        return None
+    logger.info(f"Journaling NVCF tasks to {config.NVCF_TASK_JOURNAL_PATH}")
+    return NvidiaTaskJournal(config.NVCF_TASK_JOURNAL_PATH)
+
+
+def initialize_nvidia_service(
+    shared_state: Optional[SharedStateDirectory] = None,
+    latency_model: Optional[NvidiaLatencyModel] = None,
+    task_journal: Optional[NvidiaTaskJournal] = None,
+) -> NvidiaImageGenerationTaskHandler:
     logger.info("Initializing NVIDIA service...")
 
     auth_config = NvidiaAuthConfig(
@@ -20,22 +62,195 @@ def initialize_nvidia_service() -> NvidiaImageGenerationTaskHandler:
     )
 
     nvidia_task_handler = NvidiaImageGenerationTaskHandler(
-        nvcf_url=config.NVCF_URL, auth_config=auth_config
+        nvcf_urls=config.NVCF_URLS,
+        auth_config=auth_config,
+        shared_state=shared_state,
+        latency_model=latency_model,
+        task_journal=task_journal,
     )
 
     logger.info("Initialized NVIDIA service")
     return nvidia_task_handler
 
 
+def initialize_pooled_nvidia_accounts(
+    shared_state: Optional[SharedStateDirectory] = None,
+    latency_model: Optional[NvidiaLatencyModel] = None,
+    task_journal: Optional[NvidiaTaskJournal] = None,
+) -> List[NvidiaAccount]:
+    if not config.NVCF_CREDENTIAL_POOL:
+        return []
+
+    accounts = []
+    for pooled_account in json.loads(config.NVCF_CREDENTIAL_POOL):
+        username = pooled_account["nvidia_username"]
+        logger.info(f"Initializing pooled NVIDIA account {username}...")
+        auth_config = NvidiaAuthConfig(
+            auth_url=pooled_account.get("auth_url", config.NVCF_AUTH_URL),
+            nvidia_username=username,
+            nvidia_client_secret=pooled_account["nvidia_client_secret"],
+            token_refresh_buffer_in_seconds=config.NVCF_TOKEN_REFRESH_BUFFER_IN_SECONDS,
+        )
+        # Every account gets its own task handler, so its own token manager and connection pool
+        task_handler = NvidiaImageGenerationTaskHandler(
+            nvcf_urls=pooled_account.get("nvcf_urls", config.NVCF_URLS),
+            auth_config=auth_config,
+            shared_state=shared_state,
+            latency_model=latency_model,
+            task_journal=task_journal,
+        )
+        accounts.append(NvidiaAccount(username, task_handler))
+    return accounts
+
+
+def initialize_nvidia_account_pool(
+    shared_state: Optional[SharedStateDirectory] = None,
+    latency_model: Optional[NvidiaLatencyModel] = None,
+    task_journal: Optional[NvidiaTaskJournal] = None,
+) -> NvidiaAccountPool:
+    # Latency depends on the function and not on the account, so every account feeds the same model
+    accounts = [
+        NvidiaAccount(
+            config.NVIDIA_USERNAME, initialize_nvidia_service(shared_state, latency_model, task_journal)
+        ),
+        *initialize_pooled_nvidia_accounts(shared_state, latency_model, task_journal),
+    ]
+    logger.info(f"Initialized NVIDIA account pool with {len(accounts)} accounts")
+    return NvidiaAccountPool(accounts)
+
+
+def initialize_input_image_cache() -> NvidiaInputImageCache:
+    return NvidiaInputImageCache(
+        original_max_bytes=config.NVCF_INPUT_CACHE_BYTES,
+        variant_max_bytes=config.NVCF_INPUT_VARIANT_CACHE_BYTES,
+        revalidate_seconds=config.NVCF_INPUT_CACHE_REVALIDATE_SECONDS,
+    )
+
+
+def initialize_nvidia_scheduler(
+    shared_state: Optional[SharedStateDirectory] = None,
+) -> NvidiaPriorityScheduler:
+    host_counter = None
+    if shared_state is not None and config.NVCF_HOST_MAX_CONCURRENT_TASKS > 0:
+        host_counter = SharedInFlightCounter(shared_state, "nvcf-tasks")
+    host_bytes_counter = None
+    if shared_state is not None and config.NVCF_HOST_MAX_INFLIGHT_BYTES > 0:
+        host_bytes_counter = SharedInFlightCounter(shared_state, "nvcf-bytes")
+    return NvidiaPriorityScheduler(
+        max_concurrent=config.NVCF_MAX_CONCURRENT_TASKS,
+        aging_offsets={
+            NvidiaPriority.INTERACTIVE: 0.0,
+            NvidiaPriority.STANDARD: config.NVCF_PRIORITY_AGING_SECONDS_STANDARD,
+            NvidiaPriority.BULK: config.NVCF_PRIORITY_AGING_SECONDS_BULK,
+        },
+        host_counter=host_counter,
+        host_max_concurrent=config.NVCF_HOST_MAX_CONCURRENT_TASKS,
+        max_bytes=config.NVCF_MAX_INFLIGHT_BYTES,
+        host_bytes_counter=host_bytes_counter,
+        host_max_bytes=config.NVCF_HOST_MAX_INFLIGHT_BYTES,
+    )
+
+
 class BootupManager:
     def __init__(self):
-        self.nvidia_task_handler: NvidiaImageGenerationTaskHandler = None
+        self.shared_state: Optional[SharedStateDirectory] = None
+        self.nvidia_account_pool: NvidiaAccountPool = None
+        self.nvidia_scheduler: NvidiaPriorityScheduler = None
+        self.input_image_cache: NvidiaInputImageCache = None
+        self.latency_model: NvidiaLatencyModel = None
+        self.task_journal: Optional[NvidiaTaskJournal] = None
+        self.recovery_task: Optional[asyncio.Task] = None
+        self.derivative_executor: Optional[ThreadPoolExecutor] = None
+        # Opened on first use and kept for the life of the worker, so its S3 connections stay warm
+        self.s3_client: Optional[Any] = None
+        self.s3_client_context: Optional[Any] = None
+        self.heavy_imports: Optional[asyncio.Future] = None
+        # Readiness is only reported once the warmup is over, so load balancers skip cold workers
+        self.ready = False
+        self.warmup: Dict[str, Any] = {}
+        self.warmup_task: Optional[asyncio.Task] = None
 
     def perform_bootup(self):
-        self.nvidia_task_handler = initialize_nvidia_service()
+        self.shared_state = initialize_shared_state()
+        self.latency_model = initialize_latency_model()
+        self.task_journal = initialize_task_journal()
+        self.nvidia_account_pool = initialize_nvidia_account_pool(
+            self.shared_state, self.latency_model, self.task_journal
+        )
+        self.nvidia_scheduler = initialize_nvidia_scheduler(self.shared_state)
+        self.input_image_cache = initialize_input_image_cache()
+        self.derivative_executor = initialize_derivative_executor()
+
+    async def perform_startup(self):
+        validate_function_maps()
+        if config.WARMUP_HEAVY_IMPORTS:
+            self.heavy_imports = warm_up_heavy_imports()
+        if config.NVCF_WARMUP_ENABLED:
+            self.warmup_task = asyncio.create_task(self.perform_warmup())
+        else:
+            self.ready = True
+        if self.task_journal is not None:
+            self.recovery_task = asyncio.create_task(self.perform_recovery())
+
+    async def perform_recovery(self):
+        # nvidia_service imports this module, so it can only be imported once the app is up
+        from sample_client_api.nvidia.nvidia_service import recover_journaled_tasks
+
+        try:
+            await recover_journaled_tasks()
+        except Exception as e:
+            logger.error(f"Recovery of journaled tasks failed due to {e!r}", exc_info=True)
+
+    async def perform_warmup(self):
+        start_time = time.time()
+        try:
+            await asyncio.wait_for(self.__warm_up(), config.NVCF_WARMUP_TIMEOUT_SECONDS)
+        except Exception as e:
+            # A failed warmup only means the first requests are slower, it is no reason to keep the worker out
+            logger.error(f"Warmup did not complete due to {e!r}", exc_info=True)
+            self.warmup["error"] = repr(e)
+        finally:
+            self.warmup["seconds"] = time.time() - start_time
+            self.ready = True
+            logger.info(f"Worker is ready after a warmup of {self.warmup['seconds']:.2f}s")
+
+    async def __warm_up(self):
+        # nvidia_service imports this module, so it can only be imported once the app is up
+        from sample_client_api.nvidia.nvidia_service import warm_up_s3
+
+        if self.heavy_imports is not None:
+            await self.heavy_imports
+        function_ids = configured_function_ids() if config.NVCF_WARMUP_PROBE_FUNCTIONS else []
+
+        async def warm_up_accounts():
+            self.warmup["accounts"] = await self.nvidia_account_pool.warm_up(function_ids)
+
+        async def warm_up_storage():
+            try:
+                await warm_up_s3()
+                self.warmup["s3"] = "ok"
+            except Exception as e:
+                logger.error(f"S3 warmup failed due to {e!r}")
+                self.warmup["s3"] = repr(e)
+
+        await asyncio.gather(warm_up_accounts(), warm_up_storage())
 
     async def perform_shutdown(self):
-        await self.nvidia_task_handler.close()
+        if self.warmup_task is not None and not self.warmup_task.done():
+            self.warmup_task.cancel()
+        if self.recovery_task is not None and not self.recovery_task.done():
+            self.recovery_task.cancel()
+        await self.nvidia_account_pool.close()
+        if self.task_journal is not None:
+            self.task_journal.close()
+        self.latency_model.save()
+        if self.s3_client_context is not None:
+            await self.s3_client_context.__aexit__(None, None, None)
+            self.s3_client = None
+            self.s3_client_context = None
+        if self.derivative_executor is not None:
+            self.derivative_executor.shutdown(wait=False, cancel_futures=True)
+        shutdown_tracing()
 
 
 IMMUTABLE_BOOTUP_MANAGER = BootupManager()
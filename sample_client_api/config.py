@@ -10,11 +10,16 @@ API_DOCS_ENDPOINT = os.getenv(
 )
 
 NVIDIA_S3_BUCKET = os.getenv("NVIDIA_S3_BUCKET", "nvidia-generated-images")
+# Every S3 call of a worker goes through a single client, this bounds its pool of (kept alive) connections
+S3_MAX_POOL_CONNECTIONS = int(os.getenv("S3_MAX_POOL_CONNECTIONS", 50))
 
 DO_V1_LOWER_RES = get_boolean_from_os("DO_V1_LOWER_RES", default_value=True)
 
 ART_MAX_GENERATION_DIMENSION = int(os.getenv("ART_MAX_GENERATION_DIMENSION", 1024))
 ART_MIN_GENERATION_DIMENSION = int(os.getenv("ART_MIN_GENERATION_DIMENSION", 512))
+# SDXL is generated at the requested size, within these bounds of the model
+SDXL_MAX_GENERATION_DIMENSION = int(os.getenv("SDXL_MAX_GENERATION_DIMENSION", 1536))
+SDXL_MIN_GENERATION_DIMENSION = int(os.getenv("SDXL_MIN_GENERATION_DIMENSION", 512))
 # A max aspect ratio may or may not exist based on the hardware being used. A10G (G5) cannot generate
 # aspect ratios (height/width or width/height) being > 3.5 but A100 can on the volta compilations
 ART_MAYBE_MAX_ASPECT_RATIO = (
@@ -23,8 +28,24 @@ ART_MAYBE_MAX_ASPECT_RATIO = (
     else None
 )
 
+# Routes (e.g. "txt2img,img2img") whose base resolutions are snapped to a fixed table of shapes so that
+# slightly different requested sizes share the same engine shapes on NVCF
+RESOLUTION_BUCKETING_ROUTES = {
+    route.strip()
+    for route in os.getenv("RESOLUTION_BUCKETING_ROUTES", "").split(",")
+    if route.strip()
+}
+RESOLUTION_BUCKET_STEP = int(os.getenv("RESOLUTION_BUCKET_STEP", 128))
+
 # NVIDIA API settings
 NVCF_URL = os.getenv("NVCF_URL", "https://api.nvcf.nvidia.com")
+# Comma separated list of NVCF base urls (e.g. regional ones) to route tasks over, defaults to NVCF_URL
+NVCF_URLS = [
+    url.strip() for url in os.getenv("NVCF_URLS", NVCF_URL).split(",") if url.strip()
+]
+NVCF_ENDPOINT_EWMA_ALPHA = float(os.getenv("NVCF_ENDPOINT_EWMA_ALPHA", 0.2))
+# Share of tasks sent to a random endpoint so that the latency estimates of the others stay fresh
+NVCF_ENDPOINT_EXPLORATION_RATE = float(os.getenv("NVCF_ENDPOINT_EXPLORATION_RATE", 0.05))
 NVCF_AUTH_URL = os.getenv(
     "NVCF_AUTH_URL",
     "SOME_AUTH_URL"
@@ -52,6 +73,56 @@ NVCF_SDXL_DIFFUSION_FUNCTION_ID = os.getenv(
     "NVCF_SDXL_DIFFUSION_FUNCTION_ID"
 )
 NVCF_UPSCALER_FUNCTION_ID = os.getenv("NVCF_UPSCALER_FUNCTION_ID")
+# S3 multipart parts have to be at least 5MiB (except the last one)
+NVCF_VIDEO_UPLOAD_PART_BYTES = max(
+    int(os.getenv("NVCF_VIDEO_UPLOAD_PART_BYTES", 8 * 1024 * 1024)), 5 * 1024 * 1024
+)
+# Zipped results bigger than this are spooled to disk instead of being held in memory
+NVCF_RESULT_SPOOL_MAX_BYTES = int(os.getenv("NVCF_RESULT_SPOOL_MAX_BYTES", 16 * 1024 * 1024))
+# JSON list of extra NVCF accounts to spread the load over, each entry looks like
+# {"nvidia_username": ..., "nvidia_client_secret": ..., "auth_url": optional, "nvcf_urls": optional list}
+NVCF_CREDENTIAL_POOL = os.getenv("NVCF_CREDENTIAL_POOL")
+# How long an account returning auth or rate-limit errors is taken out of rotation
+NVCF_ACCOUNT_DRAIN_SECONDS = float(os.getenv("NVCF_ACCOUNT_DRAIN_SECONDS", 30.0))
+NVCF_ACCOUNT_ERROR_EWMA_ALPHA = float(os.getenv("NVCF_ACCOUNT_ERROR_EWMA_ALPHA", 0.2))
+# Max NVCF tasks in flight per worker, queued tasks are served in priority order (0 means unbounded)
+NVCF_MAX_CONCURRENT_TASKS = int(os.getenv("NVCF_MAX_CONCURRENT_TASKS", 0))
+# Max estimated bytes of images in flight per worker (0 means unbounded). A task is estimated as
+# (images generated + input assets) x pixels x NVCF_MEMORY_BYTES_PER_PIXEL x the factor of its route in
+# NVCF_MEMORY_ROUTE_FACTORS (JSON, routes not listed count 1), pixels default to NVCF_MEMORY_DEFAULT_PIXELS when the
+# request has no size. A task over the budget on its own still runs once nothing else is in flight
+NVCF_MAX_INFLIGHT_BYTES = int(os.getenv("NVCF_MAX_INFLIGHT_BYTES", 0))
+NVCF_MEMORY_BYTES_PER_PIXEL = float(os.getenv("NVCF_MEMORY_BYTES_PER_PIXEL", 4.0))
+NVCF_MEMORY_DEFAULT_PIXELS = int(os.getenv("NVCF_MEMORY_DEFAULT_PIXELS", 1024 * 1024))
+NVCF_MEMORY_ROUTE_FACTORS = os.getenv("NVCF_MEMORY_ROUTE_FACTORS", '{"faceswap_ip": 2.0}')
+# Seconds a queued task of each class is handicapped by, waiting longer than the difference lets it overtake
+NVCF_PRIORITY_AGING_SECONDS_STANDARD = float(os.getenv("NVCF_PRIORITY_AGING_SECONDS_STANDARD", 5.0))
+NVCF_PRIORITY_AGING_SECONDS_BULK = float(os.getenv("NVCF_PRIORITY_AGING_SECONDS_BULK", 30.0))
+# Client side rate governor, submissions are delayed locally instead of failing on 429s. The rates adapt with
+# AIMD: they grow by the additive increase on every accepted submission and shrink on every throttle
+NVCF_ACCOUNT_RATE_LIMIT_PER_SECOND = float(os.getenv("NVCF_ACCOUNT_RATE_LIMIT_PER_SECOND", 50.0))
+NVCF_FUNCTION_RATE_LIMIT_PER_SECOND = float(os.getenv("NVCF_FUNCTION_RATE_LIMIT_PER_SECOND", 20.0))
+NVCF_RATE_LIMIT_MIN_PER_SECOND = float(os.getenv("NVCF_RATE_LIMIT_MIN_PER_SECOND", 0.2))
+NVCF_RATE_LIMIT_MAX_PER_SECOND = float(os.getenv("NVCF_RATE_LIMIT_MAX_PER_SECOND", 100.0))
+NVCF_RATE_LIMIT_ADDITIVE_INCREASE = float(os.getenv("NVCF_RATE_LIMIT_ADDITIVE_INCREASE", 0.1))
+NVCF_RATE_LIMIT_MULTIPLICATIVE_DECREASE = float(
+    os.getenv("NVCF_RATE_LIMIT_MULTIPLICATIVE_DECREASE", 0.5)
+)
+NVCF_RATE_LIMIT_BURST = int(os.getenv("NVCF_RATE_LIMIT_BURST", 5))
+NVCF_RATE_LIMIT_DEFAULT_BACKOFF_SECONDS = float(
+    os.getenv("NVCF_RATE_LIMIT_DEFAULT_BACKOFF_SECONDS", 1.0)
+)
+NVCF_RATE_LIMIT_MAX_RETRIES = int(os.getenv("NVCF_RATE_LIMIT_MAX_RETRIES", 5))
+# Directory (e.g. under /dev/shm) for state shared by the workers of a host: the NVCF tokens and the host wide
+# in-flight counters. Unset keeps all state per worker
+NVCF_SHARED_STATE_DIR = os.getenv("NVCF_SHARED_STATE_DIR")
+# Max NVCF tasks in flight across all the workers of the host, needs NVCF_SHARED_STATE_DIR (0 means unbounded)
+NVCF_HOST_MAX_CONCURRENT_TASKS = int(os.getenv("NVCF_HOST_MAX_CONCURRENT_TASKS", 0))
+# Max estimated bytes of images in flight across all the workers of the host, needs NVCF_SHARED_STATE_DIR (0 means
+# unbounded)
+NVCF_HOST_MAX_INFLIGHT_BYTES = int(os.getenv("NVCF_HOST_MAX_INFLIGHT_BYTES", 0))
+# How often queued tasks re-check host wide capacity that may have been freed by other workers
+NVCF_SHARED_STATE_POLL_SECONDS = float(os.getenv("NVCF_SHARED_STATE_POLL_SECONDS", 0.05))
 NVCF_MAX_POLLING_ATTEMPTS = int(os.getenv("NVCF_MAX_POLLING_ATTEMPTS", 15))
 NVCF_MIN_POLLING_INTERVAL = float(os.getenv("NVCF_MIN_POLLING_INTERVAL", 1.0))
 NVCF_TOKEN_REFRESH_BUFFER_IN_SECONDS = int(
@@ -61,3 +132,79 @@ DO_FACE_INDEX = get_boolean_from_os("DO_FACE_INDEX", False)
 DO_IP_ADAPTER = get_boolean_from_os("DO_IP_ADAPTER", False)
 SEND_NSFW_PARAMS = get_boolean_from_os("SEND_NSFW_PARAMS", False)
 SEND_NSFW_PARAMS_IP = get_boolean_from_os("SEND_NSFW_PARAMS_IP", False)
+# Heavy modules (aioboto3, numpy, PIL, jwt) are imported on first use. When enabled a worker starts importing them
+# in the background right after startup, so the first requests do not pay for them
+WARMUP_HEAVY_IMPORTS = get_boolean_from_os("WARMUP_HEAVY_IMPORTS", default_value=True)
+# Budget for `python -m sample_client_api.import_time_budget`, the time to import sample_client_api.fastapi
+IMPORT_TIME_BUDGET_MS = float(os.getenv("IMPORT_TIME_BUDGET_MS", 1500))
+# Budget for `python -m sample_client_api.result_memory_benchmark`, the peak memory of turning a fulfilled NVCF
+# response into the bytes that are uploaded, as a multiple of the size of the images
+RESULT_MEMORY_BUDGET_RATIO = float(os.getenv("RESULT_MEMORY_BUDGET_RATIO", 3.0))
+# Before a worker reports ready it fetches the NVCF tokens, opens pooled connections to every NVCF endpoint and to
+# S3, so that the first requests it gets are not slowed down by them
+NVCF_WARMUP_ENABLED = get_boolean_from_os("NVCF_WARMUP_ENABLED", default_value=True)
+# Also sends a cheap (non invoking) request for every configured function id, which fails loudly on a wrong id
+NVCF_WARMUP_PROBE_FUNCTIONS = get_boolean_from_os("NVCF_WARMUP_PROBE_FUNCTIONS", default_value=False)
+NVCF_WARMUP_CONNECTIONS_PER_ENDPOINT = int(os.getenv("NVCF_WARMUP_CONNECTIONS_PER_ENDPOINT", 2))
+# A worker reports ready after this long even if the warmup did not finish, so a slow NVCF cannot keep it out
+NVCF_WARMUP_TIMEOUT_SECONDS = float(os.getenv("NVCF_WARMUP_TIMEOUT_SECONDS", 30))
+# How long idle pooled connections to NVCF are kept open, warmed up connections are useless once they are closed
+NVCF_KEEPALIVE_SECONDS = float(os.getenv("NVCF_KEEPALIVE_SECONDS", 60))
+# In memory cache of the S3 images sent to NVCF as inputs: the originals and their encoded (resized) variants have
+# separate byte budgets. A cached object is trusted for NVCF_INPUT_CACHE_REVALIDATE_SECONDS before its ETag is
+# checked again, and everything derived from it is dropped when the ETag changed
+NVCF_INPUT_CACHE_BYTES = int(os.getenv("NVCF_INPUT_CACHE_BYTES", 256 * 1024 * 1024))
+NVCF_INPUT_VARIANT_CACHE_BYTES = int(os.getenv("NVCF_INPUT_VARIANT_CACHE_BYTES", 128 * 1024 * 1024))
+NVCF_INPUT_CACHE_REVALIDATE_SECONDS = float(os.getenv("NVCF_INPUT_CACHE_REVALIDATE_SECONDS", 60))
+NVCF_INPUT_CACHE_MAX_OBJECTS = int(os.getenv("NVCF_INPUT_CACHE_MAX_OBJECTS", 10000))
+# Seconds a request may take when the caller sets no timeout (field timeout_seconds or header
+# X-Request-Timeout-Seconds), 0 means requests never give up on their own
+NVCF_DEFAULT_REQUEST_TIMEOUT_SECONDS = float(os.getenv("NVCF_DEFAULT_REQUEST_TIMEOUT_SECONDS", 0))
+# Longest NVCF-POLL-SECONDS a task long polls with (NVCF accepts 0-300), the latency model picks shorter ones
+NVCF_MAX_POLL_SECONDS = int(os.getenv("NVCF_MAX_POLL_SECONDS", 60))
+# Latency statistics per function_id and work size (steps x pixels) that choose the long poll, the first poll delay
+# and the timeout of every task. Persisted to NVCF_LATENCY_MODEL_PATH (when set) across restarts
+NVCF_LATENCY_MODEL_PATH = os.getenv("NVCF_LATENCY_MODEL_PATH")
+NVCF_LATENCY_MODEL_SAVE_SECONDS = float(os.getenv("NVCF_LATENCY_MODEL_SAVE_SECONDS", 60))
+NVCF_LATENCY_EWMA_ALPHA = float(os.getenv("NVCF_LATENCY_EWMA_ALPHA", 0.1))
+# Samples needed before the statistics of a work size are trusted
+NVCF_LATENCY_MIN_SAMPLES = int(os.getenv("NVCF_LATENCY_MIN_SAMPLES", 5))
+# The long poll covers mean + this many standard deviations
+NVCF_LATENCY_POLL_STDDEVS = float(os.getenv("NVCF_LATENCY_POLL_STDDEVS", 2.0))
+# A task is given up on after NVCF_LATENCY_TIMEOUT_FACTOR x (mean + NVCF_LATENCY_TIMEOUT_STDDEVS standard deviations),
+# but never before NVCF_LATENCY_MIN_TIMEOUT_SECONDS
+NVCF_LATENCY_TIMEOUT_STDDEVS = float(os.getenv("NVCF_LATENCY_TIMEOUT_STDDEVS", 4.0))
+NVCF_LATENCY_TIMEOUT_FACTOR = float(os.getenv("NVCF_LATENCY_TIMEOUT_FACTOR", 2.0))
+NVCF_LATENCY_MIN_TIMEOUT_SECONDS = float(os.getenv("NVCF_LATENCY_MIN_TIMEOUT_SECONDS", 30))
+# Inpaint masks are thresholded into a binary mask (pixels >= NVCF_INPAINT_MASK_THRESHOLD are painted over), inverted
+# when the painted region is black in the uploaded masks, grown by NVCF_INPAINT_MASK_DILATE_PIXELS and softened over
+# NVCF_INPAINT_MASK_FEATHER_PIXELS. Unfeathered masks are uploaded as 1-bit PNGs, feathered ones as 8-bit PNGs
+NVCF_INPAINT_MASK_THRESHOLD = int(os.getenv("NVCF_INPAINT_MASK_THRESHOLD", 128))
+NVCF_INPAINT_MASK_INVERT = get_boolean_from_os("NVCF_INPAINT_MASK_INVERT", False)
+NVCF_INPAINT_MASK_DILATE_PIXELS = int(os.getenv("NVCF_INPAINT_MASK_DILATE_PIXELS", 0))
+NVCF_INPAINT_MASK_FEATHER_PIXELS = int(os.getenv("NVCF_INPAINT_MASK_FEATHER_PIXELS", 0))
+# Per function encoding of the input images uploaded as NVCF assets, as JSON keyed by function id (or "default"),
+# e.g. {"default": {"format": "JPEG", "quality": 90, "max_bytes": 1048576}}. Inputs of functions without a policy are
+# uploaded in their original format. Lossy formats step the quality down to NVCF_UPLOAD_MIN_QUALITY to fit max_bytes
+NVCF_UPLOAD_ENCODING_POLICIES = os.getenv("NVCF_UPLOAD_ENCODING_POLICIES")
+NVCF_UPLOAD_QUALITY = int(os.getenv("NVCF_UPLOAD_QUALITY", 90))
+NVCF_UPLOAD_MIN_QUALITY = int(os.getenv("NVCF_UPLOAD_MIN_QUALITY", 50))
+# Extra versions of every generated image uploaded next to it in response_mode S3, as a JSON list, e.g.
+# [{"name": "thumb", "format": "WEBP", "max_size": 256}, {"name": "avif", "format": "AVIF", "quality": 60}].
+# Encoded by NVCF_OUTPUT_DERIVATIVE_WORKERS threads while the image itself is uploaded, AVIF needs pillow-avif-plugin
+NVCF_OUTPUT_DERIVATIVES = os.getenv("NVCF_OUTPUT_DERIVATIVES")
+NVCF_OUTPUT_DERIVATIVE_WORKERS = int(os.getenv("NVCF_OUTPUT_DERIVATIVE_WORKERS", 4))
+NVCF_OUTPUT_DERIVATIVE_QUALITY = int(os.getenv("NVCF_OUTPUT_DERIVATIVE_QUALITY", 85))
+# Where the spans of every request stage go: "none", "otel" (the opentelemetry SDK the deployment set up, e.g. with
+# opentelemetry-instrument), "memory" (the latest TRACING_MEMORY_MAX_SPANS spans at GET /traces) or "file" (JSON
+# lines appended to TRACING_FILE_PATH)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_MEMORY_MAX_SPANS = int(os.getenv("TRACING_MEMORY_MAX_SPANS", 10000))
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "spans.jsonl")
+# SQLite file the workers of a host journal their NVCF tasks to at every state change (req_id, assets, output target).
+# A starting worker resumes the tasks of workers that died, stores their results and deletes the assets they left
+# behind, tasks older than NVCF_TASK_JOURNAL_MAX_AGE_SECONDS only get their assets deleted. Unset disables the journal
+NVCF_TASK_JOURNAL_PATH = os.getenv("NVCF_TASK_JOURNAL_PATH")
+NVCF_TASK_JOURNAL_MAX_AGE_SECONDS = float(os.getenv("NVCF_TASK_JOURNAL_MAX_AGE_SECONDS", 3600))
+# Service that `python -m sample_client_api.traffic_replay` sends the recorded requests to
+TRAFFIC_REPLAY_URL = os.getenv("TRAFFIC_REPLAY_URL", "http://localhost:8000")
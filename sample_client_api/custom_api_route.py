@@ -1,9 +1,20 @@
+import asyncio
+from collections import Counter
 from fastapi import Request
 from fastapi.routing import APIRoute
 from starlette.datastructures import Headers
+from starlette.requests import ClientDisconnect
 from starlette.responses import Response
 from typing import Any, Callable, Coroutine
 
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.tracing import span
+
+logger = get_logger_for_file(__name__)
+
+# Requests whose work was cancelled because the client went away, by route path
+CLIENT_DISCONNECT_CANCELLATIONS: Counter = Counter()
+
 
 def always_json_parsing_adjustment(request: Request):
     # Changes in FastAPI 0.65.3 only interpret the body of a request as JSON if
@@ -27,6 +38,54 @@ class CustomFastAPIRouter(APIRoute):
         async def custom_route_handler(request: Request):
             # Manage the content-type header for backward compatibility
             always_json_parsing_adjustment(request)
-            return await original_route_handler(request)
+            # Logged by the LoggingMiddleware, which shares the request state, so logged requests can be replayed
+            request.state.payload = await request.body()
+            with span("route", {"http.method": request.method, "http.route": self.path}):
+                return await original_route_handler(request)
 
         return custom_route_handler
+
+
+async def wait_for_client_disconnect(request: Request) -> bool:
+    try:
+        # Once the body has been read, the only message left for the request is the disconnect
+        while True:
+            message = await request.receive()
+            if message["type"] == "http.disconnect":
+                return True
+    except Exception as e:
+        # The receive of BaseHTTPMiddleware can fail while being cancelled, which only means we stopped listening
+        logger.debug(f"Stopped listening for the client disconnect due to {e!r}")
+        return False
+
+
+class DisconnectCancellingAPIRoute(CustomFastAPIRouter):
+    """
+    Cancels the work behind a request as soon as its client disconnects, instead of finishing it for nobody
+    """
+
+    def get_route_handler(self) -> Callable[[Request], Coroutine[Any, Any, Response]]:
+        route_handler = super().get_route_handler()
+
+        async def disconnect_cancelling_route_handler(request: Request):
+            # Read the body before listening for the disconnect, which would otherwise swallow it
+            await request.body()
+            handler = asyncio.ensure_future(route_handler(request))
+            disconnect = asyncio.ensure_future(wait_for_client_disconnect(request))
+            try:
+                await asyncio.wait({handler, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+                if not handler.done() and disconnect.result():
+                    CLIENT_DISCONNECT_CANCELLATIONS[self.path] += 1
+                    logger.info(f"Cancelling {request.method} {request.url.path} after the client disconnected")
+                    handler.cancel()
+                    # Lets the cancelled work run its cleanup (assets, slots, uploads) before moving on
+                    await asyncio.wait({handler})
+                    raise ClientDisconnect()
+                return await handler
+            finally:
+                disconnect.cancel()
+                if not handler.done():
+                    handler.cancel()
+                    await asyncio.wait({handler})
+
+        return disconnect_cancelling_route_handler
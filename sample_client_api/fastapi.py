@@ -1,7 +1,9 @@
 from datetime import datetime
 
 from fastapi import FastAPI
+from starlette import status
 from starlette.middleware import Middleware
+from starlette.responses import JSONResponse
 from sample_client_api.log_handling import get_logger_for_file
 from sample_client_api import config
 from sample_client_api.api.nvidia_dispatcher import nvidia_dispatcher
@@ -33,7 +35,10 @@ def get_basic_fastapi_app() -> FastAPI:
     logger.info("Startup objects initialized ...")
     fast_app = FastAPI(**opts)
     logger.info("FastAPI is up and running ...")
-    log_environment_configs()
+    # Kept out of the import path, so importing the app (and forking workers) stays fast
+    fast_app.add_event_handler(event_type="startup", func=log_environment_configs)
+    fast_app.add_event_handler(event_type="startup",
+                               func=IMMUTABLE_BOOTUP_MANAGER.perform_startup)
     fast_app.add_event_handler(event_type="shutdown",
                                func=IMMUTABLE_BOOTUP_MANAGER.perform_shutdown)
     return fast_app
@@ -60,3 +65,14 @@ async def health_check():
         "now": datetime.utcnow(),
         "service": "nvidia-picasso",
     }
+
+
+@app.get("/ready")
+async def readiness_check():
+    readiness = {
+        "ready": IMMUTABLE_BOOTUP_MANAGER.ready,
+        "warmup": IMMUTABLE_BOOTUP_MANAGER.warmup,
+    }
+    if not IMMUTABLE_BOOTUP_MANAGER.ready:
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=readiness)
+    return readiness
@@ -0,0 +1,72 @@
+"""
+Measures how long importing the app takes in a fresh interpreter and fails when it goes over the budget or when one
+of the lazily imported heavy modules gets imported eagerly again, e.g.
+python -m sample_client_api.import_time_budget --runs 5 --budget-ms 1500
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from sample_client_api import config
+from sample_client_api.bootup.lazy_imports import HEAVY_MODULES
+
+APP_MODULE = "sample_client_api.fastapi"
+
+
+def measure_import_times(module: str) -> Dict[str, Tuple[int, int]]:
+    # Maps every imported module to its (self, cumulative) import time in microseconds
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{completed.stderr}")
+
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative_time, name = line[len("import time:"):].split("|")
+        import_times[name.strip()] = (int(self_time), int(cumulative_time))
+    return import_times
+
+
+def is_eagerly_imported(import_times: Dict[str, Tuple[int, int]], module: str) -> bool:
+    return module in import_times
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default=APP_MODULE)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=config.IMPORT_TIME_BUDGET_MS)
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest modules to print")
+    args = parser.parse_args(argv)
+
+    runs = [measure_import_times(args.module) for _ in range(args.runs)]
+    # The median is less sensitive to a cold disk cache on the first run
+    total_ms = statistics.median(run[args.module][1] for run in runs) / 1000
+    slowest = sorted(runs[-1].items(), key=lambda item: item[1][0], reverse=True)[: args.top]
+
+    print(f"Slowest modules by self time while importing {args.module}:")
+    for name, (self_time, cumulative_time) in slowest:
+        print(f"{self_time / 1000:10.1f}ms {cumulative_time / 1000:10.1f}ms  {name}")
+    print(f"Median import time over {args.runs} runs: {total_ms:.1f}ms (budget {args.budget_ms:.1f}ms)")
+
+    failures = [
+        f"{module} is imported eagerly, it should only be imported on first use"
+        for module in HEAVY_MODULES
+        if is_eagerly_imported(runs[-1], module)
+    ]
+    if total_ms > args.budget_ms:
+        failures.append(f"Import time {total_ms:.1f}ms is over the budget of {args.budget_ms:.1f}ms")
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -24,6 +24,8 @@ def get_stats_json(
     # Place the necessary stats into the logs as a JSON object, avoid the base route on the app
     stats_json = {
         "path": f"{request.method}-{request.url.path}",
+        # Lets sample_client_api.traffic_replay send the logged requests again at their original times
+        "start_time": start_time,
         "payload": payload,
         "run_time": run_time,
         "headers": request.headers.items(),
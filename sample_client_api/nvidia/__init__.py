@@ -1 +1,5 @@
 MIME_JPEG_CONTENT_TYPE = "image/jpeg"
+MIME_PNG_CONTENT_TYPE = "image/png"
+MIME_WEBP_CONTENT_TYPE = "image/webp"
+# Pillow formats without an alpha channel
+OPAQUE_FORMATS = {"JPEG"}
@@ -1,12 +1,18 @@
 import asyncio
 import json
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Union
 
 import aiohttp
 from sample_client_api.log_handling import get_logger_for_file
 
 from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest, AssetLoader
+from sample_client_api.nvidia.nvidia_task_journal import (
+    NOOP_JOURNAL_ENTRY,
+    NoopJournalEntry,
+    NvidiaJournalEntry,
+)
 from sample_client_api.nvidia.nvidia_token_manager import NvidiaAuthTokenManager
+from sample_client_api.tracing import span
 
 logger = get_logger_for_file(__name__)
 
@@ -39,10 +45,9 @@ def is_response_status_valid(response: aiohttp.ClientResponse) -> bool:
 
 
 class NvidiaAssetClient:
-    def __init__(self, token_manager: NvidiaAuthTokenManager, endpoint: str):
+    def __init__(self, token_manager: NvidiaAuthTokenManager):
         logger.info("Initializing NvidiaAssetClient...")
         self.token_manager = token_manager
-        self.endpoint = endpoint
 
     async def upload_asset(
         self,
@@ -51,9 +56,12 @@ class NvidiaAssetClient:
         token: str,
         field_name: str,
         data: Dict[str, Any],
+        endpoint: str,
+        journal_entry: Union[NvidiaJournalEntry, NoopJournalEntry] = NOOP_JOURNAL_ENTRY,
     ) -> str:
-        with await asset_loader() as asset:
-            url = f"{self.endpoint}/assets"
+        with span("nvcf.asset", {"nvcf.asset.field": field_name}) as asset_span, await asset_loader() as asset:
+            asset_span.set_attribute("bytes", asset.content_length)
+            url = f"{endpoint}/assets"
             request = session.post(
                 url,
                 headers={
@@ -69,15 +77,19 @@ class NvidiaAssetClient:
                 ),
             )
 
-            async with request as response:
-                if not is_response_status_valid(response):
-                    raise NvidiaAssetCreationException(
-                        field_name, response.status, await response.text(), url
-                    )
+            with span("nvcf.asset.create"):
+                async with request as response:
+                    if not is_response_status_valid(response):
+                        raise NvidiaAssetCreationException(
+                            field_name, response.status, await response.text(), url
+                        )
 
-                res_json = await response.json()
+                    res_json = await response.json()
 
             asset_id: str = res_json["assetId"]
+            # Journaled before the upload, so the asset is deleted after a restart even when the upload never finished
+            journal_entry.add_asset(asset_id)
+            asset_span.set_attribute("nvcf.asset_id", asset_id)
             url = res_json["uploadUrl"]
 
             headers = {
@@ -86,15 +98,18 @@ class NvidiaAssetClient:
                 "Content-Length": str(asset.content_length),
             }
 
-            async with session.put(
-                url,
-                headers=headers,
-                data=asset.data,
-            ) as response:
-                if not is_response_status_valid(response):
-                    raise NvidiaAssetUploadException(
-                        asset_id, response.status, await response.text(), url
-                    )
+            # getvalue hands over the buffer the asset was built from without a copy, aiohttp then sends it in one
+            # write instead of reading it back in small chunks
+            with span("nvcf.asset.put", {"nvcf.asset_id": asset_id, "bytes": asset.content_length}):
+                async with session.put(
+                    url,
+                    headers=headers,
+                    data=asset.data.getvalue(),
+                ) as response:
+                    if not is_response_status_valid(response):
+                        raise NvidiaAssetUploadException(
+                            asset_id, response.status, await response.text(), url
+                        )
 
             data["inputs"].append(
                 {
@@ -108,28 +123,33 @@ class NvidiaAssetClient:
             return asset_id
 
     async def delete_asset(
-        self, session: aiohttp.ClientSession, asset_id: str, token: str
+        self, session: aiohttp.ClientSession, asset_id: str, token: str, endpoint: str
     ):
         logger.info(f"Deleting asset {asset_id}")
-        url = f"{self.endpoint}/assets/{asset_id}"
+        url = f"{endpoint}/assets/{asset_id}"
 
-        async with session.delete(
-            url,
-            headers={"Authorization": f"Bearer {token}"},
-        ) as response:
-            if not is_response_status_valid(response):
-                raise NvidiaAssetDeleteException(
-                    asset_id, response.status, await response.text(), url
-                )
+        with span("nvcf.asset.delete", {"nvcf.asset_id": asset_id}):
+            async with session.delete(
+                url,
+                headers={"Authorization": f"Bearer {token}"},
+            ) as response:
+                if not is_response_status_valid(response):
+                    raise NvidiaAssetDeleteException(
+                        asset_id, response.status, await response.text(), url
+                    )
 
     async def cleanup_assets(
-        self, session: aiohttp.ClientSession, assets: List[str], token: str
+        self,
+        session: aiohttp.ClientSession,
+        assets: List[str],
+        token: str,
+        endpoint: str,
     ):
         if len(assets) <= 0:
             return
 
         await asyncio.gather(
-            *[self.delete_asset(session, asset, token) for asset in assets]
+            *[self.delete_asset(session, asset, token, endpoint) for asset in assets]
         )
 
     async def handle_assets(
@@ -138,7 +158,9 @@ class NvidiaAssetClient:
         nvidia_request: NvidiaRequest,
         token: str,
         data: Dict[str, Any],
-        headers: Dict[str, str]
+        headers: Dict[str, str],
+        endpoint: str,
+        journal_entry: Union[NvidiaJournalEntry, NoopJournalEntry] = NOOP_JOURNAL_ENTRY,
     ) -> Tuple[List[str], Dict[str, Any], Dict[str, str]]:
         tasks = [
             self.upload_asset(
@@ -147,6 +169,8 @@ class NvidiaAssetClient:
                 token,
                 field,
                 data,
+                endpoint,
+                journal_entry,
             )
             for field, image in nvidia_request.assets.items()
             if image is not None
@@ -0,0 +1,57 @@
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from sample_client_api import config
+
+# Relative budget of a request in seconds, counted from when the API received it
+REQUEST_TIMEOUT_HEADER = "X-Request-Timeout-Seconds"
+
+# Set per request by the API, so the deadline holds across every NVCF call a request makes
+REQUEST_ARRIVAL_TIME: ContextVar[Optional[float]] = ContextVar("request_arrival_time", default=None)
+REQUEST_HEADER_TIMEOUT: ContextVar[Optional[float]] = ContextVar("request_header_timeout", default=None)
+
+
+class NvidiaDeadlineExceededException(Exception):
+    def __init__(self, task_id: str, stage: str, deadline: float):
+        self.task_id = task_id
+        self.stage = stage
+        message = f"Task {task_id} ran out of time {time.time() - deadline:.2f}s past its deadline while {stage}"
+        super().__init__(message)
+
+
+def request_deadline(timeout_seconds: Optional[float] = None) -> Optional[float]:
+    # The tightest of the field, the header and the configured default wins
+    timeouts = [
+        timeout
+        for timeout in (
+            timeout_seconds,
+            REQUEST_HEADER_TIMEOUT.get(),
+            config.NVCF_DEFAULT_REQUEST_TIMEOUT_SECONDS,
+        )
+        if timeout
+    ]
+    if not timeouts:
+        return None
+    arrival_time = REQUEST_ARRIVAL_TIME.get() or time.time()
+    return arrival_time + min(timeouts)
+
+
+def remaining_seconds(deadline: Optional[float]) -> Optional[float]:
+    if deadline is None:
+        return None
+    return deadline - time.time()
+
+
+def check_deadline(deadline: Optional[float], task_id: str, stage: str):
+    remaining = remaining_seconds(deadline)
+    if remaining is not None and remaining <= 0:
+        raise NvidiaDeadlineExceededException(task_id, stage, deadline)
+
+
+def poll_seconds(deadline: Optional[float], max_poll_seconds: int) -> str:
+    # NVCF holds a long poll for up to this many seconds, which must not outlive the caller
+    remaining = remaining_seconds(deadline)
+    if remaining is None:
+        return str(max_poll_seconds)
+    return str(max(0, min(max_poll_seconds, int(remaining))))
@@ -0,0 +1,102 @@
+import asyncio
+import random
+from typing import Optional, List, Dict, Any
+
+import aiohttp
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.client.nvidia_exceptions import (
+    NvidiaImageGenerationClientException,
+)
+from sample_client_api.nvidia.client.nvidia_response_handler import (
+    NvidiaPollTimeoutException,
+)
+
+logger = get_logger_for_file(__name__)
+
+# How much a fully failing endpoint is penalized relative to its observed latency
+NVIDIA_ENDPOINT_ERROR_PENALTY = 4.0
+
+
+def is_endpoint_failure(exception: Exception) -> bool:
+    # Only failures that say something about the endpoint count, not rejected prompts or bad requests
+    if isinstance(
+        exception,
+        (aiohttp.ClientError, asyncio.TimeoutError, NvidiaPollTimeoutException),
+    ):
+        return True
+    return (
+        isinstance(exception, NvidiaImageGenerationClientException)
+        and exception.status is not None
+        and exception.status >= 500
+    )
+
+
+class NvidiaEndpoint:
+    def __init__(self, nvcf_url: str):
+        self.nvcf_url = nvcf_url.rstrip("/")
+        self.endpoint = f"{self.nvcf_url}/v2/nvcf"
+        self.latency_ewma: Optional[float] = None
+        self.error_rate = 0.0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+
+    def is_measured(self) -> bool:
+        return self.completed > 0 or self.failed > 0
+
+    def score(self, default_latency: float) -> float:
+        latency = self.latency_ewma if self.latency_ewma is not None else default_latency
+        return latency * (1 + NVIDIA_ENDPOINT_ERROR_PENALTY * self.error_rate)
+
+    def record_success(self, latency: float):
+        alpha = config.NVCF_ENDPOINT_EWMA_ALPHA
+        if self.latency_ewma is None:
+            self.latency_ewma = latency
+        else:
+            self.latency_ewma = (1 - alpha) * self.latency_ewma + alpha * latency
+        self.error_rate = (1 - alpha) * self.error_rate
+        self.completed += 1
+
+    def record_failure(self):
+        alpha = config.NVCF_ENDPOINT_EWMA_ALPHA
+        self.error_rate = (1 - alpha) * self.error_rate + alpha
+        self.failed += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "nvcf_url": self.nvcf_url,
+            "latency_ewma": self.latency_ewma,
+            "error_rate": self.error_rate,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "failed": self.failed,
+        }
+
+
+class NvidiaEndpointRouter:
+    def __init__(self, nvcf_urls: List[str]):
+        if len(nvcf_urls) == 0:
+            raise ValueError("NvidiaEndpointRouter needs at least one NVCF url")
+        self.endpoints = [NvidiaEndpoint(nvcf_url) for nvcf_url in nvcf_urls]
+
+    def choose(self) -> NvidiaEndpoint:
+        if len(self.endpoints) == 1:
+            return self.endpoints[0]
+
+        # Endpoints without a measurement yet are tried first so every region gets a latency estimate
+        unmeasured = [endpoint for endpoint in self.endpoints if not endpoint.is_measured()]
+        if unmeasured:
+            return min(unmeasured, key=lambda endpoint: endpoint.in_flight)
+
+        if random.random() < config.NVCF_ENDPOINT_EXPLORATION_RATE:
+            return random.choice(self.endpoints)
+        # Endpoints that only ever failed have no latency yet, they count as slow as the slowest measured one
+        slowest = max(
+            (endpoint.latency_ewma for endpoint in self.endpoints if endpoint.latency_ewma is not None), default=1.0
+        )
+        return min(self.endpoints, key=lambda endpoint: endpoint.score(slowest))
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [endpoint.stats() for endpoint in self.endpoints]
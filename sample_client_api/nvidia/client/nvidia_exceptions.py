@@ -1,4 +1,14 @@
+from starlette import status
+
 from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest
+from sample_client_api.nvidia.nvidia_token_manager import NvidiaTokenException
+
+# Statuses that mean the account itself is the problem, not the request
+NVIDIA_ACCOUNT_DRAIN_STATUSES = {
+    status.HTTP_401_UNAUTHORIZED,
+    status.HTTP_403_FORBIDDEN,
+    status.HTTP_429_TOO_MANY_REQUESTS,
+}
 
 
 class NvidiaImageGenerationClientException(Exception):
@@ -14,6 +24,7 @@ class NvidiaImageGenerationClientException(Exception):
         self.nvidia_request = nvidia_request
         self.task_id = task_id
         self.url = url
+        self.status = status
         message = f"Failed request: {task_id}: {nvidia_request} to {url} with response: {text}, status_code: {status}"
         if custom_msg is not None:
             message = f"{message} and {custom_msg}"
@@ -104,3 +115,12 @@ class NvidiaPostClientException(NvidiaImageGenerationClientException):
     ):
         message = f" payload : {payload}"
         super().__init__(nvidia_request, task_id, url, status, text, message)
+
+
+def should_drain_account(exception: Exception) -> bool:
+    if isinstance(exception, NvidiaTokenException):
+        return True
+    return (
+        isinstance(exception, NvidiaImageGenerationClientException)
+        and exception.status in NVIDIA_ACCOUNT_DRAIN_STATUSES
+    )
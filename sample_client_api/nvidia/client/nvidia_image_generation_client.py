@@ -1,7 +1,8 @@
+import asyncio
 import json
 import time
 from enum import unique, Enum
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, List, Tuple, Union
 
 import aiohttp
 from aiohttp import ClientResponse
@@ -13,6 +14,21 @@ from sample_client_api.nvidia.client.nvidia_asset_client import (
     NvidiaAssetClient,
     is_response_status_valid,
 )
+from sample_client_api.nvidia.client.nvidia_deadline import (
+    NvidiaDeadlineExceededException,
+    check_deadline,
+    poll_seconds,
+    remaining_seconds,
+)
+from sample_client_api.nvidia.client.nvidia_latency_model import (
+    NvidiaLatencyModel,
+    NvidiaPollPlan,
+)
+from sample_client_api.nvidia.client.nvidia_endpoint_router import (
+    NvidiaEndpoint,
+    NvidiaEndpointRouter,
+    is_endpoint_failure,
+)
 from sample_client_api.nvidia.client.nvidia_exceptions import (
     NvidiaPollException,
     NSFWRejectionException,
@@ -21,6 +37,11 @@ from sample_client_api.nvidia.client.nvidia_exceptions import (
     NSFWRejectionFaceswapException,
     NSFWRejectionSDXLException,
     NvidiaOOMException,
+    should_drain_account,
+)
+from sample_client_api.nvidia.client.nvidia_rate_governor import (
+    NvidiaRateGovernor,
+    parse_retry_after,
 )
 from sample_client_api.nvidia.client.nvidia_request import (
     NvidiaRequest,
@@ -32,9 +53,17 @@ from sample_client_api.nvidia.client.nvidia_response_handler import (
     explicitly_sleep_for_minimum_polling_interval,
     handle_fulfilled_response,
 )
+from sample_client_api.nvidia.nvidia_shared_state import SharedStateDirectory
+from sample_client_api.nvidia.nvidia_task_journal import (
+    NOOP_JOURNAL_ENTRY,
+    NoopJournalEntry,
+    NvidiaJournalEntry,
+    NvidiaJournaledTask,
+    NvidiaTaskJournal,
+    NvidiaTaskState,
+)
 from sample_client_api.nvidia.nvidia_token_manager import NvidiaAuthConfig, NvidiaAuthTokenManager
-
-NVCF_POLL_SECONDS = "60"  # valid range is 0-300 seconds
+from sample_client_api.tracing import span
 
 logger = get_logger_for_file(__name__)
 
@@ -114,102 +143,203 @@ def process_parameter(name: str, parameter: Any) -> Dict[str, Any]:
     }
 
 
+def request_data(nvidia_request: NvidiaRequest) -> Dict[str, Any]:
+    nvcf_function_inputs = nvidia_request.parameters
+    data = {
+        "inputs": [
+            process_parameter(name, parameter)
+            for name, parameter in nvcf_function_inputs.items()
+            if parameter is not None
+               and (
+                       not isinstance(parameter, NvidiaRequestParameter)
+                       or parameter.value is not None
+               )
+        ],
+        "outputs": [
+            {
+                "name": nvidia_request.image_output_name,
+                "datatype": "BYTES",
+                "shape": [nvidia_request.batch_size],
+            }
+        ],
+    }
+
+    if nvidia_request.profile_output_name:
+        data["outputs"].append(
+            {
+                "name": nvidia_request.profile_output_name,
+                "datatype": "BYTES",
+                "shape": [1],
+            }
+        )
+
+    return data
+
+
 class NvidiaImageGenerationClient:
-    def __init__(self, nvcf_url: str, auth_config: NvidiaAuthConfig):
+    def __init__(
+        self,
+        nvcf_urls: List[str],
+        auth_config: NvidiaAuthConfig,
+        shared_state: Optional[SharedStateDirectory] = None,
+        latency_model: Optional[NvidiaLatencyModel] = None,
+        task_journal: Optional[NvidiaTaskJournal] = None,
+    ):
         logger.info("Initializing NvidiaImageGenerationClient...")
-        self.token_manager = NvidiaAuthTokenManager(auth_config)
-        self.endpoint = f"{nvcf_url}/v2/nvcf"
-        self.asset_handler = NvidiaAssetClient(self.token_manager,
-                                               self.endpoint)
+        self.latency_model = latency_model or NvidiaLatencyModel()
+        self.task_journal = task_journal
+        self.token_manager = NvidiaAuthTokenManager(auth_config, shared_state)
+        self.endpoint_router = NvidiaEndpointRouter(nvcf_urls)
+        self.rate_governor = NvidiaRateGovernor()
+        self.asset_handler = NvidiaAssetClient(self.token_manager)
         self.client_session = aiohttp.ClientSession(
                 connector=aiohttp.TCPConnector(limit=0,
+                                               keepalive_timeout=config.NVCF_KEEPALIVE_SECONDS,
                                                enable_cleanup_closed=True))
 
     async def close(self):
         await self.client_session.close()
 
+    async def warm_up(self, function_ids: List[str]) -> Dict[str, Any]:
+        start_time = time.time()
+        token = await self.token_manager.fetch_token_if_required(self.client_session)
+        headers = {"Authorization": f"Bearer {token}"}
+
+        async def probe(url: str) -> int:
+            async with self.client_session.get(
+                url, headers=headers, allow_redirects=False
+            ) as response:
+                await response.read()  # Hands the connection back to the pool
+                return response.status
+
+        urls = []
+        for endpoint in self.endpoint_router.endpoints:
+            # Sent in parallel, so every endpoint is left with a few open connections to pick from
+            urls.extend(
+                f"{endpoint.endpoint}/functions"
+                for _ in range(config.NVCF_WARMUP_CONNECTIONS_PER_ENDPOINT)
+            )
+            # Listing the versions checks that the function exists without invoking it
+            urls.extend(
+                f"{endpoint.endpoint}/functions/{function_id}/versions"
+                for function_id in function_ids
+            )
+        results = await asyncio.gather(*[probe(url) for url in urls], return_exceptions=True)
+
+        probes = {}
+        for url, result in zip(urls, results):
+            if isinstance(result, Exception):
+                logger.error(f"Warmup request to {url} failed due to {result}")
+                probes[url] = str(result)
+            else:
+                if result >= 400:
+                    logger.error(f"Warmup request to {url} returned {result}")
+                probes[url] = result
+        return {"seconds": time.time() - start_time, "probes": probes}
+
     # Invoke a function
     async def nvidia_post_call(
         self,
         token: str,
         nvidia_request: NvidiaRequest,
         task_id: str,
+        endpoint: NvidiaEndpoint,
+        plan: NvidiaPollPlan,
+        journal_entry: Union[NvidiaJournalEntry, NoopJournalEntry] = NOOP_JOURNAL_ENTRY,
     ) -> Tuple[ClientResponse, List[str]]:
         headers = {
             "Content-Type": "application/json",
             "Authorization": f"Bearer {token}",
-            "NVCF-POLL-SECONDS": NVCF_POLL_SECONDS,
         }
+        data = request_data(nvidia_request)
 
-        nvidia_function = nvidia_request.function_id
-        nvcf_function_inputs = nvidia_request.parameters
-        data = {
-            "inputs": [
-                process_parameter(name, parameter)
-                for name, parameter in nvcf_function_inputs.items()
-                if parameter is not None
-                   and (
-                           not isinstance(parameter, NvidiaRequestParameter)
-                           or parameter.value is not None
-                   )
-            ],
-            "outputs": [
-                {
-                    "name": nvidia_request.image_output_name,
-                    "datatype": "BYTES",
-                    "shape": [1],
-                }
-            ],
-        }
-
-        if nvidia_request.profile_output_name:
-            data["outputs"].append(
-                {
-                    "name": nvidia_request.profile_output_name,
-                    "datatype": "BYTES",
-                    "shape": [1],
-                }
-            )
-
+        # Nobody waits for the answer anymore, so do not spend uploads (or NVCF capacity) on it
+        check_deadline(nvidia_request.deadline, task_id, "uploading assets")
         assets, data, headers = await self.asset_handler.handle_assets(
-            self.client_session, nvidia_request, token, data, headers
+            self.client_session, nvidia_request, token, data, headers, endpoint.endpoint, journal_entry
         )
 
         try:
-            payload = json.dumps(data)
-            post_url = f"{self.endpoint}/pexec/functions/{nvidia_function}"
-            logger.info(f"Sending {task_id} to {post_url} with payload: {payload}")
-            async with self.client_session.post(
-                post_url,
-                headers=headers,
-                data=payload,
-            ) as response:
-                if not is_response_status_valid(response) and response.status != 302:
-                    exception_reason = await response.text()
-                    check_custom_exception_reasons(
-                        nvidia_request, task_id, response.status, exception_reason
-                    )
-                    raise NvidiaPostClientException(
-                        nvidia_request,
-                        task_id,
-                        post_url,
-                        response.status,
-                        exception_reason,
-                        payload,
-                    )
-
-                await response.read()  # Load body as to not need the connection to stay alive
-
-                return response, assets
-        except Exception as e:
-            # If we fail, handle cleaning assets before returning
-            await self.asset_handler.cleanup_assets(self.client_session, assets, token)
+            return await self.invoke(headers, data, nvidia_request, task_id, endpoint, plan), assets
+        except BaseException as e:
+            # If we fail or get cancelled (e.g. the client went away), handle cleaning assets before returning
+            await self.asset_handler.cleanup_assets(
+                self.client_session, assets, token, endpoint.endpoint
+            )
+            journal_entry.remove_assets()
             raise e
 
+    async def invoke(
+        self,
+        headers: Dict[str, str],
+        data: Dict[str, Any],
+        nvidia_request: NvidiaRequest,
+        task_id: str,
+        endpoint: NvidiaEndpoint,
+        plan: NvidiaPollPlan,
+    ) -> ClientResponse:
+        nvidia_function = nvidia_request.function_id
+        payload = json.dumps(data)
+        post_url = f"{endpoint.endpoint}/pexec/functions/{nvidia_function}"
+        logger.info(f"Sending {task_id} to {post_url} with payload: {payload}")
+        attempt = 0
+        while True:
+            await self.rate_governor.acquire(nvidia_function, task_id)
+            check_deadline(nvidia_request.deadline, task_id, "waiting for the rate limit")
+            headers["NVCF-POLL-SECONDS"] = poll_seconds(nvidia_request.deadline, plan.poll_seconds)
+            with span(
+                "nvcf.pexec",
+                {"nvcf.function_id": nvidia_function, "nvcf.endpoint": endpoint.endpoint, "attempt": attempt},
+            ) as pexec_span:
+                async with self.client_session.post(
+                    post_url,
+                    headers=headers,
+                    data=payload,
+                    # Large results come back as a 302 to a zip which handle_fulfilled_response streams itself
+                    allow_redirects=False,
+                ) as response:
+                    pexec_span.set_attribute("http.status_code", response.status)
+                    if (
+                        response.status == 429
+                        and attempt < config.NVCF_RATE_LIMIT_MAX_RETRIES
+                    ):
+                        await response.read()
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        logger.info(
+                            f"{task_id} was throttled by {post_url}, retrying in {retry_after}s"
+                        )
+                        self.rate_governor.on_throttled(nvidia_function, retry_after)
+                        attempt += 1
+                        continue
+
+                    if not is_response_status_valid(response) and response.status != 302:
+                        exception_reason = await response.text()
+                        check_custom_exception_reasons(
+                            nvidia_request, task_id, response.status, exception_reason
+                        )
+                        raise NvidiaPostClientException(
+                            nvidia_request,
+                            task_id,
+                            post_url,
+                            response.status,
+                            exception_reason,
+                            payload,
+                        )
+
+                    if "NVCF-REQID" in response.headers:
+                        pexec_span.set_attribute("nvcf.req_id", response.headers["NVCF-REQID"])
+                    await response.read()  # Load body as to not need the connection to stay alive
+                    self.rate_governor.on_accepted(nvidia_function)
+
+                    return response
+
     async def get_request_status_by_id(
         self,
+        endpoint: NvidiaEndpoint,
         req_id: Optional[str] = None,
         token: Optional[str] = None,
+        deadline: Optional[float] = None,
+        max_poll_seconds: int = config.NVCF_MAX_POLL_SECONDS,
     ) -> ClientResponse:
         if req_id is None:
             raise InvalidNvidiaPollParamsException(
@@ -217,13 +347,18 @@ class NvidiaImageGenerationClient:
             )
         token = await self.token_manager.fetch_token_if_required(self.client_session, token)
         headers = {"Authorization": f"Bearer {token}",
-                   "NVCF-POLL-SECONDS": NVCF_POLL_SECONDS}
-        get_url = f"{self.endpoint}/pexec/status/{req_id}"
+                   "NVCF-POLL-SECONDS": poll_seconds(deadline, max_poll_seconds)}
+        # Polling has to stay on the endpoint that owns the req_id
+        get_url = f"{endpoint.endpoint}/pexec/status/{req_id}"
 
-        async with self.client_session.get(get_url, headers=headers) as response:
-            await response.read()  # may be a 302, which has no json body
+        with span("nvcf.poll", {"nvcf.req_id": req_id, "nvcf.endpoint": endpoint.endpoint}) as poll_span:
+            async with self.client_session.get(
+                get_url, headers=headers, allow_redirects=False
+            ) as response:
+                await response.read()  # may be a 302, which has no json body
+                poll_span.set_attribute("http.status_code", response.status)
 
-            return response
+                return response
 
     async def handle_response(
         self,
@@ -232,30 +367,50 @@ class NvidiaImageGenerationClient:
         task_id: str,
         last_request_time: float,
         token: str,
-    ) -> Tuple[bytes, List[Any]]:
+        endpoint: NvidiaEndpoint,
+        plan: NvidiaPollPlan,
+    ) -> Tuple[List[bytes], List[Any]]:
         num_requests: int = 0  # The number of times we have polled for the request
+        invoked_at = last_request_time
         while num_requests <= config.NVCF_MAX_POLLING_ATTEMPTS:
             if response.status == 200 or response.status == 302:
                 req_id = response.headers.get("NVCF-REQID")
                 logger.info(
                     f"task_id: {task_id} req_id: {req_id} fulfilled in {num_requests} polls"
                 )
+                plan.polls = num_requests
                 # if there is a responseReference, we need to get the image from the URL
-                return await handle_fulfilled_response(
-                        self.client_session, response, nvidia_request, task_id,
-                        req_id
-                )
+                with span(
+                    "nvcf.decode",
+                    {"nvcf.req_id": req_id, "nvcf.function_id": nvidia_request.function_id, "polls": num_requests},
+                ):
+                    return await handle_fulfilled_response(
+                            self.client_session, response, nvidia_request, task_id,
+                            req_id
+                    )
 
             elif response.status == 202:
                 await response.json()  # drain body for connection reuse
                 req_id = response.headers.get("NVCF-REQID")
                 if num_requests >= config.NVCF_MAX_POLLING_ATTEMPTS:
                     raise NvidiaPollTimeoutException(nvidia_request, task_id, req_id)
+                if plan.timeout is not None and time.time() - invoked_at > plan.timeout:
+                    # Far slower than this function has ever been for this much work, so it is most likely stuck
+                    raise NvidiaPollTimeoutException(nvidia_request, task_id, req_id, plan.timeout)
+                if num_requests == 0 and plan.first_poll_delay > config.NVCF_MIN_POLLING_INTERVAL:
+                    first_poll_delay = plan.first_poll_delay
+                    remaining = remaining_seconds(nvidia_request.deadline)
+                    if remaining is not None:
+                        # Waking up at the deadline at the latest, so that it is reported on time
+                        first_poll_delay = max(0.0, min(first_poll_delay, remaining))
+                    logger.info(f"task_id: {task_id} req_id: {req_id} first poll in {first_poll_delay:.1f}s")
+                    await asyncio.sleep(first_poll_delay)
                 await explicitly_sleep_for_minimum_polling_interval(last_request_time)
+                check_deadline(nvidia_request.deadline, task_id, f"polling req_id {req_id}")
                 logger.info(f"task_id: {task_id} req_id: {req_id} still polling")
                 # poll get_req_by_id until status is fulfilled
                 response = await self.get_request_status_by_id(
-                    req_id, token
+                    endpoint, req_id, token, nvidia_request.deadline, plan.poll_seconds
                 )
                 num_requests += 1
                 last_request_time = time.time()
@@ -270,38 +425,224 @@ class NvidiaImageGenerationClient:
 
     async def generate_image(
         self, nvidia_client_request: NvidiaRequest, task_id: str
-    ) -> Optional[Tuple[bytes, List[Any]]]:
+    ) -> Optional[Tuple[List[bytes], List[Any]]]:
         # Get an auth token as Before we make a request, we need to make sure we have a valid auth token
         token = await self.token_manager.fetch_token_if_required(self.client_session)
+        endpoint = self.endpoint_router.choose()
+        plan = self.latency_model.plan(nvidia_client_request)
         start_time_post = time.time()
-        logger.info(f"Sending {task_id} to {self.endpoint} at {start_time_post}")
+        logger.info(f"Sending {task_id} to {endpoint.endpoint} at {start_time_post}")
 
-        # Invoke a function
-        invoke_res, assets = await self.nvidia_post_call(
-            token, nvidia_client_request, task_id
-        )
-        poll_start_time = time.time()
-        response = None
-        reason_for_failure = None
+        endpoint.in_flight += 1
+        journal_entry = self.__start_journal_entry(nvidia_client_request, task_id, endpoint)
         try:
-            response = await self.handle_response(
-                invoke_res,
+            # Invoke a function
+            try:
+                invoke_res, assets = await self.nvidia_post_call(
+                    token, nvidia_client_request, task_id, endpoint, plan, journal_entry
+                )
+            except Exception as e:
+                if is_endpoint_failure(e):
+                    endpoint.record_failure()
+                raise e
+            if invoke_res.status == 202:
+                journal_entry.set_state(NvidiaTaskState.INVOKED, invoke_res.headers.get("NVCF-REQID"))
+
+            poll_start_time = time.time()
+            response = None
+            reason_for_failure = None
+            try:
+                response = await self.handle_response(
+                    invoke_res,
+                    nvidia_client_request,
+                    task_id,
+                    poll_start_time,
+                    token,
+                    endpoint,
+                    plan,
+                )
+                time_image_generation = time.time() - start_time_post
+                endpoint.record_success(time_image_generation)
+                self.latency_model.record(nvidia_client_request, time_image_generation, plan.polls)
+                logger.info(
+                    f"Image generation for {task_id} successful in {time_image_generation} seconds"
+                )
+            except NvidiaDeadlineExceededException as e:
+                logger.info(f"Stopped waiting on {task_id}: {e}")
+                raise e
+            except Exception as e:
+                if is_endpoint_failure(e):
+                    endpoint.record_failure()
+                reason_for_failure = str(e)
+                logger.error(
+                    f"Nvidia call failed for {task_id}: {nvidia_client_request} due to {reason_for_failure}",
+                    exc_info=True,
+                )
+            finally:
+                await self.asset_handler.cleanup_assets(
+                    self.client_session, assets, token, endpoint.endpoint
+                )
+                journal_entry.remove_assets()
+        finally:
+            endpoint.in_flight -= 1
+            journal_entry.finish()
+
+        return response, reason_for_failure
+
+    async def generate_variants(
+        self,
+        nvidia_client_request: NvidiaRequest,
+        task_id: str,
+        variant_parameters: List[Dict[str, Any]],
+        required: int,
+    ) -> Tuple[List[Tuple[int, List[bytes], List[Any]]], Optional[str]]:
+        # Every variant is the request with its own parameters (e.g. seed) on top, invoked with the same assets.
+        # Returns (index, images, outputs) of the first `required` variants that succeeded, in the order they did
+        token = await self.token_manager.fetch_token_if_required(self.client_session)
+        endpoint = self.endpoint_router.choose()
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}",
+        }
+        logger.info(f"Sending {len(variant_parameters)} variants of {task_id} to {endpoint.endpoint}")
+
+        endpoint.in_flight += 1
+        journal_entry = self.__start_journal_entry(nvidia_client_request, task_id, endpoint)
+        assets: List[str] = []
+        try:
+            check_deadline(nvidia_client_request.deadline, task_id, "uploading assets")
+            # Uploaded once, every variant references the same asset ids
+            assets, asset_data, headers = await self.asset_handler.handle_assets(
+                self.client_session,
                 nvidia_client_request,
-                task_id,
-                poll_start_time,
                 token,
+                {"inputs": []},
+                headers,
+                endpoint.endpoint,
+                journal_entry,
             )
-            time_image_generation = time.time() - start_time_post
-            logger.info(
-                f"Image generation for {task_id} successful in {time_image_generation} seconds"
+
+            async def generate_variant(index: int, parameters: Dict[str, Any]) -> Tuple[int, List[bytes], List[Any]]:
+                variant = nvidia_client_request.model_copy(
+                    update={"parameters": {**nvidia_client_request.parameters, **parameters}}
+                )
+                data = request_data(variant)
+                data["inputs"].extend(asset_data["inputs"])
+                plan = self.latency_model.plan(variant)
+                start_time_post = time.time()
+                with span("nvcf.variant", {"task_id": task_id, "variant": index}):
+                    response = await self.invoke(dict(headers), data, variant, task_id, endpoint, plan)
+                    files, outputs = await self.handle_response(
+                        response, variant, task_id, time.time(), token, endpoint, plan
+                    )
+                time_image_generation = time.time() - start_time_post
+                endpoint.record_success(time_image_generation)
+                self.latency_model.record(variant, time_image_generation, plan.polls)
+                return index, files, outputs
+
+            tasks = [
+                asyncio.create_task(generate_variant(index, parameters))
+                for index, parameters in enumerate(variant_parameters)
+            ]
+            pending = set(tasks)
+            results = []
+            failures: List[Exception] = []
+            reason_for_failure = None
+            try:
+                while pending and len(results) < required:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        try:
+                            results.append(task.result())
+                        except NvidiaDeadlineExceededException as e:
+                            logger.info(f"Stopped waiting on {task_id}: {e}")
+                            raise e
+                        except Exception as e:
+                            if is_endpoint_failure(e):
+                                endpoint.record_failure()
+                            failures.append(e)
+                            reason_for_failure = str(e)
+                            logger.error(f"A variant of {task_id} failed due to {reason_for_failure}")
+                    if len(results) + len(pending) < required:
+                        break
+            finally:
+                # First K wins, nobody waits for the rest anymore
+                for task in pending:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+            # Every variant that finished was refused for the account, let the pool drain it and fail over
+            if not results and failures and all(should_drain_account(e) for e in failures):
+                raise failures[-1]
+            if len(results) < required:
+                return [], reason_for_failure
+            logger.info(f"{required} of {len(variant_parameters)} variants of {task_id} done")
+            return results[:required], None
+        finally:
+            try:
+                await self.asset_handler.cleanup_assets(
+                    self.client_session, assets, token, endpoint.endpoint
+                )
+                journal_entry.remove_assets()
+            finally:
+                endpoint.in_flight -= 1
+                journal_entry.finish()
+
+    def __start_journal_entry(
+        self, nvidia_request: NvidiaRequest, task_id: str, endpoint: NvidiaEndpoint
+    ) -> Union[NvidiaJournalEntry, NoopJournalEntry]:
+        if self.task_journal is None:
+            return NOOP_JOURNAL_ENTRY
+        try:
+            return self.task_journal.start(
+                task_id, nvidia_request, self.token_manager.nvidia_auth_config.nvidia_username, endpoint.nvcf_url
             )
         except Exception as e:
-            reason_for_failure = str(e)
-            logger.error(
-                f"Nvidia call failed for {task_id}: {nvidia_client_request} due to {reason_for_failure}",
-                exc_info=True,
+            # The task still runs, it only cannot be recovered if this worker dies
+            logger.error(f"Could not journal {task_id} due to {e!r}")
+            return NOOP_JOURNAL_ENTRY
+
+    def endpoint_for(self, nvcf_url: str) -> NvidiaEndpoint:
+        for endpoint in self.endpoint_router.endpoints:
+            if endpoint.nvcf_url == nvcf_url:
+                return endpoint
+        # The endpoint may have been dropped from the config since, a req_id can only be polled where it was created
+        return NvidiaEndpoint(nvcf_url)
+
+    async def resume_task(
+        self, task: NvidiaJournaledTask
+    ) -> Optional[Tuple[List[bytes], List[Any]]]:
+        # Picks up a task journaled by a worker that died: fetches its result when NVCF may still hold it and
+        # deletes the assets it left behind either way
+        token = await self.token_manager.fetch_token_if_required(self.client_session)
+        endpoint = self.endpoint_for(task.nvcf_url)
+        try:
+            if task.state != NvidiaTaskState.INVOKED or task.req_id is None or task.output is None:
+                return None
+            if time.time() - task.created_at > config.NVCF_TASK_JOURNAL_MAX_AGE_SECONDS:
+                logger.info(f"Not resuming {task.task_id}, req_id {task.req_id} is too old to still have a result")
+                return None
+            nvidia_request = task.nvidia_request()
+            plan = NvidiaPollPlan(
+                poll_seconds=config.NVCF_MAX_POLL_SECONDS,
+                first_poll_delay=config.NVCF_MIN_POLLING_INTERVAL,
+                timeout=None,
+                expected_latency=None,
             )
-
-        await self.asset_handler.cleanup_assets(self.client_session, assets, token)
-
-        return response, reason_for_failure
+            with span("nvcf.resume", {"task_id": task.task_id, "nvcf.req_id": task.req_id}):
+                response = await self.get_request_status_by_id(endpoint, task.req_id, token)
+                return await self.handle_response(
+                    response, nvidia_request, task.task_id, time.time(), token, endpoint, plan
+                )
+        finally:
+            results = await asyncio.gather(
+                *[
+                    self.asset_handler.delete_asset(self.client_session, asset, token, endpoint.endpoint)
+                    for asset in task.assets
+                ],
+                return_exceptions=True,
+            )
+            for asset, result in zip(task.assets, results):
+                # Most likely deleted already, right before the worker died
+                if isinstance(result, Exception):
+                    logger.warning(f"Could not delete asset {asset} of {task.task_id} due to {result}")
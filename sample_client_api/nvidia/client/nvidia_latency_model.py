@@ -0,0 +1,207 @@
+import json
+import math
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest, NvidiaRequestParameter
+
+logger = get_logger_for_file(__name__)
+
+STEP_PARAMETERS = ("steps", "base_steps", "refiner_steps")
+DIMENSION_PARAMETERS = (
+    ("width", "height"),
+    ("desired_width", "desired_height"),
+    ("desired_final_width", "desired_final_height"),
+)
+
+
+def parameter_value(nvidia_request: NvidiaRequest, name: str) -> Optional[float]:
+    value = nvidia_request.parameters.get(name)
+    if isinstance(value, NvidiaRequestParameter):
+        value = value.value
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return None
+    return value
+
+
+def work_units(nvidia_request: NvidiaRequest) -> float:
+    # Diffusion runtime grows roughly with steps x pixels x images, anything missing counts as 1
+    pixels = 1.0
+    for width_name, height_name in DIMENSION_PARAMETERS:
+        width = parameter_value(nvidia_request, width_name)
+        height = parameter_value(nvidia_request, height_name)
+        if width and height:
+            pixels = width * height
+            break
+    steps = sum(parameter_value(nvidia_request, name) or 0 for name in STEP_PARAMETERS) or 1
+    return pixels * steps * max(nvidia_request.batch_size, 1)
+
+
+def work_size_bucket(units: float) -> int:
+    # Buckets double in size, requests within a bucket take about the same time
+    return int(round(math.log2(max(units, 1.0))))
+
+
+class NvidiaLatencyStats:
+    def __init__(self, mean: float = 0.0, variance: float = 0.0, count: int = 0, single_poll: int = 0):
+        self.mean = mean
+        self.variance = variance
+        self.count = count
+        # Tasks that were fulfilled without a single status poll
+        self.single_poll = single_poll
+
+    def record(self, latency: float, polls: int):
+        self.count += 1
+        if polls == 0:
+            self.single_poll += 1
+        if self.count == 1:
+            self.mean = latency
+            return
+        # Exponentially weighted, so a function that got faster (or slower) is picked up quickly
+        alpha = max(config.NVCF_LATENCY_EWMA_ALPHA, 1 / self.count)
+        delta = latency - self.mean
+        self.mean += alpha * delta
+        self.variance = (1 - alpha) * (self.variance + alpha * delta * delta)
+
+    def stddev(self) -> float:
+        return math.sqrt(self.variance)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "mean": self.mean,
+            "variance": self.variance,
+            "count": self.count,
+            "single_poll": self.single_poll,
+        }
+
+
+class NvidiaPollPlan:
+    def __init__(
+        self,
+        poll_seconds: int,
+        first_poll_delay: float,
+        timeout: Optional[float],
+        expected_latency: Optional[float],
+    ):
+        # NVCF-POLL-SECONDS of the invocation and of every status poll
+        self.poll_seconds = poll_seconds
+        # Wait before the first status poll once the invocation returned still pending
+        self.first_poll_delay = first_poll_delay
+        # Seconds after the invocation at which the task is considered stuck, None falls back to the poll attempts
+        self.timeout = timeout
+        self.expected_latency = expected_latency
+        # Status polls the task needed, set once it is fulfilled
+        self.polls = 0
+
+
+class NvidiaLatencyModel:
+    """
+    Online latency statistics per function_id and work size (steps x pixels), which decide how long each task long
+    polls, when it polls first and when it is given up on. Optionally persisted to a JSON file across restarts.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.stats: Dict[Tuple[str, int], NvidiaLatencyStats] = {}
+        self.last_saved = time.time()
+        self.dirty = False
+        if path:
+            self.load()
+
+    def __estimate(self, function_id: str, bucket: int) -> Optional[Tuple[float, float]]:
+        stats = self.stats.get((function_id, bucket))
+        if stats is not None and stats.count >= config.NVCF_LATENCY_MIN_SAMPLES:
+            return stats.mean, stats.stddev()
+
+        # Scale the closest measured work size of the function, latency grows about linearly with the work
+        measured = [
+            (abs(other_bucket - bucket), other_bucket, other_stats)
+            for (other_function_id, other_bucket), other_stats in self.stats.items()
+            if other_function_id == function_id and other_stats.count >= config.NVCF_LATENCY_MIN_SAMPLES
+        ]
+        if not measured:
+            return None
+        _, other_bucket, other_stats = min(measured, key=lambda item: item[:2])
+        scale = 2.0 ** (bucket - other_bucket)
+        return other_stats.mean * scale, other_stats.stddev() * scale
+
+    def plan(self, nvidia_request: NvidiaRequest) -> NvidiaPollPlan:
+        estimate = self.__estimate(
+            nvidia_request.function_id, work_size_bucket(work_units(nvidia_request))
+        )
+        if estimate is None:
+            return NvidiaPollPlan(
+                poll_seconds=config.NVCF_MAX_POLL_SECONDS,
+                first_poll_delay=config.NVCF_MIN_POLLING_INTERVAL,
+                timeout=None,
+                expected_latency=None,
+            )
+
+        mean, stddev = estimate
+        # Long enough for most tasks to come back fulfilled from the invocation itself
+        likely_latency = mean + config.NVCF_LATENCY_POLL_STDDEVS * stddev
+        poll_seconds = min(config.NVCF_MAX_POLL_SECONDS, max(1, math.ceil(likely_latency)))
+        # The invocation already waited poll_seconds and the first poll waits as long again, so only the rest of the
+        # likely latency is worth sleeping through
+        first_poll_delay = max(config.NVCF_MIN_POLLING_INTERVAL, likely_latency - 2 * poll_seconds)
+        timeout = max(
+            config.NVCF_LATENCY_MIN_TIMEOUT_SECONDS,
+            config.NVCF_LATENCY_TIMEOUT_FACTOR * (mean + config.NVCF_LATENCY_TIMEOUT_STDDEVS * stddev),
+        )
+        return NvidiaPollPlan(poll_seconds, first_poll_delay, timeout, mean)
+
+    def record(self, nvidia_request: NvidiaRequest, latency: float, polls: int):
+        key = (nvidia_request.function_id, work_size_bucket(work_units(nvidia_request)))
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = self.stats[key] = NvidiaLatencyStats()
+        stats.record(latency, polls)
+        self.dirty = True
+        if self.path and time.time() - self.last_saved >= config.NVCF_LATENCY_MODEL_SAVE_SECONDS:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return
+        except ValueError as e:
+            logger.error(f"Ignoring the unreadable latency model at {self.path} due to {e}")
+            return
+        for entry in entries:
+            self.stats[(entry["function_id"], entry["bucket"])] = NvidiaLatencyStats(
+                entry["mean"], entry["variance"], entry["count"], entry.get("single_poll", 0)
+            )
+        logger.info(f"Loaded {len(entries)} latency statistics from {self.path}")
+
+    def save(self):
+        self.last_saved = time.time()
+        if not self.path or not self.dirty:
+            return
+        entries = [
+            {"function_id": function_id, "bucket": bucket, **stats.to_json()}
+            for (function_id, bucket), stats in self.stats.items()
+        ]
+        # Written aside and renamed, so a crash (or another worker) never leaves a partial file behind
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, "w") as f:
+                json.dump(entries, f)
+            os.replace(temporary_path, self.path)
+            self.dirty = False
+        except OSError as e:
+            logger.error(f"Could not save the latency model to {self.path} due to {e}")
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            f"{function_id}/{bucket}": {
+                **stats.to_json(),
+                "stddev": stats.stddev(),
+                "single_poll_ratio": stats.single_poll / stats.count if stats.count else 0.0,
+            }
+            for (function_id, bucket), stats in sorted(self.stats.items())
+        }
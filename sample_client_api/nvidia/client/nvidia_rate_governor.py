@@ -0,0 +1,137 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional, Dict, Any
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+
+logger = get_logger_for_file(__name__)
+
+
+def parse_retry_after(retry_after: Optional[str]) -> float:
+    # Retry-After is either a number of seconds or an HTTP date
+    if not retry_after:
+        return config.NVCF_RATE_LIMIT_DEFAULT_BACKOFF_SECONDS
+    try:
+        return max(float(retry_after), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(retry_after)
+        return max((retry_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return config.NVCF_RATE_LIMIT_DEFAULT_BACKOFF_SECONDS
+
+
+class AdaptiveTokenBucket:
+    """
+    Token bucket whose refill rate follows AIMD: every accepted submission adds a little to the rate and every
+    throttle halves it and pauses the bucket for the Retry-After duration
+    """
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.capacity = config.NVCF_RATE_LIMIT_BURST
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.accepted = 0
+        self.throttled = 0
+
+    def __refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        self.__refill(now)
+        if self.paused_until > now:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def on_accepted(self):
+        self.accepted += 1
+        self.rate = min(
+            config.NVCF_RATE_LIMIT_MAX_PER_SECOND,
+            self.rate + config.NVCF_RATE_LIMIT_ADDITIVE_INCREASE,
+        )
+
+    def on_throttled(self, retry_after: float):
+        now = time.monotonic()
+        self.throttled += 1
+        self.rate = max(
+            config.NVCF_RATE_LIMIT_MIN_PER_SECOND,
+            self.rate * config.NVCF_RATE_LIMIT_MULTIPLICATIVE_DECREASE,
+        )
+        self.tokens = 0.0
+        self.updated = now
+        self.paused_until = max(self.paused_until, now + retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        self.__refill(now)
+        return {
+            "rate": self.rate,
+            "tokens": self.tokens,
+            "paused_for": max(self.paused_until - now, 0.0),
+            "accepted": self.accepted,
+            "throttled": self.throttled,
+        }
+
+
+class NvidiaRateGovernor:
+    def __init__(self):
+        self.account_bucket = AdaptiveTokenBucket(config.NVCF_ACCOUNT_RATE_LIMIT_PER_SECOND)
+        self.function_buckets: Dict[str, AdaptiveTokenBucket] = {}
+        self.delayed = 0
+        self.total_delay = 0.0
+
+    def __function_bucket(self, function_id: str) -> AdaptiveTokenBucket:
+        if function_id not in self.function_buckets:
+            self.function_buckets[function_id] = AdaptiveTokenBucket(
+                config.NVCF_FUNCTION_RATE_LIMIT_PER_SECOND
+            )
+        return self.function_buckets[function_id]
+
+    async def acquire(self, function_id: str, task_id: str):
+        function_bucket = self.__function_bucket(function_id)
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            delay = max(self.account_bucket.delay(now), function_bucket.delay(now))
+            if delay <= 0:
+                break
+            await asyncio.sleep(delay)
+            waited += delay
+
+        self.account_bucket.take()
+        function_bucket.take()
+        if waited > 0:
+            self.delayed += 1
+            self.total_delay += waited
+            logger.info(f"Delayed {task_id} for {waited:.2f}s to stay within the NVCF rate limits")
+
+    def on_accepted(self, function_id: str):
+        self.account_bucket.on_accepted()
+        self.__function_bucket(function_id).on_accepted()
+
+    def on_throttled(self, function_id: str, retry_after: float):
+        self.account_bucket.on_throttled(retry_after)
+        self.__function_bucket(function_id).on_throttled(retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "delayed": self.delayed,
+            "total_delay": self.total_delay,
+            "account": self.account_bucket.stats(),
+            "functions": {
+                function_id: bucket.stats()
+                for function_id, bucket in self.function_buckets.items()
+            },
+        }
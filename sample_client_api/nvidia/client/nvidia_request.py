@@ -1,16 +1,18 @@
 import io
 import json
+from functools import lru_cache
 from io import BytesIO
-from typing import Optional, Dict, Any, Callable, Awaitable
+from typing import Optional, Dict, Any, Callable, Awaitable, List, TYPE_CHECKING
 
-import PIL
-from PIL.Image import Image
 from pydantic import BaseModel, ConfigDict
 from sample_client_api.log_handling import get_logger_for_file
 
 from sample_client_api import config
 from sample_client_api.nvidia import MIME_JPEG_CONTENT_TYPE
 
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
 log = get_logger_for_file(__name__)
 
 
@@ -22,13 +24,46 @@ def get_styles_to_nvidia_functions(
     return functions_dict
 
 
-STYLES_TO_NVIDIA_FUNCTIONS = get_styles_to_nvidia_functions(
-    config.DIFFUSION_STYLE_MODEL_TO_NVCF_FUNCTION
-)
+@lru_cache(maxsize=None)
+def styles_to_nvidia_functions() -> Dict[str, str]:
+    return get_styles_to_nvidia_functions(config.DIFFUSION_STYLE_MODEL_TO_NVCF_FUNCTION)
+
+
+@lru_cache(maxsize=None)
+def styles_to_img2img_nvidia_functions() -> Dict[str, str]:
+    return get_styles_to_nvidia_functions(config.IMG2IMG_STYLE_MODEL_TO_NVCF_FUNCTION)
+
+
+def validate_function_maps():
+    # The maps are parsed on first use to keep the import fast, parsing them at startup still keeps a misconfigured
+    # worker from serving traffic
+    for setting, function_map in (
+        ("DIFFUSION_STYLE_MODEL_TO_NVCF_FUNCTION", styles_to_nvidia_functions),
+        ("IMG2IMG_STYLE_MODEL_TO_NVCF_FUNCTION", styles_to_img2img_nvidia_functions),
+    ):
+        try:
+            functions = function_map()
+        except (TypeError, ValueError) as e:
+            raise ValueError(f"{setting} is not a JSON object of models to NVCF function ids: {e}") from e
+        if not isinstance(functions, dict):
+            raise ValueError(f"{setting} is not a JSON object of models to NVCF function ids: {functions!r}")
+
+
+def configured_function_ids() -> List[str]:
+    function_ids = {
+        *styles_to_nvidia_functions().values(),
+        *styles_to_img2img_nvidia_functions().values(),
+        config.NVCF_INPAINT_FUNCTION_ID,
+        config.NVCF_INSTRUCT_FUNCTION_ID,
+        config.NVCF_TXT2VID_FUNCTION_ID,
+        config.NVCF_FACESWAP_FUNCTION_ID,
+        config.NVCF_FACESWAP_IP_FUNCTION_ID,
+        config.NVCF_AVATAR_FUNCTION_ID,
+        config.NVCF_SDXL_DIFFUSION_FUNCTION_ID,
+        config.NVCF_UPSCALER_FUNCTION_ID,
+    }
+    return sorted(function_id for function_id in function_ids if function_id)
 
-STYLES_TO_IMG2IMG_NVIDIA_FUNCTIONS = get_styles_to_nvidia_functions(
-    config.IMG2IMG_STYLE_MODEL_TO_NVCF_FUNCTION
-)
 
 FACESWAP_FUNCTION_ID_SET = {
     config.NVCF_FACESWAP_FUNCTION_ID,
@@ -83,14 +118,18 @@ class NvidiaRequestAsset(BaseModel):
 
 
 AssetLoader = Callable[[], Awaitable[NvidiaRequestAsset]]
+# Receives the frames of a multi-frame result one at a time, in order
+FrameWriter = Callable[[bytes], Awaitable[None]]
+
 
+def asset_from_image(image: "Image", image_format: str):
+    from PIL.Image import MIME
 
-def asset_from_image(image: Image, image_format: str):
     image_data = io.BytesIO()
     image.save(image_data, format=image_format)
     return asset_from_bytes(
         image_data,
-        PIL.Image.MIME.get(image_format, MIME_JPEG_CONTENT_TYPE),
+        MIME.get(image_format, MIME_JPEG_CONTENT_TYPE),
     )
 
 
@@ -114,5 +153,14 @@ class NvidiaRequest(BaseModel):
 
     image_output_name: str = "generated_image"
     profile_output_name: Optional[str] = None
+    # Number of images the function returns under image_output_name in a single call
+    batch_size: int = 1
+    # When set, the result frames are streamed into the writer instead of being returned
+    frame_writer: Optional[FrameWriter] = None
+    # Epoch seconds after which nobody waits for the result anymore
+    deadline: Optional[float] = None
+    # Fields of the client request that say where the result is stored (task_id, s3_output_bucket, s3_output_key),
+    # journaled so that another worker can still store the result when this one dies while waiting for it
+    output_target: Optional[Dict[str, Any]] = None
 
     model_config = ConfigDict(arbitrary_types_allowed=True)
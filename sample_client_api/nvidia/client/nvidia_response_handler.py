@@ -1,15 +1,23 @@
 import asyncio
-import base64
+import binascii
 import io
+import os
+import re
+import tempfile
 import time
 import zipfile
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Optional, Dict
 
 import aiohttp
 from sample_client_api.log_handling import get_logger_for_file
 
 from sample_client_api import config
-from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest
+from sample_client_api.nvidia import (
+    MIME_JPEG_CONTENT_TYPE,
+    MIME_PNG_CONTENT_TYPE,
+    MIME_WEBP_CONTENT_TYPE,
+)
+from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest, FrameWriter
 
 logger = get_logger_for_file(__name__)
 
@@ -43,8 +51,17 @@ class NvidiaImageZipRetrievalException(NvidiaFulfilledResponseProcessingExceptio
 
 
 class NvidiaPollTimeoutException(Exception):
-    def __init__(self, nvidia_request: NvidiaRequest, task_id: str, req_id: str):
-        message = f"Task timed out after {config.NVCF_MAX_POLLING_ATTEMPTS} attempts for Request: {task_id}: {nvidia_request} for req_id: {req_id}"
+    def __init__(
+        self,
+        nvidia_request: NvidiaRequest,
+        task_id: str,
+        req_id: str,
+        timeout: Optional[float] = None,
+    ):
+        if timeout is None:
+            message = f"Task timed out after {config.NVCF_MAX_POLLING_ATTEMPTS} attempts for Request: {task_id}: {nvidia_request} for req_id: {req_id}"
+        else:
+            message = f"Task timed out after {timeout:.1f}s for Request: {task_id}: {nvidia_request} for req_id: {req_id}"
         super().__init__(message)
 
 
@@ -58,6 +75,69 @@ async def explicitly_sleep_for_minimum_polling_interval(last_request_time: float
 
 
 NVIDIA_ZIP_IMAGE_FILE_NAME = "image.jpg"
+NVIDIA_ZIP_IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+DIGITS = re.compile(r"(\d+)")
+
+
+def natural_sort_key(name: str) -> List[Any]:
+    # image_2.jpg before image_10.jpg, whether or not NVCF zero-padded the numbers
+    return [int(part) if part.isdigit() else part for part in DIGITS.split(name)]
+
+
+def zipped_image_names(zipped: zipfile.ZipFile) -> List[str]:
+    return sorted(
+        (
+            info.filename
+            for info in zipped.infolist()
+            if not info.is_dir() and os.path.splitext(info.filename)[1].lower() in NVIDIA_ZIP_IMAGE_EXTENSIONS
+        ),
+        key=natural_sort_key,
+    )
+
+
+def read_zipped_images(data: bytes, batch_size: int) -> List[bytes]:
+    with zipfile.ZipFile(io.BytesIO(data)) as zipped:
+        if batch_size <= 1:
+            return [zipped.read(NVIDIA_ZIP_IMAGE_FILE_NAME)]
+        # A batch holds one image per member, in the order they were generated
+        image_names = zipped_image_names(zipped)
+        if len(image_names) != batch_size:
+            logger.warning(f"Zip holds {len(image_names)} images for a batch of {batch_size}")
+        return [zipped.read(image_name) for image_name in image_names]
+
+
+def detect_image_content_type(image_data: bytes) -> str:
+    # NVCF functions return JPEG unless they were built otherwise, so sniff the magic bytes
+    if image_data[:8] == b"\x89PNG\r\n\x1a\n":
+        return MIME_PNG_CONTENT_TYPE
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return MIME_WEBP_CONTENT_TYPE
+    return MIME_JPEG_CONTENT_TYPE
+
+
+def decode_base64(data: str) -> bytes:
+    # Reads the ASCII str in place, base64.b64decode would first copy all of it into bytes
+    return binascii.a2b_base64(data)
+
+
+async def decode_image_output(outputs: List[Dict[str, Any]]) -> List[bytes]:
+    image_output = outputs[0]
+    images_base64 = image_output["data"]
+    if len(images_base64) == 0:
+        raise ValueError("No image data in the image output")
+    # A batch holds several images in the same output, decode them in parallel
+    loop = asyncio.get_running_loop()
+    images_data = [
+        *await asyncio.gather(
+            *[
+                loop.run_in_executor(None, decode_base64, image_base64)
+                for image_base64 in images_base64
+            ]
+        )
+    ]
+    # From here on the decoded bytes are the only copy, passed along as is up to S3 or the next asset upload
+    image_output["data"] = []
+    return images_data
 
 
 async def handle_fulfilled_response(
@@ -66,15 +146,21 @@ async def handle_fulfilled_response(
     nvidia_client_request: NvidiaRequest,
     task_id: str,
     req_id: str,
-) -> Tuple[bytes, List[Any]]:
+) -> Tuple[List[bytes], List[Any]]:
     outputs = []
-    image_data: bytes
+    images_data: List[bytes]
+
+    if nvidia_client_request.frame_writer is not None:
+        return await handle_fulfilled_frames(
+            session, response, nvidia_client_request, task_id, req_id
+        )
 
     if response.status == 302:  # zip file was sent back
         try:
             url = response.headers.get("Location")
-            image_data = await convert_zipped_image_from_url_to_base64(session,
-                                                                       url)
+            images_data = await convert_zipped_images_from_url(
+                session, url, nvidia_client_request.batch_size
+            )
         except Exception as e:
             raise NvidiaImageZipRetrievalException(
                 req_id, e, nvidia_client_request, task_id, await response.text()
@@ -83,23 +169,19 @@ async def handle_fulfilled_response(
         res_json = await response.json()
         outputs = res_json.get("outputs", [])
         try:
-            image_outputs = outputs[0]
-            image_base64 = image_outputs["data"][0]  # Means outputs are not empty
-            image_data = await asyncio.get_running_loop().run_in_executor(
-                None, lambda: base64.b64decode(image_base64)
-            )
+            images_data = await decode_image_output(outputs)
         except Exception as e:
             logger.error(f"Error getting image from response: {e}", exc_info=True)
             raise NvidiaImageProcessingException(
                 req_id, e, nvidia_client_request, task_id, res_json
             )
 
-    return image_data, [output["data"][0] for output in outputs[1:]]
+    return images_data, [output["data"][0] for output in outputs[1:]]
 
 
-async def convert_zipped_image_from_url_to_base64(
-    session: aiohttp.ClientSession, url: str
-) -> bytes:
+async def convert_zipped_images_from_url(
+    session: aiohttp.ClientSession, url: str, batch_size: int
+) -> List[bytes]:
     # Step 1: Download the zip file from the URL
     logger.info(f"Getting zip file from {url}...")
     async with session.get(url) as response:
@@ -109,12 +191,74 @@ async def convert_zipped_image_from_url_to_base64(
             )
 
         # Step 2: Open the zip file and read the file data
-        image_data = await asyncio.get_running_loop().run_in_executor(
-            None,
-            lambda data: zipfile.ZipFile(io.BytesIO(data)).read(
-                NVIDIA_ZIP_IMAGE_FILE_NAME
-            ),
-            await response.read(),
+        images_data = await asyncio.get_running_loop().run_in_executor(
+            None, read_zipped_images, await response.read(), batch_size
         )
 
-        return image_data
+        return images_data
+
+
+async def handle_fulfilled_frames(
+    session: aiohttp.ClientSession,
+    response: aiohttp.ClientResponse,
+    nvidia_client_request: NvidiaRequest,
+    task_id: str,
+    req_id: str,
+) -> Tuple[List[bytes], List[Any]]:
+    # Frames are handed to the writer one by one so that only a single decoded frame is held at a time
+    frame_writer = nvidia_client_request.frame_writer
+    outputs = []
+
+    if response.status == 302:  # zip file with all the frames was sent back
+        try:
+            url = response.headers.get("Location")
+            await stream_zipped_frames_from_url(session, url, frame_writer)
+        except Exception as e:
+            raise NvidiaImageZipRetrievalException(
+                req_id, e, nvidia_client_request, task_id, await response.text()
+            )
+    else:
+        res_json = await response.json()
+        outputs = res_json.get("outputs", [])
+        try:
+            frames_base64 = outputs[0]["data"]
+            if len(frames_base64) == 0:
+                raise ValueError("No frame data in the image output")
+            loop = asyncio.get_running_loop()
+            for index in range(len(frames_base64)):
+                # Each encoded frame is dropped once decoded, so only the frames still to come stay in memory
+                frame_base64, frames_base64[index] = frames_base64[index], None
+                frame = await loop.run_in_executor(None, decode_base64, frame_base64)
+                del frame_base64
+                await frame_writer(frame)
+        except Exception as e:
+            logger.error(f"Error getting frames from response: {e}", exc_info=True)
+            raise NvidiaImageProcessingException(
+                req_id, e, nvidia_client_request, task_id, res_json
+            )
+
+    return [], [output["data"][0] for output in outputs[1:]]
+
+
+async def stream_zipped_frames_from_url(
+    session: aiohttp.ClientSession, url: str, frame_writer: FrameWriter
+):
+    logger.info(f"Streaming zipped frames from {url}...")
+    loop = asyncio.get_running_loop()
+    with tempfile.SpooledTemporaryFile(
+        max_size=config.NVCF_RESULT_SPOOL_MAX_BYTES
+    ) as spool:
+        async with session.get(url) as response:
+            if response.status != 200:
+                raise ValueError(
+                    f"Failed to download file from {url} with status code: {response.status}"
+                )
+            async for chunk in response.content.iter_chunked(1024 * 1024):
+                await loop.run_in_executor(None, spool.write, chunk)
+
+        spool.seek(0)
+        with zipfile.ZipFile(spool) as zipped_frames:
+            for frame_name in zipped_image_names(zipped_frames):
+                await frame_writer(
+                    await loop.run_in_executor(None, zipped_frames.read, frame_name)
+                )
@@ -0,0 +1,163 @@
+import asyncio
+import time
+from typing import Optional, Tuple, List, Any, Dict, Callable, Awaitable, TypeVar
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.client.nvidia_endpoint_router import is_endpoint_failure
+from sample_client_api.nvidia.client.nvidia_exceptions import should_drain_account
+from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest
+from sample_client_api.nvidia.nvidia_task_handler import NvidiaImageGenerationTaskHandler
+from sample_client_api.nvidia.nvidia_task_journal import NvidiaJournaledTask
+
+logger = get_logger_for_file(__name__)
+
+R = TypeVar("R")
+
+# Weight of the recent error rate against the number of in-flight tasks when picking an account
+NVIDIA_ACCOUNT_ERROR_WEIGHT = 10.0
+
+
+class NvidiaAccount:
+    def __init__(self, name: str, task_handler: NvidiaImageGenerationTaskHandler):
+        self.name = name
+        self.task_handler = task_handler
+        self.in_flight = 0
+        self.error_rate = 0.0
+        self.drained_until = 0.0
+        self.completed = 0
+        self.failed = 0
+
+    def is_drained(self, now: float) -> bool:
+        return self.drained_until > now
+
+    def score(self) -> float:
+        return self.in_flight + NVIDIA_ACCOUNT_ERROR_WEIGHT * self.error_rate
+
+    def record_result(self, failed: bool):
+        alpha = config.NVCF_ACCOUNT_ERROR_EWMA_ALPHA
+        self.error_rate = (1 - alpha) * self.error_rate + alpha * (1.0 if failed else 0.0)
+        if failed:
+            self.failed += 1
+        else:
+            self.completed += 1
+
+    def drain(self, reason: Exception):
+        self.drained_until = time.time() + config.NVCF_ACCOUNT_DRAIN_SECONDS
+        logger.warning(
+            f"Draining NVCF account {self.name} for {config.NVCF_ACCOUNT_DRAIN_SECONDS}s due to {reason}"
+        )
+
+    def stats(self, now: float) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "in_flight": self.in_flight,
+            "error_rate": self.error_rate,
+            "drained": self.is_drained(now),
+            "completed": self.completed,
+            "failed": self.failed,
+            "endpoints": self.task_handler.nvidia_client.endpoint_router.stats(),
+            "rate_limits": self.task_handler.nvidia_client.rate_governor.stats(),
+        }
+
+
+class NvidiaAccountPool:
+    def __init__(self, accounts: List[NvidiaAccount]):
+        if len(accounts) == 0:
+            raise ValueError("NvidiaAccountPool needs at least one account")
+        self.accounts = accounts
+
+    async def close(self):
+        for account in self.accounts:
+            await account.task_handler.close()
+
+    async def warm_up(self, function_ids: List[str]) -> Dict[str, Any]:
+        results = await asyncio.gather(
+            *[account.task_handler.warm_up(function_ids) for account in self.accounts],
+            return_exceptions=True,
+        )
+        warmup = {}
+        for account, result in zip(self.accounts, results):
+            if isinstance(result, Exception):
+                logger.error(f"Warmup of account {account.name} failed due to {result}")
+                result = {"error": str(result)}
+            warmup[account.name] = result
+        return warmup
+
+    def choose_account(self, excluded: List[NvidiaAccount]) -> Optional[NvidiaAccount]:
+        now = time.time()
+        candidates = [account for account in self.accounts if account not in excluded]
+        if len(candidates) == 0:
+            return None
+        healthy = [account for account in candidates if not account.is_drained(now)]
+        if len(healthy) == 0:
+            # Every account is drained, the one coming back first is the best bet
+            return min(candidates, key=lambda account: account.drained_until)
+        return min(healthy, key=lambda account: account.score())
+
+    async def handle_nvidia_task(
+        self,
+        nvidia_client_request: NvidiaRequest,
+        task_id: str,
+    ) -> Optional[Tuple[List[bytes], List[Any]]]:
+        return await self.__handle_on_account(
+            task_id, lambda task_handler: task_handler.handle_nvidia_task(nvidia_client_request, task_id)
+        )
+
+    async def handle_nvidia_variants(
+        self,
+        nvidia_client_request: NvidiaRequest,
+        task_id: str,
+        variant_parameters: List[Dict[str, Any]],
+        required: int,
+    ) -> List[Tuple[int, List[bytes], List[Any]]]:
+        # The variants share their assets, which only exist on the account that uploaded them
+        return await self.__handle_on_account(
+            task_id,
+            lambda task_handler: task_handler.handle_nvidia_variants(
+                nvidia_client_request, task_id, variant_parameters, required
+            ),
+        )
+
+    async def __handle_on_account(
+        self,
+        task_id: str,
+        handle: Callable[[NvidiaImageGenerationTaskHandler], Awaitable[R]],
+    ) -> R:
+        tried: List[NvidiaAccount] = []
+        last_exception: Optional[Exception] = None
+        for _ in range(len(self.accounts)):
+            account = self.choose_account(tried)
+            tried.append(account)
+            account.in_flight += 1
+            try:
+                result = await handle(account.task_handler)
+                account.record_result(failed=False)
+                return result
+            except Exception as e:
+                drain = should_drain_account(e)
+                # Rejected prompts, bad requests and missed deadlines say nothing about the account
+                if drain or is_endpoint_failure(e):
+                    account.record_result(failed=True)
+                if not drain:
+                    raise e
+                # The account refused the task before doing any work, so it is safe to place it elsewhere
+                account.drain(e)
+                last_exception = e
+                logger.info(f"Account {account.name} refused {task_id}, trying the next account")
+            finally:
+                account.in_flight -= 1
+
+        raise last_exception
+
+    async def resume_task(self, task: NvidiaJournaledTask) -> Optional[Tuple[List[bytes], List[Any]]]:
+        # Only the account that invoked the task can poll its req_id and delete its assets
+        account = next((account for account in self.accounts if account.name == task.account), None)
+        if account is None:
+            logger.error(f"Cannot resume {task.task_id}, its NVCF account {task.account} is no longer configured")
+            return None
+        return await account.task_handler.resume_task(task)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        now = time.time()
+        return [account.stats(now) for account in self.accounts]
@@ -0,0 +1,172 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+
+logger = get_logger_for_file(__name__)
+
+# (bucket, key)
+ObjectKey = Tuple[str, str]
+# How the original was encoded for upload, e.g. the (width, height) it is resized to or None when it is sent as is
+VariantKey = Hashable
+
+
+class ByteBudgetLRU:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries: "OrderedDict[Hashable, Tuple[Any, int]]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: Hashable, value: Any, size: int):
+        self.pop(key)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (value, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self.entries.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
+
+    def pop(self, key: Hashable):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def pop_matching(self, predicate: Callable[[Hashable], bool]) -> int:
+        keys = [key for key in self.entries if predicate(key)]
+        for key in keys:
+            self.pop(key)
+        return len(keys)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+class NvidiaInputImageCache:
+    """
+    Two tier cache of the S3 images sent to NVCF as inputs: the original objects keyed by bucket/key/ETag, and the
+    encoded variants (resized, mask processed or as is) that are actually uploaded, keyed by the original and how
+    it was encoded
+    """
+
+    def __init__(self, original_max_bytes: int, variant_max_bytes: int, revalidate_seconds: float):
+        self.originals = ByteBudgetLRU(original_max_bytes)
+        self.variants = ByteBudgetLRU(variant_max_bytes)
+        self.revalidate_seconds = revalidate_seconds
+        # Last ETag seen for an object and when it was checked, trusted without asking S3 for revalidate_seconds
+        self.etags: "OrderedDict[ObjectKey, Tuple[str, float]]" = OrderedDict()
+        self.max_etags = config.NVCF_INPUT_CACHE_MAX_OBJECTS
+        self.loading: Dict[Tuple[ObjectKey, VariantKey], asyncio.Future] = {}
+        self.revalidations = 0
+        self.invalidations = 0
+        self.s3_gets = 0
+
+    def __remember_etag(self, object_key: ObjectKey, etag: str):
+        previous = self.etags.pop(object_key, None)
+        if previous is not None and previous[0] != etag:
+            # The object changed in place, everything derived from the old version is stale
+            self.invalidations += 1
+            self.originals.pop_matching(lambda key: key[:2] == object_key and key[2] != etag)
+            self.variants.pop_matching(lambda key: key[:2] == object_key and key[2] != etag)
+            logger.info(f"Invalidated the cached inputs of {object_key} after its ETag changed")
+        self.etags[object_key] = (etag, time.time())
+        while len(self.etags) > self.max_etags:
+            self.etags.popitem(last=False)
+
+    async def __current_etag(
+        self, object_key: ObjectKey, fetch_etag: Callable[[], Awaitable[str]]
+    ) -> Optional[str]:
+        known = self.etags.get(object_key)
+        if known is None:
+            # Never seen, the GET that follows returns the ETag anyway
+            return None
+        etag, validated_at = known
+        if time.time() - validated_at < self.revalidate_seconds:
+            return etag
+        self.revalidations += 1
+        etag = await fetch_etag()
+        self.__remember_etag(object_key, etag)
+        return etag
+
+    async def __load(
+        self,
+        object_key: ObjectKey,
+        variant_key: VariantKey,
+        fetch: Callable[[], Awaitable[Tuple[str, bytes]]],
+        fetch_etag: Callable[[], Awaitable[str]],
+        encode: Callable[[bytes, VariantKey], Awaitable[Tuple[bytes, str]]],
+    ) -> Tuple[bytes, str]:
+        # Lookups with an unknown ETag always miss, which keeps the hit ratios honest
+        etag = await self.__current_etag(object_key, fetch_etag)
+        variant = self.variants.get((*object_key, etag, variant_key))
+        if variant is not None:
+            return variant
+
+        original = self.originals.get((*object_key, etag))
+        if original is None:
+            self.s3_gets += 1
+            etag, original = await fetch()
+            self.__remember_etag(object_key, etag)
+            self.originals.put((*object_key, etag), original, len(original))
+
+        variant = await encode(original, variant_key)
+        self.variants.put((*object_key, etag, variant_key), variant, len(variant[0]))
+        return variant
+
+    async def load(
+        self,
+        object_key: ObjectKey,
+        variant_key: VariantKey,
+        fetch: Callable[[], Awaitable[Tuple[str, bytes]]],
+        fetch_etag: Callable[[], Awaitable[str]],
+        encode: Callable[[bytes, VariantKey], Awaitable[Tuple[bytes, str]]],
+    ) -> Tuple[bytes, str]:
+        # Concurrent requests for the same input (e.g. a burst of faceswaps on one photo) share a single load
+        loading_key = (object_key, variant_key)
+        loading = self.loading.get(loading_key)
+        if loading is not None:
+            return await asyncio.shield(loading)
+
+        loading = asyncio.ensure_future(self.__load(object_key, variant_key, fetch, fetch_etag, encode))
+        self.loading[loading_key] = loading
+        try:
+            return await asyncio.shield(loading)
+        finally:
+            if loading.done():
+                self.loading.pop(loading_key, None)
+            else:
+                loading.add_done_callback(lambda _: self.loading.pop(loading_key, None))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "originals": self.originals.stats(),
+            "variants": self.variants.stats(),
+            "s3_gets": self.s3_gets,
+            "revalidations": self.revalidations,
+            "invalidations": self.invalidations,
+        }
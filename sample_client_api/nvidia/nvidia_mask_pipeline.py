@@ -0,0 +1,74 @@
+import io
+from typing import TYPE_CHECKING, Optional, Tuple
+
+from sample_client_api import config
+
+if TYPE_CHECKING:
+    import numpy
+
+MASK_CONTENT_TYPE = "image/png"
+
+
+class NvidiaMaskSettings:
+    """
+    How an uploaded inpaint mask is turned into the binary (or feathered) mask NVCF paints over
+    """
+
+    def __init__(
+        self,
+        threshold: int = config.NVCF_INPAINT_MASK_THRESHOLD,
+        invert: bool = config.NVCF_INPAINT_MASK_INVERT,
+        dilate_pixels: int = config.NVCF_INPAINT_MASK_DILATE_PIXELS,
+        feather_pixels: int = config.NVCF_INPAINT_MASK_FEATHER_PIXELS,
+    ):
+        self.threshold = threshold
+        self.invert = invert
+        self.dilate_pixels = max(dilate_pixels, 0)
+        self.feather_pixels = max(feather_pixels, 0)
+
+    def key(self) -> Tuple[int, bool, int, int]:
+        return self.threshold, self.invert, self.dilate_pixels, self.feather_pixels
+
+
+def __window_sum(array: "numpy.ndarray", radius: int) -> "numpy.ndarray":
+    import numpy as np
+
+    # Sliding sums along the rows from one cumulative sum, so the cost does not grow with the radius
+    padded = np.pad(array, ((0, 0), (radius + 1, radius)))
+    cumulative = np.cumsum(padded, axis=1)
+    return cumulative[:, 2 * radius + 1:] - cumulative[:, : -2 * radius - 1]
+
+
+def __box_sum(array: "numpy.ndarray", radius: int) -> "numpy.ndarray":
+    # A square window is separable into a pass over the rows and one over the columns
+    return __window_sum(__window_sum(array, radius).T, radius).T
+
+
+def process_mask(data: bytes, size: Optional[Tuple[int, int]], settings: NvidiaMaskSettings) -> bytes:
+    import numpy as np
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    if size is not None:
+        # JPEG masks are decoded straight at (about) the target scale and in grayscale, which is most of the resize
+        image.draft("L", size)
+    mask = image.convert("L")
+    if size is not None and mask.size != size:
+        mask = mask.resize(size, Image.BILINEAR)
+
+    painted = np.asarray(mask) >= settings.threshold
+    if settings.invert:
+        painted = ~painted
+    if settings.dilate_pixels:
+        painted = __box_sum(painted.astype(np.int32), settings.dilate_pixels) > 0
+
+    output = io.BytesIO()
+    if settings.feather_pixels:
+        # Normalized by the window size, so the edges of the image do not fade out
+        blurred = __box_sum(painted.astype(np.float32), settings.feather_pixels)
+        coverage = __box_sum(np.ones(painted.shape, dtype=np.float32), settings.feather_pixels)
+        feathered = np.rint(blurred * 255 / coverage).astype(np.uint8)
+        Image.fromarray(feathered, "L").save(output, format="PNG", optimize=True)
+    else:
+        Image.fromarray(painted).save(output, format="PNG", optimize=True)
+    return output.getvalue()
@@ -0,0 +1,49 @@
+import json
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Dict, Optional
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.client.nvidia_latency_model import DIMENSION_PARAMETERS, parameter_value
+from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest
+
+logger = get_logger_for_file(__name__)
+
+# Set per request by the API to the route it came in on, e.g. "faceswap_ip"
+REQUEST_ROUTE: ContextVar[Optional[str]] = ContextVar("request_route", default=None)
+
+
+@lru_cache(maxsize=None)
+def route_memory_factors() -> Dict[str, float]:
+    factors = json.loads(config.NVCF_MEMORY_ROUTE_FACTORS or "{}")
+    logger.info(f"Memory factors per route: {factors}")
+    return factors
+
+
+def request_pixels(nvidia_request: NvidiaRequest) -> float:
+    pixels = config.NVCF_MEMORY_DEFAULT_PIXELS
+    for width_name, height_name in DIMENSION_PARAMETERS:
+        width = parameter_value(nvidia_request, width_name)
+        height = parameter_value(nvidia_request, height_name)
+        if width and height:
+            pixels = width * height
+            break
+    if nvidia_request.parameters.get("enable_high_resolution_resample") is True:
+        # The resample pass works on the upscaled image
+        scale_factor = parameter_value(nvidia_request, "high_resolution_resample_scale_factor") or 1.0
+        pixels *= scale_factor * scale_factor
+    return pixels
+
+
+def estimate_request_bytes(nvidia_request: NvidiaRequest, route: Optional[str] = None) -> int:
+    # Every generated image and every input is held decoded or encoded at some point of the task
+    assets = sum(1 for asset in nvidia_request.assets.values() if asset is not None)
+    if nvidia_request.frame_writer is not None:
+        # Frames are streamed to the writer one at a time, so only one decoded frame and its encoded payload are held
+        generated = 2
+    else:
+        generated = max(nvidia_request.batch_size, 1)
+    images = generated + assets
+    route_factor = route_memory_factors().get(route or REQUEST_ROUTE.get(), 1.0)
+    return int(images * request_pixels(nvidia_request) * config.NVCF_MEMORY_BYTES_PER_PIXEL * route_factor)
@@ -1,4 +1,13 @@
+import asyncio
+import contextvars
+import json
+import time
 from io import BytesIO
+from typing import Any, AsyncIterator, Coroutine, Dict, TypeVar
+
+from fastapi import HTTPException
+from starlette import status
+from starlette.responses import StreamingResponse
 
 from sample_client_api.log_handling import get_logger_for_file
 from sample_client_api.nvidia_request_models.final_models import (
@@ -8,19 +17,28 @@ from sample_client_api.nvidia_request_models.final_models import (
 from sample_client_api.config import NVCF_UPSCALER_FUNCTION_ID
 from sample_client_api.nvidia import MIME_JPEG_CONTENT_TYPE
 from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest, asset_from_bytes, NvidiaRequestParameter
-from sample_client_api.nvidia.nvidia_service import process_text_to_image, handle_custom_request
+from sample_client_api.nvidia.nvidia_service import (
+    build_output_response,
+    handle_custom_request,
+    process_text_to_image,
+    upload_intermediate_to_s3,
+)
 
 logger = get_logger_for_file(__name__)
 
+SERVER_SENT_EVENTS_CONTENT_TYPE = "text/event-stream"
 
-async def multi_client_request(request: GuidanceNvidiaClientRequest) -> BytesIO:
-    original_requested_width = request.width
-    original_requested_height = request.height
+R = TypeVar("R")
+
+
+async def generate_base_image(request: GuidanceNvidiaClientRequest) -> BytesIO:
     picasso_request_text2img = process_text_to_image(request)
-    generated_image_small = await handle_custom_request(
-        picasso_request_text2img, request.task_id
+    return await handle_custom_request(
+        picasso_request_text2img, request
     )
 
+
+async def upscale_base_image(request: GuidanceNvidiaClientRequest, generated_image_small: BytesIO) -> BytesIO:
     async def base_asset():
         return asset_from_bytes(
             generated_image_small,
@@ -30,15 +48,73 @@ async def multi_client_request(request: GuidanceNvidiaClientRequest) -> BytesIO:
     picasso_request_upscale = NvidiaRequest(
         function_id=NVCF_UPSCALER_FUNCTION_ID,
         parameters={
-            "desired_width": NvidiaRequestParameter(original_requested_width, "UINT16"),
-            "desired_height": NvidiaRequestParameter(original_requested_height, "UINT16"),
+            "desired_width": NvidiaRequestParameter(request.width, "UINT16"),
+            "desired_height": NvidiaRequestParameter(request.height, "UINT16"),
         },
         assets={
             "original_image": base_asset,
         },
     )
     logger.info(f"Upscaling image with request: {picasso_request_upscale} for task {request.task_id}")
-    upscaled_image = await handle_custom_request(
-        picasso_request_upscale, request.task_id, None
+    return await handle_custom_request(
+        picasso_request_upscale, request
+    )
+
+
+async def multi_client_request(request: GuidanceNvidiaClientRequest) -> BytesIO:
+    generated_image_small = await generate_base_image(request)
+    return await upscale_base_image(request, generated_image_small)
+
+
+def server_sent_event(event: str, data: Dict[str, Any]) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+def __in_context(context: contextvars.Context, coroutine: Coroutine[Any, Any, R]) -> "asyncio.Task[R]":
+    # The task gets its own copy of the context, same as asyncio.create_task(..., context=) on Python 3.11
+    return context.run(asyncio.create_task, coroutine)
+
+
+async def __progressive_events(
+        request: GuidanceNvidiaClientRequest,
+        generated_image_small: BytesIO,
+        started: float,
+        context: contextvars.Context,
+) -> AsyncIterator[bytes]:
+    # The stream is iterated outside of the handler, so the work runs in the handler's context to keep the deadline,
+    # route and trace of the request. The upscale starts right away, the base image is uploaded and announced meanwhile
+    upscale = __in_context(context, upscale_base_image(request, generated_image_small))
+    try:
+        base_uri = await __in_context(
+            context, upload_intermediate_to_s3(generated_image_small.getvalue(), request, "base")
+        )
+        yield server_sent_event("base", {"output": base_uri, "seconds": time.time() - started})
+
+        upscaled_image = await upscale
+        output = await __in_context(context, build_output_response([upscaled_image.getvalue()], request, {}))
+        yield server_sent_event("final", {**output.model_dump(), "seconds": time.time() - started})
+    except HTTPException as e:
+        yield server_sent_event("error", {"detail": e.detail, "status_code": e.status_code})
+    except Exception as e:
+        logger.error(f"Progressive delivery failed for {request.task_id} due to {e}", exc_info=True)
+        yield server_sent_event(
+            "error", {"detail": repr(e), "status_code": status.HTTP_500_INTERNAL_SERVER_ERROR}
+        )
+    finally:
+        # Also when the client disconnected and the stream was cancelled
+        if not upscale.done():
+            upscale.cancel()
+            await asyncio.wait({upscale})
+
+
+async def progressive_multi_client_request(request: GuidanceNvidiaClientRequest) -> StreamingResponse:
+    # The base image is generated before responding, so its failures still get their own status code. Once the
+    # status is sent, the stream carries a "base" event with the S3 URI of the base image as soon as it is uploaded,
+    # then a "final" event with the output of the upscaled image, or an "error" event.
+    started = time.time()
+    generated_image_small = await generate_base_image(request)
+    return StreamingResponse(
+        __progressive_events(request, generated_image_small, started, contextvars.copy_context()),
+        media_type=SERVER_SENT_EVENTS_CONTENT_TYPE,
+        headers={"Cache-Control": "no-cache"},
     )
-    return upscaled_image
@@ -0,0 +1,116 @@
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia import OPAQUE_FORMATS
+
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
+logger = get_logger_for_file(__name__)
+
+
+class NvidiaDerivativeSpec:
+    """
+    An extra version of a generated image, bounded to max_size on its longest side (None keeps the size)
+    """
+
+    def __init__(
+        self,
+        name: str,
+        image_format: str,
+        max_size: Optional[int] = None,
+        quality: int = config.NVCF_OUTPUT_DERIVATIVE_QUALITY,
+    ):
+        self.name = name
+        self.image_format = image_format.upper()
+        self.max_size = max_size
+        self.quality = quality
+
+    @classmethod
+    def from_json(cls, entry: Dict[str, Any]) -> "NvidiaDerivativeSpec":
+        return cls(
+            entry["name"],
+            entry.get("format", "JPEG"),
+            entry.get("max_size"),
+            entry.get("quality", config.NVCF_OUTPUT_DERIVATIVE_QUALITY),
+        )
+
+    def extension(self) -> str:
+        return self.image_format.lower()
+
+    def content_type(self) -> str:
+        from PIL.Image import MIME
+
+        return MIME.get(self.image_format, f"image/{self.extension()}")
+
+
+def __savable_formats() -> List[str]:
+    from PIL import Image
+
+    try:
+        # Registers AVIF with Pillow versions that do not ship it
+        import pillow_avif  # noqa: F401
+    except ImportError:
+        pass
+    Image.init()
+    return list(Image.SAVE)
+
+
+@lru_cache(maxsize=None)
+def derivative_specs() -> List[NvidiaDerivativeSpec]:
+    if not config.NVCF_OUTPUT_DERIVATIVES:
+        return []
+    savable_formats = __savable_formats()
+    specs = []
+    for entry in json.loads(config.NVCF_OUTPUT_DERIVATIVES):
+        spec = NvidiaDerivativeSpec.from_json(entry)
+        if spec.image_format not in savable_formats:
+            logger.warning(f"Skipping output derivative {spec.name}, Pillow cannot save {spec.image_format}")
+            continue
+        specs.append(spec)
+    logger.info(f"Output derivatives: {[spec.name for spec in specs]}")
+    return specs
+
+
+def initialize_derivative_executor() -> Optional[ThreadPoolExecutor]:
+    if not config.NVCF_OUTPUT_DERIVATIVES:
+        return None
+    # Pillow releases the GIL while resizing and encoding, so threads scale without copying images between processes
+    return ThreadPoolExecutor(
+        max_workers=config.NVCF_OUTPUT_DERIVATIVE_WORKERS, thread_name_prefix="output-derivatives"
+    )
+
+
+def decode_output(data: bytes) -> "Image":
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    # Decoded once here, the encoders of every derivative start from it
+    image.load()
+    return image
+
+
+def encode_derivative(shared_image: "Image", spec: NvidiaDerivativeSpec) -> bytes:
+    from PIL import Image
+
+    image = shared_image
+    if spec.max_size and max(image.size) > spec.max_size:
+        scale = spec.max_size / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS, reducing_gap=3.0)
+    if spec.image_format in OPAQUE_FORMATS and image.mode not in ("RGB", "L"):
+        # Generated images are flattened to RGB for them
+        image = image.convert("RGB")
+    if image is shared_image:
+        # Saving sets the encoder options on the image itself, so the encoders running at the same time must not
+        # share it
+        image = image.copy()
+
+    output = io.BytesIO()
+    image.save(output, format=spec.image_format, quality=spec.quality)
+    return output.getvalue()
@@ -0,0 +1,251 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Tuple, Optional
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.nvidia_shared_state import SharedInFlightCounter
+from sample_client_api.nvidia_request_models.final_models import NvidiaPriority
+
+logger = get_logger_for_file(__name__)
+
+
+class NvidiaPriorityClassStats:
+    def __init__(self):
+        self.queued = 0
+        self.served = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float):
+        self.served += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self.queued,
+            "served": self.served,
+            "mean_wait": self.total_wait / self.served if self.served else 0.0,
+            "max_wait": self.max_wait,
+        }
+
+
+class NvidiaPriorityScheduler:
+    """
+    Bounds the number of NVCF tasks and the estimated bytes of images in flight, and hands out capacity in weighted
+    priority order. Every class is ranked by its enqueue time plus an aging offset, so a bulk task that has waited
+    longer than its offset is served before interactive tasks that just arrived and lower classes can never starve.
+    """
+
+    def __init__(
+        self,
+        max_concurrent: int,
+        aging_offsets: Dict[NvidiaPriority, float],
+        host_counter: Optional[SharedInFlightCounter] = None,
+        host_max_concurrent: int = 0,
+        max_bytes: int = 0,
+        host_bytes_counter: Optional[SharedInFlightCounter] = None,
+        host_max_bytes: int = 0,
+    ):
+        self.max_concurrent = max_concurrent
+        self.aging_offsets = aging_offsets
+        # Counts the tasks in flight in every worker of the host when set
+        self.host_counter = host_counter
+        self.host_max_concurrent = host_max_concurrent
+        self.max_bytes = max_bytes
+        # Sums the estimated bytes in flight in every worker of the host when set
+        self.host_bytes_counter = host_bytes_counter
+        self.host_max_bytes = host_max_bytes
+        self.running = 0
+        self.bytes_in_flight = 0
+        self.waiters: List[Tuple[float, int, asyncio.Future, int]] = []
+        self.host_watcher: Optional[asyncio.Task] = None
+        self.host_wakeup = asyncio.Event()
+        self.sequence = itertools.count()
+        self.class_stats = {priority: NvidiaPriorityClassStats() for priority in NvidiaPriority}
+
+    def __has_local_capacity(self, weight: int) -> bool:
+        if 0 < self.max_concurrent <= self.running:
+            return False
+        # A task over the byte budget on its own still runs once nothing else is in flight
+        if self.max_bytes > 0 and self.bytes_in_flight > 0 and self.bytes_in_flight + weight > self.max_bytes:
+            return False
+        return True
+
+    def __has_host_counters(self) -> bool:
+        return self.host_counter is not None or self.host_bytes_counter is not None
+
+    def __take_local(self, weight: int):
+        self.running += 1
+        self.bytes_in_flight += weight
+
+    def __give_back_local(self, weight: int):
+        self.running -= 1
+        self.bytes_in_flight -= weight
+
+    def __try_add_host(self, weight: int) -> bool:
+        # Blocks on the flock of the counters, so it only ever runs in the executor
+        if self.host_counter is not None and not self.host_counter.try_add(1, self.host_max_concurrent):
+            return False
+        if self.host_bytes_counter is not None and weight > 0:
+            if not self.host_bytes_counter.try_add(weight, self.host_max_bytes):
+                if self.host_counter is not None:
+                    self.host_counter.add(-1)
+                return False
+        return True
+
+    def __release_host_now(self, weight: int):
+        if self.host_counter is not None:
+            self.host_counter.add(-1)
+        if self.host_bytes_counter is not None and weight > 0:
+            self.host_bytes_counter.add(-weight)
+
+    def __release_host(self, weight: int):
+        def released(future: asyncio.Future):
+            if not future.cancelled() and future.exception() is not None:
+                logger.error(f"Could not release host capacity due to {future.exception()}")
+            self.__wake_host_watcher()
+
+        asyncio.get_running_loop().run_in_executor(None, self.__release_host_now, weight).add_done_callback(released)
+
+    async def __take_host(self, weight: int) -> bool:
+        taking = asyncio.get_running_loop().run_in_executor(None, self.__try_add_host, weight)
+        try:
+            return await asyncio.shield(taking)
+        except asyncio.CancelledError:
+            # The executor thread still finishes, give back what it took once it did
+            def taken(future: asyncio.Future):
+                if not future.cancelled() and future.exception() is None and future.result():
+                    self.__release_host(weight)
+
+            taking.add_done_callback(taken)
+            raise
+
+    def __wake_host_watcher(self):
+        if self.waiters and self.__has_host_counters():
+            self.host_wakeup.set()
+            if self.host_watcher is None:
+                self.host_watcher = asyncio.create_task(self.__watch_host())
+
+    async def __watch_host(self):
+        # Host capacity is taken off the event loop, so with host counters a single watcher per worker serves the
+        # waiters. It is woken when this worker frees capacity and polls for capacity freed by other workers
+        try:
+            while True:
+                self.host_wakeup.clear()
+                while self.waiters and self.waiters[0][2].done():  # Cancelled while waiting
+                    heapq.heappop(self.waiters)
+                if not self.waiters:
+                    return
+                head = self.waiters[0]
+                _, _, waiter, weight = head
+                if self.__has_local_capacity(weight):
+                    self.__take_local(weight)
+                    taken = False
+                    try:
+                        taken = await self.__take_host(weight)
+                    finally:
+                        if not taken:
+                            self.__give_back_local(weight)
+                    if taken:
+                        self.waiters.remove(head)
+                        heapq.heapify(self.waiters)
+                        if waiter.done():  # Cancelled while its capacity was being taken
+                            self.release(weight)
+                        else:
+                            waiter.set_result(None)
+                        continue
+                try:
+                    await asyncio.wait_for(self.host_wakeup.wait(), config.NVCF_SHARED_STATE_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self.host_watcher = None
+
+    async def acquire(self, priority: NvidiaPriority, task_id: str, weight: int = 0):
+        enqueue_time = time.time()
+        class_stats = self.class_stats[priority]
+        if len(self.waiters) == 0 and self.__has_local_capacity(weight):
+            self.__take_local(weight)
+            taken = False
+            try:
+                taken = not self.__has_host_counters() or await self.__take_host(weight)
+            finally:
+                if not taken:
+                    self.__give_back_local(weight)
+            if taken:
+                class_stats.record_wait(0.0)
+                return
+
+        waiter = asyncio.get_running_loop().create_future()
+        rank = enqueue_time + self.aging_offsets[priority]
+        heapq.heappush(self.waiters, (rank, next(self.sequence), waiter, weight))
+        class_stats.queued += 1
+        self.__dispatch()
+        logger.info(f"Task {task_id} queued with priority {priority.value}")
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The capacity was handed over right as we got cancelled, pass it on
+                self.release(weight)
+            else:
+                waiter.cancel()
+            raise
+        finally:
+            class_stats.queued -= 1
+        class_stats.record_wait(time.time() - enqueue_time)
+
+    def release(self, weight: int = 0):
+        self.__give_back_local(weight)
+        if self.__has_host_counters():
+            # The waiters are woken once the host counters took it back
+            self.__release_host(weight)
+        else:
+            self.__dispatch()
+
+    def __dispatch(self):
+        if self.__has_host_counters():
+            self.__wake_host_watcher()
+            return
+        while self.waiters:
+            _, _, waiter, weight = self.waiters[0]
+            if waiter.done():  # Cancelled while waiting
+                heapq.heappop(self.waiters)
+                continue
+            # The head waits for its capacity rather than letting lighter tasks pass, so heavy tasks never starve
+            if not self.__has_local_capacity(weight):
+                return
+            heapq.heappop(self.waiters)
+            self.__take_local(weight)
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, priority: NvidiaPriority, task_id: str, weight: int = 0):
+        await self.acquire(priority, task_id, weight)
+        try:
+            yield
+        finally:
+            self.release(weight)
+
+    async def stats(self) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        return {
+            "max_concurrent": self.max_concurrent,
+            "running": self.running,
+            "queued": sum(class_stats.queued for class_stats in self.class_stats.values()),
+            "host_running": await loop.run_in_executor(None, self.host_counter.total) if self.host_counter else None,
+            "max_bytes": self.max_bytes,
+            "bytes_in_flight": self.bytes_in_flight,
+            "host_bytes_in_flight": (
+                await loop.run_in_executor(None, self.host_bytes_counter.total) if self.host_bytes_counter else None
+            ),
+            "classes": {
+                priority.value: class_stats.stats()
+                for priority, class_stats in self.class_stats.items()
+            },
+        }
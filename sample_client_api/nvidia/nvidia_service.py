@@ -1,13 +1,15 @@
 import asyncio
 import io
 import json
-from typing import Tuple, Optional, TypeVar, Callable, Dict
+import os
+import random
+import time
+from typing import Tuple, Optional, TypeVar, Callable, Dict, Any, Union, List, Awaitable
 
-import PIL
-import aioboto3
-import numpy
-import numpy as np
-from pydantic import BaseModel
+from fastapi import HTTPException, Header, Request
+from starlette import status
+from starlette.background import BackgroundTask
+from starlette.responses import Response, StreamingResponse
 
 from sample_client_api import config
 from sample_client_api.api.network_models import (
@@ -21,17 +23,51 @@ from sample_client_api.config import (
     NVCF_FACESWAP_FUNCTION_ID,
     NVCF_FACESWAP_IP_FUNCTION_ID,
     NVCF_AVATAR_FUNCTION_ID,
+    NVCF_TXT2VID_FUNCTION_ID,
 )
 from sample_client_api.log_handling import get_logger_for_file
 from sample_client_api.model_constants import SD_XL_0_9
 from sample_client_api.nvidia.client.nvidia_request import (
     NvidiaRequest,
-    STYLES_TO_NVIDIA_FUNCTIONS,
-    STYLES_TO_IMG2IMG_NVIDIA_FUNCTIONS,
+    styles_to_nvidia_functions,
+    styles_to_img2img_nvidia_functions,
     NvidiaRequestParameter,
     AssetLoader,
-    asset_from_image,
+    asset_from_bytes,
 )
+from sample_client_api.nvidia.client.nvidia_deadline import (
+    REQUEST_TIMEOUT_HEADER,
+    REQUEST_ARRIVAL_TIME,
+    REQUEST_HEADER_TIMEOUT,
+    NvidiaDeadlineExceededException,
+    request_deadline,
+    remaining_seconds,
+    check_deadline,
+)
+from sample_client_api.nvidia.client.nvidia_response_handler import detect_image_content_type
+from sample_client_api.nvidia.nvidia_video_pipeline import S3MultipartFrameSink
+from sample_client_api.nvidia.nvidia_input_cache import VariantKey
+from sample_client_api.nvidia.nvidia_memory_estimate import REQUEST_ROUTE, estimate_request_bytes
+from sample_client_api.nvidia.nvidia_task_journal import NvidiaJournaledTask, NvidiaTaskState
+from sample_client_api.nvidia.nvidia_output_derivatives import (
+    NvidiaDerivativeSpec,
+    decode_output,
+    derivative_specs,
+    encode_derivative,
+)
+from sample_client_api.nvidia.nvidia_upload_encoding import (
+    MASK_UPLOAD_ENCODING_POLICY,
+    NvidiaUploadEncodingPolicy,
+    encode_upload,
+    record_upload_encoding,
+    upload_encoding_policy,
+)
+from sample_client_api.nvidia.nvidia_mask_pipeline import (
+    MASK_CONTENT_TYPE,
+    NvidiaMaskSettings,
+    process_mask,
+)
+from sample_client_api.nvidia_request_models import ImageInput
 from sample_client_api.nvidia_request_models.final_models import (
     NvidiaClientRequest,
     InstructNvidiaClientRequest,
@@ -43,7 +79,12 @@ from sample_client_api.nvidia_request_models.final_models import (
     AvatarNvidiaClientRequest,
     DiffusionNvidiaClientRequest,
     BaseNvidiaClientRequest,
+    NvidiaResponseMode,
+    NvidiaPriority,
+    SDXLNvidiaClientRequest,
+    TextToVideoNvidiaClientRequest,
 )
+from sample_client_api.tracing import span
 from sample_client_api.synth.synth_defaults import (
     SDXL_BASE_STEPS,
     T2I_SCHEDULER_STEPS,
@@ -54,66 +95,345 @@ from sample_client_api.synth.synth_defaults import (
     INSTRUCT_IMAGE_CFG_MIN,
     INSTRUCT_IMAGE_CFG_MAX,
 )
-from sample_client_api.synth.synth_spec_resolution_scaling import compute_base_dimensions
+from sample_client_api.synth.synth_spec_resolution_scaling import (
+    compute_base_dimensions,
+    get_final_sdxl_resolution,
+)
 
 log = get_logger_for_file(__name__)
 
-session = aioboto3.Session()
+# Created on first use, importing aioboto3 alone takes a good part of the worker startup
+session = None
 
 T = TypeVar("T", bound=BaseNvidiaClientRequest)
+R = TypeVar("R")
+
+NVIDIA_OUTPUT_URI_HEADER = "X-Nvidia-Output-Uri"
+NVIDIA_PROFILE_HEADER = "X-Nvidia-Profile"
+NVIDIA_SEED_HEADER = "X-Nvidia-Seed"
 
 
-async def __upload_to_s3(fileobj: io.BytesIO, request: T) -> str:
+def get_s3_session():
+    global session
+    if session is None:
+        import aioboto3
+
+        session = aioboto3.Session()
+    return session
+
+
+async def get_s3_client():
+    if IMMUTABLE_BOOTUP_MANAGER.s3_client is None:
+        from aiobotocore.config import AioConfig
+
+        context = get_s3_session().client(
+            "s3", config=AioConfig(max_pool_connections=config.S3_MAX_POOL_CONNECTIONS)
+        )
+        s3_client = await context.__aenter__()
+        # Another task may have opened the client while this one was waiting for its own
+        if IMMUTABLE_BOOTUP_MANAGER.s3_client is None:
+            IMMUTABLE_BOOTUP_MANAGER.s3_client = s3_client
+            IMMUTABLE_BOOTUP_MANAGER.s3_client_context = context
+        else:
+            await context.__aexit__(None, None, None)
+    return IMMUTABLE_BOOTUP_MANAGER.s3_client
+
+
+async def warm_up_s3():
+    # Loads the S3 service model, resolves the credentials and opens a connection of the shared client
+    s3_client = await get_s3_client()
+    await s3_client.head_bucket(Bucket=NVIDIA_S3_BUCKET)
+
+
+def __s3_output_location(
+        request: T, index: Optional[int] = None, extension: str = "jpeg"
+) -> Tuple[str, str]:
     output_bucket = request.s3_output_bucket or NVIDIA_S3_BUCKET
-    output_key = request.s3_output_key or f"{request.task_id}.jpeg"
-    async with session.client("s3") as s3_client:
-        await s3_client.upload_fileobj(fileobj, output_bucket, output_key)
-        s3_uri = f"s3://{output_bucket}/{output_key}"
-        log.info(f"Uploaded to {s3_uri}")
+    output_key = request.s3_output_key or f"{request.task_id}.{extension}"
+    if index is not None:
+        # Images of a batch are stored next to each other as {key}_{index}.{ext}
+        root, extension = os.path.splitext(output_key)
+        output_key = f"{root}_{index}{extension}"
+    return output_bucket, output_key
+
+
+async def __put_to_s3(file: bytes, output_bucket: str, output_key: str, **kwargs) -> str:
+    # The bytes are the body as is, upload_fileobj would read them back into new buffers first
+    with span("s3.put_object", {"s3.bucket": output_bucket, "s3.key": output_key, "bytes": len(file)}):
+        s3_client = await get_s3_client()
+        await s3_client.put_object(Bucket=output_bucket, Key=output_key, Body=file, **kwargs)
+    return f"s3://{output_bucket}/{output_key}"
+
+
+async def __upload_to_s3(
+        file: bytes, request: T, index: Optional[int] = None
+) -> str:
+    output_bucket, output_key = __s3_output_location(request, index)
+    s3_uri = await __put_to_s3(file, output_bucket, output_key)
+    log.info(f"Uploaded to {s3_uri}")
+
+    return s3_uri
+
+
+async def __upload_to_s3_in_background(file: bytes, request: T):
+    # Runs after the response has been sent, so there is nobody left to report a failure to
+    try:
+        await __upload_to_s3(file, request)
+    except Exception as e:
+        log.error(
+            f"Background upload failed for {request.task_id} due to {e}", exc_info=True
+        )
+
+
+async def __upload_batch_to_s3(files: List[bytes], request: T) -> List[str]:
+    return [
+        *await asyncio.gather(
+            *[
+                __upload_to_s3(file, request, index)
+                for index, file in enumerate(files)
+            ]
+        )
+    ]
+
+
+def __s3_sibling_location(
+        request: T, index: Optional[int], name: str, extension: str
+) -> Tuple[str, str]:
+    # Derivatives and intermediate images are stored next to their output as {key}_{name}.{ext}
+    output_bucket, output_key = __s3_output_location(request, index)
+    root, _ = os.path.splitext(output_key)
+    return output_bucket, f"{root}_{name}.{extension}"
+
+
+async def __upload_derivative_to_s3(
+        file: bytes, request: T, index: Optional[int], spec: NvidiaDerivativeSpec
+) -> str:
+    output_bucket, output_key = __s3_sibling_location(request, index, spec.name, spec.extension())
+    s3_uri = await __put_to_s3(file, output_bucket, output_key, ContentType=spec.content_type())
+    log.info(f"Uploaded derivative {spec.name} to {s3_uri}")
 
     return s3_uri
 
 
+async def upload_intermediate_to_s3(file: bytes, request: T, name: str) -> str:
+    content_type = detect_image_content_type(file)
+    output_bucket, output_key = __s3_sibling_location(request, None, name, content_type.split("/")[-1])
+    s3_uri = await __put_to_s3(file, output_bucket, output_key, ContentType=content_type)
+    log.info(f"Uploaded intermediate {name} to {s3_uri}")
+
+    return s3_uri
+
+
+async def __build_derivatives(
+        file: bytes, request: T, index: Optional[int]
+) -> Dict[str, Optional[str]]:
+    executor = IMMUTABLE_BOOTUP_MANAGER.derivative_executor
+    loop = asyncio.get_running_loop()
+    image = await loop.run_in_executor(executor, decode_output, file)
+
+    async def build(spec: NvidiaDerivativeSpec) -> Optional[str]:
+        try:
+            derivative = await loop.run_in_executor(executor, encode_derivative, image, spec)
+            return await __upload_derivative_to_s3(derivative, request, index, spec)
+        except Exception as e:
+            log.error(f"Derivative {spec.name} failed for {request.task_id} due to {e}", exc_info=True)
+            return None
+
+    specs = derivative_specs()
+    s3_uris = await asyncio.gather(*[build(spec) for spec in specs])
+    return {spec.name: s3_uri for spec, s3_uri in zip(specs, s3_uris)}
+
+
+async def __upload_derivatives_to_s3(files: List[bytes], request: T) -> Dict[str, List[str]]:
+    # A failed derivative never fails the request, it is only left out of the response
+    specs = derivative_specs()
+    if not specs:
+        return {}
+    indices = [None] if len(files) == 1 else range(len(files))
+    try:
+        derivatives = await asyncio.gather(
+            *[__build_derivatives(file, request, index) for file, index in zip(files, indices)]
+        )
+    except Exception as e:
+        log.error(f"Derivatives failed for {request.task_id} due to {e}", exc_info=True)
+        return {}
+    return {
+        spec.name: [file_derivatives[spec.name] for file_derivatives in derivatives]
+        for spec in specs
+        if all(file_derivatives[spec.name] for file_derivatives in derivatives)
+    }
+
+
+async def build_output_response(
+        files: List[bytes], client_request: T, profile: Dict[str, Any]
+) -> Union[NvidiaOutput, Response]:
+    if client_request.response_mode in (NvidiaResponseMode.S3, NvidiaResponseMode.PROGRESSIVE):
+        async def upload_outputs() -> List[str]:
+            if len(files) == 1:
+                return [await __upload_to_s3(files[0], client_request)]
+            return await __upload_batch_to_s3(files, client_request)
+
+        # Derivatives are encoded and uploaded while the outputs themselves are uploading
+        s3_uris, derivatives = await asyncio.gather(
+            upload_outputs(), __upload_derivatives_to_s3(files, client_request)
+        )
+        return NvidiaOutput(
+            output=s3_uris[0], outputs=s3_uris, derivatives=derivatives, profile=profile
+        )
+
+    if len(files) != 1:
+        raise HTTPException(
+            detail=f"Task {client_request.task_id} produced {len(files)} images but "
+                   f"response_mode {client_request.response_mode.value} only supports a single image",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+    file = files[0]
+    headers = {"Content-Length": str(len(file))}
+    if profile:
+        headers[NVIDIA_PROFILE_HEADER] = json.dumps(profile)
+
+    background = None
+    if client_request.response_mode == NvidiaResponseMode.BYTES_AND_S3:
+        output_bucket, output_key = __s3_output_location(client_request)
+        headers[NVIDIA_OUTPUT_URI_HEADER] = f"s3://{output_bucket}/{output_key}"
+        background = BackgroundTask(__upload_to_s3_in_background, file, client_request)
+
+    return StreamingResponse(
+        iter([file]),
+        media_type=detect_image_content_type(file),
+        headers=headers,
+        background=background,
+    )
+
+
+def __encode_input_image(
+        data: bytes, size: Optional[Tuple[int, int]], policy: NvidiaUploadEncodingPolicy
+) -> Tuple[bytes, str]:
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(data))
+    image_format = image.format
+    if size is not None:
+        image = image.resize(size)
+    return encode_upload(image, image_format, policy)
+
+
+def __encode_input_mask(
+        data: bytes, size: Optional[Tuple[int, int]], settings: NvidiaMaskSettings
+) -> Tuple[bytes, str]:
+    return process_mask(data, size, settings), MASK_CONTENT_TYPE
+
+
+def __timed_encode(
+        encode_sync: Callable[[bytes], Tuple[bytes, str]], data: bytes
+) -> Tuple[Tuple[bytes, str], float]:
+    start = time.perf_counter()
+    encoded = encode_sync(data)
+    return encoded, time.perf_counter() - start
+
+
+def __construct_cached_asset(
+        function_id: str,
+        target: ImageInput,
+        variant_key: VariantKey,
+        description: str,
+        encode_sync: Callable[[bytes], Tuple[bytes, str]],
+) -> AssetLoader:
+    s3_attributes = {"s3.bucket": target.image_bucket, "s3.key": target.image_key}
+
+    async def fetch() -> Tuple[str, bytes]:
+        log.info(f"Loading image from {target.image_bucket}/{target.image_key}")
+        with span("s3.get_object", s3_attributes) as current:
+            s3_client = await get_s3_client()
+            response = await s3_client.get_object(
+                Bucket=target.image_bucket, Key=target.image_key
+            )
+            async with response["Body"] as body:
+                data = await body.read()
+            current.set_attribute("bytes", len(data))
+            return response["ETag"], data
+
+    async def fetch_etag() -> str:
+        with span("s3.head_object", s3_attributes):
+            s3_client = await get_s3_client()
+            response = await s3_client.head_object(
+                Bucket=target.image_bucket, Key=target.image_key
+            )
+            return response["ETag"]
+
+    async def encode(data: bytes, _: VariantKey) -> Tuple[bytes, str]:
+        log.info(f"Encoding {description} {target.image_bucket}/{target.image_key}")
+        with span("input.encode", {**s3_attributes, "description": description}) as current:
+            loop = asyncio.get_running_loop()
+            encoded, encode_seconds = await loop.run_in_executor(None, __timed_encode, encode_sync, data)
+            record_upload_encoding(function_id, len(data), len(encoded[0]), encode_seconds)
+            current.set_attribute("bytes_before", len(data))
+            current.set_attribute("bytes_after", len(encoded[0]))
+            return encoded
+
+    async def load():
+        image_data, content_type = await IMMUTABLE_BOOTUP_MANAGER.input_image_cache.load(
+            (target.image_bucket, target.image_key), variant_key, fetch, fetch_etag, encode
+        )
+        return asset_from_bytes(io.BytesIO(image_data), content_type)
+
+    return load
+
+
 def __construct_asset(
+        function_id: str,
         target: Optional[ImageInput],
         width: Optional[int] = None,
         height: Optional[int] = None,
+        policy: Optional[NvidiaUploadEncodingPolicy] = None,
 ) -> Optional[AssetLoader]:
     if target is None:
         return None
 
-    async def load():
-        log.info(
-            f"Loading image from {target.image_bucket}/{target.image_key}{f',resizing to {width}x{height}' if width and height else ''} "
-        )
-
-        loop = asyncio.get_running_loop()
-        data = io.BytesIO()
-        async with session.client("s3") as s3_client:
-            await s3_client.download_fileobj(
-                target.image_bucket, target.image_key, data
-            )
-
-        if width and height:
-            image = await loop.run_in_executor(None, lambda: PIL.Image.open(data))
-            image_format = image.format
+    size = (width, height) if width and height else None
+    policy = policy or upload_encoding_policy(function_id)
+    return __construct_cached_asset(
+        function_id,
+        target,
+        (size, policy.key()),
+        f"image{f', resizing to {width}x{height},' if size else ''}",
+        lambda data: __encode_input_image(data, size, policy),
+    )
 
-            image = await loop.run_in_executor(
-                None, lambda: image.resize((width, height))
-            )
-        else:
-            image = await loop.run_in_executor(None, lambda: PIL.Image.open(data))
-            image_format = image.format
 
-        return asset_from_image(image, image_format)
+def __construct_mask_asset(
+        function_id: str,
+        target: Optional[ImageInput],
+        width: int,
+        height: int,
+) -> Optional[AssetLoader]:
+    if target is None:
+        return None
 
-    return load
+    size = (width, height)
+    settings = NvidiaMaskSettings()
+    # Keyed apart from the plain resizes, an object may be uploaded both as an image and as a mask
+    return __construct_cached_asset(
+        function_id,
+        target,
+        ("mask", size, settings.key()),
+        f"mask at {width}x{height}",
+        lambda data: __encode_input_mask(data, size, settings),
+    )
 
 
 def __request_resolution(
         request: NvidiaClientRequest,
+        route: Optional[str] = None,
 ) -> Tuple[NvidiaRequestParameter, NvidiaRequestParameter]:
-    width, height = compute_base_dimensions(
+    compute_dimensions = compute_base_dimensions
+    if route is not None and route in config.RESOLUTION_BUCKETING_ROUTES:
+        # The planner needs numpy, so it is only loaded once a bucketed route is hit
+        from sample_client_api.synth.synth_resolution_buckets import get_resolution_bucket_planner
+
+        compute_dimensions = get_resolution_bucket_planner().snap_base_dimensions
+    width, height = compute_dimensions(
         should_lower_resolution_drastically=config.DO_V1_LOWER_RES,
         is_sd_xl=False,
         final_model=request.model,
@@ -126,66 +446,314 @@ def __request_resolution(
     )
 
 
+def __sdxl_resolution(
+        request: NvidiaClientRequest,
+) -> Tuple[NvidiaRequestParameter, NvidiaRequestParameter]:
+    # Nothing upscales the SDXL output afterwards, so it is generated at the requested size
+    width, height = get_final_sdxl_resolution(request.width, request.height)
+
+    return NvidiaRequestParameter(width, "UINT16"), NvidiaRequestParameter(
+        height, "UINT16"
+    )
+
+
 def __request_model(request: T) -> str:
     return request.model or config.DEFAULT_STYLE_MODEL
 
 
+def __model_function_id(functions: Dict[str, str], model: str, request: T) -> str:
+    if model not in functions:
+        raise HTTPException(
+            detail=f"Task {request.task_id} asks for model {model}, which has no NVCF function",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    return functions[model]
+
+
 def __request_guidance(request: GuidanceNvidiaClientRequest):
     return request.guidance or SD_CFG_SCALE_DEFAULT
 
 
 def __instruct_guidance():
-    return np.random.uniform(low=INSTRUCT_IMAGE_CFG_MIN, high=INSTRUCT_IMAGE_CFG_MAX)
+    return random.uniform(INSTRUCT_IMAGE_CFG_MIN, INSTRUCT_IMAGE_CFG_MAX)
 
 
 def __get_seed(seed: Optional[int]) -> NvidiaRequestParameter:
     if seed is None:
-        seed = numpy.random.randint(0, int(1e9))
+        seed = random.randrange(0, int(1e9))
 
     return NvidiaRequestParameter(seed, "UINT32")
 
 
+def with_default_priority(client_request: T, priority: NvidiaPriority) -> T:
+    if client_request.priority is None:
+        client_request.priority = priority
+    return client_request
+
+
+async def read_request_timeout(
+        request_timeout: Optional[float] = Header(default=None, alias=REQUEST_TIMEOUT_HEADER, gt=0)
+):
+    REQUEST_ARRIVAL_TIME.set(time.time())
+    REQUEST_HEADER_TIMEOUT.set(request_timeout)
+
+
+async def read_request_route(request: Request):
+    REQUEST_ROUTE.set(request.url.path.rstrip("/").rsplit("/", 1)[-1])
+
+
+async def __run_nvidia_task(
+        request: NvidiaRequest, client_request: T
+) -> Tuple[List[bytes], List[Any]]:
+    return await __run_scheduled(
+        request,
+        client_request,
+        lambda: IMMUTABLE_BOOTUP_MANAGER.nvidia_account_pool.handle_nvidia_task(
+            request, client_request.task_id
+        ),
+    )
+
+
+async def __run_scheduled(
+        request: NvidiaRequest, client_request: T, run: Callable[[], Awaitable[R]], copies: int = 1
+) -> R:
+    priority = client_request.priority or NvidiaPriority.STANDARD
+    request.deadline = request_deadline(client_request.timeout_seconds)
+    scheduler = IMMUTABLE_BOOTUP_MANAGER.nvidia_scheduler
+    weight = estimate_request_bytes(request) * copies
+    try:
+        check_deadline(request.deadline, client_request.task_id, "waiting to be sent")
+        try:
+            with span("scheduler.acquire", {"priority": priority.value, "weight": weight}):
+                await asyncio.wait_for(
+                    scheduler.acquire(priority, client_request.task_id, weight),
+                    remaining_seconds(request.deadline),
+                )
+        except asyncio.TimeoutError:
+            raise NvidiaDeadlineExceededException(
+                client_request.task_id, "queued for a slot", request.deadline
+            )
+        try:
+            return await run()
+        finally:
+            scheduler.release(weight)
+    except NvidiaDeadlineExceededException as e:
+        raise HTTPException(detail=str(e), status_code=status.HTTP_504_GATEWAY_TIMEOUT)
+
+
+def __build_request(
+        client_request: T, request_factory: Callable[[T], NvidiaRequest]
+) -> NvidiaRequest:
+    if client_request.response_mode == NvidiaResponseMode.PROGRESSIVE:
+        raise HTTPException(
+            detail=f"Task {client_request.task_id} asks for response_mode {NvidiaResponseMode.PROGRESSIVE.value}, "
+                   f"which only txt2img supports",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    with span(
+            "build_request",
+            {"request.factory": getattr(request_factory, "__name__", None), "task_id": client_request.task_id},
+    ) as current:
+        request = request_factory(client_request)
+        current.set_attribute("nvcf.function_id", request.function_id)
+        return request
+
+
 async def handle_request(
         client_request: T, request_factory: Callable[[T], NvidiaRequest]
 ):
-    request = request_factory(client_request)
+    request = __build_request(client_request, request_factory)
+    if client_request.variants:
+        return await __handle_variants(request, client_request)
+    if client_request.response_mode != NvidiaResponseMode.BYTES:
+        # Journaled with the task, so the result still ends up in S3 when this worker dies while waiting for it
+        request.output_target = client_request.model_dump(include={"task_id", "s3_output_bucket", "s3_output_key"})
 
-    result = await IMMUTABLE_BOOTUP_MANAGER.nvidia_task_handler.handle_nvidia_task(
-        request, client_request.task_id
-    )
+    result = await __run_nvidia_task(request, client_request)
 
-    (file, outputs) = result
+    (files, outputs) = result
 
     if len(outputs):
         profile = json.loads(outputs[0])
     else:
         profile = {}
 
-    return NvidiaOutput(
-        output=await __upload_to_s3(io.BytesIO(file), client_request), profile=profile
+    return await build_output_response(files, client_request, profile)
+
+
+async def __handle_variants(
+        request: NvidiaRequest, client_request: T
+) -> Union[NvidiaOutput, Response]:
+    seed = request.parameters.get("seed")
+    if not isinstance(seed, NvidiaRequestParameter):
+        raise HTTPException(
+            detail=f"Task {client_request.task_id} has no seed to generate variants with",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+    required = client_request.variants_required or client_request.variants
+    if client_request.response_mode != NvidiaResponseMode.S3 and required * request.batch_size > 1:
+        raise HTTPException(
+            detail=f"Task {client_request.task_id} would produce {required * request.batch_size} images but "
+                   f"response_mode {client_request.response_mode.value} only supports a single image",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+    seeds = [(seed.value + index) % 2 ** 32 for index in range(client_request.variants)]
+    # Every variant holds its own images, but the asset uploads are shared
+    results = await __run_scheduled(
+        request,
+        client_request,
+        lambda: IMMUTABLE_BOOTUP_MANAGER.nvidia_account_pool.handle_nvidia_variants(
+            request,
+            client_request.task_id,
+            [{"seed": NvidiaRequestParameter(variant_seed, "UINT32")} for variant_seed in seeds],
+            required,
+        ),
+        copies=client_request.variants,
     )
 
+    files = [file for _, variant_files, _ in results for file in variant_files]
+    variant_seeds = [seeds[index] for index, variant_files, _ in results for _ in variant_files]
+    outputs = results[0][2]
+    profile = json.loads(outputs[0]) if len(outputs) else {}
+    response = await build_output_response(files, client_request, profile)
+    if isinstance(response, NvidiaOutput):
+        response.seeds = variant_seeds
+    else:
+        response.headers[NVIDIA_SEED_HEADER] = str(variant_seeds[0])
+    return response
+
+
+def __reject_variants(client_request: T):
+    if client_request.variants:
+        raise HTTPException(
+            detail=f"Task {client_request.task_id} asks for variants, which this route does not support",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+
+async def handle_video_request(
+        client_request: T, request_factory: Callable[[T], NvidiaRequest]
+):
+    __reject_variants(client_request)
+    if client_request.response_mode != NvidiaResponseMode.S3:
+        raise HTTPException(
+            detail=f"Task {client_request.task_id} generates a video which only supports response_mode "
+                   f"{NvidiaResponseMode.S3.value}",
+            status_code=status.HTTP_400_BAD_REQUEST,
+        )
+
+    request = __build_request(client_request, request_factory)
+    output_bucket, output_key = __s3_output_location(client_request, extension="mjpeg")
+
+    s3_client = await get_s3_client()
+    frame_sink = S3MultipartFrameSink(s3_client, output_bucket, output_key)
+    request.frame_writer = frame_sink.write_frame
+    try:
+        (_, outputs) = await __run_nvidia_task(request, client_request)
+        s3_uri = await frame_sink.finish()
+    except BaseException:
+        await frame_sink.abort()
+        raise
+
+    if len(outputs):
+        profile = json.loads(outputs[0])
+    else:
+        profile = {}
+
+    return NvidiaOutput(output=s3_uri, outputs=[s3_uri], profile=profile)
+
+
+async def __recover_task(task: NvidiaJournaledTask):
+    journal = IMMUTABLE_BOOTUP_MANAGER.task_journal
+    try:
+        result = await IMMUTABLE_BOOTUP_MANAGER.nvidia_account_pool.resume_task(task)
+        if result is not None:
+            (files, outputs) = result
+            profile = json.loads(outputs[0]) if len(outputs) else {}
+            output = await build_output_response(files, BaseNvidiaClientRequest(**task.output), profile)
+            journal.recovered += 1
+            log.info(f"Recovered {task.task_id} with req_id {task.req_id} to {output.outputs}")
+        elif task.state == NvidiaTaskState.INVOKED:
+            journal.abandoned += 1
+    except Exception as e:
+        journal.abandoned += 1
+        log.error(f"Could not recover {task.task_id} with req_id {task.req_id} due to {e!r}", exc_info=True)
+    # Left in the journal when cancelled (the worker is shutting down), so the next worker tries again
+    journal.remove(task.id)
+
+
+async def recover_journaled_tasks():
+    journal = IMMUTABLE_BOOTUP_MANAGER.task_journal
+    if journal is None:
+        return
+    tasks = await journal.claim_orphaned_tasks()
+    if len(tasks) == 0:
+        return
+    log.info(f"Recovering {len(tasks)} tasks of workers that died: {[task.task_id for task in tasks]}")
+    await asyncio.gather(*[__recover_task(task) for task in tasks])
+
 
 async def handle_custom_request(
         request: NvidiaRequest,
-        task_id: str,
+        client_request: T,
 ):
-    result = await IMMUTABLE_BOOTUP_MANAGER.nvidia_task_handler.handle_nvidia_task(
-        request, task_id
-    )
+    __reject_variants(client_request)
+    result = await __run_nvidia_task(request, client_request)
 
-    (file, _) = result
+    (files, _) = result
 
-    return io.BytesIO(file)
+    return io.BytesIO(files[0])
 
 
 def process_text_to_image(
         request: GuidanceNvidiaClientRequest,
 ) -> NvidiaRequest:
-    width, height = __request_resolution(request)
+    width, height = __request_resolution(request, "txt2img")
+
+    return NvidiaRequest(
+        function_id=__model_function_id(styles_to_nvidia_functions(), __request_model(request), request),
+        parameters={
+            "prompt": request.prompt,
+            "negative_prompt": request.negative_prompt,
+            "width": width,
+            "height": height,
+            "guidance": __request_guidance(request),
+            "steps": NvidiaRequestParameter(T2I_SCHEDULER_STEPS, "UINT16"),
+            "seed": __get_seed(request.seed),
+        },
+    )
+
+
+def process_sdxl(request: SDXLNvidiaClientRequest) -> NvidiaRequest:
+    width, height = __sdxl_resolution(request)
+    batch_size = request.batch_size or 1
+
+    return NvidiaRequest(
+        function_id=__model_function_id(styles_to_nvidia_functions(), request.model or SD_XL_0_9, request),
+        parameters={
+            "prompt": request.prompt,
+            "negative_prompt": request.negative_prompt,
+            "width": width,
+            "height": height,
+            "guidance": __request_guidance(request),
+            "base_steps": NvidiaRequestParameter(request.base_steps, "UINT16"),
+            "refiner_steps": NvidiaRequestParameter(request.refiner_steps, "UINT16"),
+            "scheduler": request.scheduler.value if request.scheduler else None,
+            "seed": __get_seed(request.seed),
+            "batch_size": NvidiaRequestParameter(batch_size, "UINT16"),
+        },
+        batch_size=batch_size,
+    )
+
+
+def process_text_to_video(
+        request: TextToVideoNvidiaClientRequest,
+) -> NvidiaRequest:
+    width, height = __request_resolution(request, "txt2vid")
 
     return NvidiaRequest(
-        function_id=STYLES_TO_NVIDIA_FUNCTIONS[__request_model(request)],
+        function_id=NVCF_TXT2VID_FUNCTION_ID,
         parameters={
             "prompt": request.prompt,
             "negative_prompt": request.negative_prompt,
@@ -194,7 +762,9 @@ def process_text_to_image(
             "guidance": __request_guidance(request),
             "steps": NvidiaRequestParameter(T2I_SCHEDULER_STEPS, "UINT16"),
             "seed": __get_seed(request.seed),
+            "num_frames": NvidiaRequestParameter(request.num_frames, "UINT16"),
         },
+        batch_size=request.num_frames,
     )
 
 
@@ -202,9 +772,10 @@ def process_image_to_image(
         request: ImageToImageNvidiaClientRequest,
 ) -> NvidiaRequest:
     steps = SDXL_BASE_STEPS if request.model == SD_XL_0_9 else I2I_SCHEDULER_STEPS
-    width, height = __request_resolution(request)
+    width, height = __request_resolution(request, "img2img")
+    function_id = __model_function_id(styles_to_img2img_nvidia_functions(), __request_model(request), request)
     return NvidiaRequest(
-        function_id=STYLES_TO_IMG2IMG_NVIDIA_FUNCTIONS[__request_model(request)],
+        function_id=function_id,
         parameters={
             "prompt": request.prompt,
             "negative_prompt": request.negative_prompt,
@@ -216,13 +787,13 @@ def process_image_to_image(
             "seed": __get_seed(request.seed),
         },
         assets={
-            "image": __construct_asset(request.image, width.value, height.value),
+            "image": __construct_asset(function_id, request.image, width.value, height.value),
         },
     )
 
 
 def process_inpaint(request: InpaintNvidiaClientRequest) -> NvidiaRequest:
-    width, height = __request_resolution(request)
+    width, height = __request_resolution(request, "inpaint")
 
     return NvidiaRequest(
         function_id=NVCF_INPAINT_FUNCTION_ID,
@@ -238,17 +809,17 @@ def process_inpaint(request: InpaintNvidiaClientRequest) -> NvidiaRequest:
         },
         assets={
             "input_image": __construct_asset(
-                request.input_image, width.value, height.value
+                NVCF_INPAINT_FUNCTION_ID, request.input_image, width.value, height.value
+            ),
+            "input_mask": __construct_mask_asset(
+                NVCF_INPAINT_FUNCTION_ID, request.input_mask, width.value, height.value
             ),
-            "input_mask": __construct_asset(
-                request.input_mask, width.value, height.value
-            ),  # TODO Need to invert
         },
     )
 
 
 def process_instruct(request: InstructNvidiaClientRequest) -> NvidiaRequest:
-    width, height = __request_resolution(request)
+    width, height = __request_resolution(request, "instruct")
 
     return NvidiaRequest(
         function_id=NVCF_INSTRUCT_FUNCTION_ID,
@@ -262,7 +833,7 @@ def process_instruct(request: InstructNvidiaClientRequest) -> NvidiaRequest:
             "seed": __get_seed(request.seed),
         },
         assets={
-            "image": __construct_asset(request.image, width.value, height.value),
+            "image": __construct_asset(NVCF_INSTRUCT_FUNCTION_ID, request.image, width.value, height.value),
         },
     )
 
@@ -288,8 +859,8 @@ def process_faceswap(request: FaceswapNvidiaClientRequest) -> NvidiaRequest:
         function_id=NVCF_FACESWAP_FUNCTION_ID,
         parameters=params,
         assets={
-            "source_image": __construct_asset(request.source_image),
-            "target_image": __construct_asset(request.target_image),
+            "source_image": __construct_asset(NVCF_FACESWAP_FUNCTION_ID, request.source_image),
+            "target_image": __construct_asset(NVCF_FACESWAP_FUNCTION_ID, request.target_image),
         },
     )
 
@@ -327,8 +898,8 @@ def process_faceswap_ip_adapter(
         function_id=NVCF_FACESWAP_IP_FUNCTION_ID,
         parameters=parameters,
         assets={
-            "source_image": __construct_asset(request.ip_image),
-            "target_image": __construct_asset(request.target_image),
+            "source_image": __construct_asset(NVCF_FACESWAP_IP_FUNCTION_ID, request.ip_image),
+            "target_image": __construct_asset(NVCF_FACESWAP_IP_FUNCTION_ID, request.target_image),
         },
     )
 
@@ -348,13 +919,13 @@ def process_avatar(request: AvatarNvidiaClientRequest) -> NvidiaRequest:
         },
         assets={
             "source_image": __construct_asset(
-                request.source_image, request.width, request.height
+                NVCF_AVATAR_FUNCTION_ID, request.source_image, request.width, request.height
             ),
         },
     )
 
 
-class NvidiaUpscalerRequest(BaseModel):
+class NvidiaUpscalerRequest(BaseNvidiaClientRequest):
     original_image: ImageInput
     desired_width: int
     desired_height: int
@@ -380,8 +951,11 @@ def process_diffusion(
             ),
         },
         assets={
-            "input_image_path": __construct_asset(request.input_image),
-            "mask_image_path": __construct_asset(request.mask_image),
+            "input_image_path": __construct_asset(function_id, request.input_image),
+            # The size the function works at is not known here, so the mask is only kept lossless
+            "mask_image_path": __construct_asset(
+                function_id, request.mask_image, policy=MASK_UPLOAD_ENCODING_POLICY
+            ),
         },
         profile_output_name="profile",
     )
@@ -395,6 +969,6 @@ def process_upscaler(request: NvidiaUpscalerRequest, function_id: str) -> Nvidia
             "desired_height": request.desired_height,
         },
         assets={
-            "original_image": __construct_asset(request.original_image),
+            "original_image": __construct_asset(function_id, request.original_image),
         },
     )
@@ -0,0 +1,134 @@
+import fcntl
+import hashlib
+import json
+import os
+from contextlib import contextmanager
+from typing import Optional, Any, Dict
+
+from sample_client_api.log_handling import get_logger_for_file
+
+logger = get_logger_for_file(__name__)
+
+
+def is_process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class SharedStateDirectory:
+    """
+    File backed state shared by every worker process on the host (e.g. the gunicorn workers). Files are guarded by
+    flock based locks and replaced atomically, so readers never see a partial write.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def __file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    @contextmanager
+    def lock(self, name: str):
+        fd = os.open(self.__file(f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            self.unlock(fd)
+
+    def try_lock(self, name: str) -> Optional[int]:
+        # Never blocks: the locked file descriptor to pass to unlock, or None while another holder has the lock
+        fd = os.open(self.__file(f"{name}.lock"), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return None
+        return fd
+
+    def unlock(self, fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def read_json(self, name: str) -> Optional[Any]:
+        try:
+            with open(self.__file(f"{name}.json")) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except ValueError as e:
+            logger.error(f"Ignoring corrupt shared state {name} due to {e}")
+            return None
+
+    def write_json(self, name: str, value: Any):
+        final_path = self.__file(f"{name}.json")
+        temporary_path = f"{final_path}.{os.getpid()}.tmp"
+        fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(value, f)
+        os.replace(temporary_path, final_path)
+
+
+class SharedTokenCache:
+    def __init__(self, directory: SharedStateDirectory, auth_url: str, username: str):
+        self.directory = directory
+        # Account details are hashed so the file names do not leak them
+        self.name = "token-" + hashlib.sha256(f"{auth_url}|{username}".encode()).hexdigest()[:16]
+
+    def load(self) -> Optional[str]:
+        state = self.directory.read_json(self.name)
+        return state.get("token") if state else None
+
+    def store(self, token: str):
+        self.directory.write_json(self.name, {"token": token})
+
+    def try_refresh_lock(self) -> Optional[int]:
+        return self.directory.try_lock(self.name)
+
+    def release_refresh_lock(self, fd: int):
+        self.directory.unlock(fd)
+
+
+class SharedInFlightCounter:
+    """
+    Host wide counter that every worker adds to under its own pid, so the share of a worker that died without
+    cleaning up is dropped the next time the counter is touched
+    """
+
+    def __init__(self, directory: SharedStateDirectory, name: str):
+        self.directory = directory
+        self.name = f"counter-{name}"
+
+    def __live_counts(self) -> Dict[str, float]:
+        counts = self.directory.read_json(self.name) or {}
+        return {pid: count for pid, count in counts.items() if is_process_alive(int(pid))}
+
+    def add(self, delta: float) -> float:
+        pid = str(os.getpid())
+        with self.directory.lock(self.name):
+            counts = self.__live_counts()
+            counts[pid] = max(counts.get(pid, 0) + delta, 0)
+            self.directory.write_json(self.name, counts)
+            return sum(counts.values())
+
+    def try_add(self, amount: float, limit: float) -> bool:
+        # Checked and added under the same lock, so two workers never both take the last of the capacity. An amount
+        # over the limit on its own is still let through once nothing else is counted
+        pid = str(os.getpid())
+        with self.directory.lock(self.name):
+            counts = self.__live_counts()
+            total = sum(counts.values())
+            if total > 0 and total + amount > limit:
+                return False
+            counts[pid] = counts.get(pid, 0) + amount
+            self.directory.write_json(self.name, counts)
+            return True
+
+    def total(self) -> float:
+        return sum(self.__live_counts().values())
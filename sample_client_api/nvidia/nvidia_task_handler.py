@@ -8,28 +8,87 @@ from sample_client_api.log_handling import get_logger_for_file
 from sample_client_api.nvidia.client.nvidia_image_generation_client import (
     NvidiaImageGenerationClient,
 )
+from sample_client_api.nvidia.client.nvidia_latency_model import NvidiaLatencyModel
 from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest
+from sample_client_api.nvidia.nvidia_shared_state import SharedStateDirectory
+from sample_client_api.nvidia.nvidia_task_journal import NvidiaJournaledTask, NvidiaTaskJournal
 from sample_client_api.nvidia.nvidia_token_manager import NvidiaAuthConfig
+from sample_client_api.tracing import span
 
 logger = get_logger_for_file(__name__)
 
 
 class NvidiaImageGenerationTaskHandler:
-    def __init__(self, nvcf_url: str, auth_config: NvidiaAuthConfig):
-        self.nvidia_client = NvidiaImageGenerationClient(nvcf_url, auth_config)
+    def __init__(
+        self,
+        nvcf_urls: List[str],
+        auth_config: NvidiaAuthConfig,
+        shared_state: Optional[SharedStateDirectory] = None,
+        latency_model: Optional[NvidiaLatencyModel] = None,
+        task_journal: Optional[NvidiaTaskJournal] = None,
+    ):
+        self.nvidia_client = NvidiaImageGenerationClient(
+            nvcf_urls, auth_config, shared_state, latency_model, task_journal
+        )
 
     async def close(self):
         await self.nvidia_client.close()
 
+    async def warm_up(self, function_ids: List[str]) -> Dict[str, Any]:
+        return await self.nvidia_client.warm_up(function_ids)
+
+    async def handle_nvidia_variants(
+        self,
+        nvidia_client_request: NvidiaRequest,
+        task_id: str,
+        variant_parameters: List[Dict[str, Any]],
+        required: int,
+    ) -> List[Tuple[int, List[bytes], List[Any]]]:
+        timer = perf_counter()
+        with span(
+            "nvcf.variants",
+            {
+                "nvcf.function_id": nvidia_client_request.function_id,
+                "task_id": task_id,
+                "variants": len(variant_parameters),
+                "required": required,
+            },
+        ) as task_span:
+            results, reason_for_failure = await self.nvidia_client.generate_variants(
+                nvidia_client_request, task_id, variant_parameters, required
+            )
+            if reason_for_failure is not None:
+                task_span.set_attribute("error.reason", reason_for_failure)
+        time_taken = perf_counter() - timer
+
+        logger.info(f"Task {task_id} with {len(variant_parameters)} variants took ${time_taken:.2f}s")
+
+        if results:
+            return results
+        else:
+            raise HTTPException(
+                detail=f"Task {task_id} got fewer than {required} of its {len(variant_parameters)} variants due to "
+                       f"{reason_for_failure} with request: {nvidia_client_request}",
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+
+    async def resume_task(self, task: NvidiaJournaledTask) -> Optional[Tuple[List[bytes], List[Any]]]:
+        return await self.nvidia_client.resume_task(task)
+
     async def handle_nvidia_task(
         self,
         nvidia_client_request: NvidiaRequest,
         task_id: str,
-    ) -> Optional[Tuple[bytes, List[Any]]]:
+    ) -> Optional[Tuple[List[bytes], List[Any]]]:
         timer = perf_counter()
-        results, reason_for_failure = await self.nvidia_client.generate_image(
-            nvidia_client_request, task_id
-        )
+        with span(
+            "nvcf.task", {"nvcf.function_id": nvidia_client_request.function_id, "task_id": task_id}
+        ) as task_span:
+            results, reason_for_failure = await self.nvidia_client.generate_image(
+                nvidia_client_request, task_id
+            )
+            if reason_for_failure is not None:
+                task_span.set_attribute("error.reason", reason_for_failure)
         time_taken = perf_counter() - timer
 
         logger.info(f"Task {task_id} took ${time_taken:.2f}s")
@@ -0,0 +1,289 @@
+import asyncio
+import json
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum, unique
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.client.nvidia_request import NvidiaRequest
+from sample_client_api.nvidia.nvidia_shared_state import is_process_alive
+
+logger = get_logger_for_file(__name__)
+
+R = TypeVar("R")
+
+JOURNAL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS workers (pid INTEGER PRIMARY KEY, owner TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    owner TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    state TEXT NOT NULL,
+    function_id TEXT NOT NULL,
+    account TEXT NOT NULL,
+    nvcf_url TEXT NOT NULL,
+    req_id TEXT,
+    request TEXT NOT NULL,
+    output TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS assets (task INTEGER NOT NULL, asset_id TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS tasks_owner ON tasks (owner);
+CREATE INDEX IF NOT EXISTS assets_task ON assets (task);
+"""
+
+
+@unique
+class NvidiaTaskState(Enum):
+    SUBMITTING = "submitting"  # Uploading assets and invoking, NVCF has not handed out a req_id yet
+    INVOKED = "invoked"  # NVCF accepted the task under req_id, its result is still to be fetched
+    FINISHED = "finished"  # The result was fetched (or the task failed), only its assets may be left
+
+
+class NvidiaJournaledTask:
+    def __init__(self, row: sqlite3.Row, assets: List[str]):
+        self.id: int = row["id"]
+        self.task_id: str = row["task_id"]
+        self.state = NvidiaTaskState(row["state"])
+        self.function_id: str = row["function_id"]
+        self.account: str = row["account"]
+        self.nvcf_url: str = row["nvcf_url"]
+        self.req_id: Optional[str] = row["req_id"]
+        self.request: Dict[str, Any] = json.loads(row["request"])
+        self.output: Optional[Dict[str, Any]] = json.loads(row["output"]) if row["output"] else None
+        self.created_at: float = row["created_at"]
+        self.assets = assets
+
+    def nvidia_request(self) -> NvidiaRequest:
+        # Enough of the original request to decode its result, the parameters were already sent
+        return NvidiaRequest(function_id=self.function_id, parameters={}, **self.request)
+
+
+class NvidiaJournalEntry:
+    """
+    The journal row of one attempt at a task, updated at every state change of the attempt. The updates are queued
+    behind the insert of the row, which sets entry_id, and are dropped when the insert failed.
+    """
+
+    def __init__(self, journal: "NvidiaTaskJournal", task_id: str):
+        self.journal = journal
+        self.task_id = task_id
+        self.entry_id: Optional[int] = None
+
+    def __write(self, description: str, statement: str, parameters: Callable[[int], tuple]):
+        def write(connection: sqlite3.Connection):
+            if self.entry_id is not None:
+                connection.execute(statement, parameters(self.entry_id))
+
+        self.journal.submit(f"{description} of {self.task_id}", write)
+
+    def add_asset(self, asset_id: str):
+        self.__write(
+            "journal an asset", "INSERT INTO assets (task, asset_id) VALUES (?, ?)", lambda entry_id: (entry_id, asset_id)
+        )
+
+    def remove_assets(self):
+        self.__write("remove the assets", "DELETE FROM assets WHERE task = ?", lambda entry_id: (entry_id,))
+
+    def set_state(self, state: NvidiaTaskState, req_id: Optional[str] = None):
+        updated_at = time.time()
+        self.__write(
+            f"set the state {state.value}",
+            "UPDATE tasks SET state = ?, req_id = COALESCE(?, req_id), updated_at = ? WHERE id = ?",
+            lambda entry_id: (state.value, req_id, updated_at, entry_id),
+        )
+
+    def finish(self):
+        def write(connection: sqlite3.Connection):
+            if self.entry_id is not None:
+                self.journal.finish_entry(connection, self.entry_id)
+
+        self.journal.submit(f"finish {self.task_id}", write)
+
+
+class NoopJournalEntry:
+    def add_asset(self, asset_id: str):
+        pass
+
+    def remove_assets(self):
+        pass
+
+    def set_state(self, state: NvidiaTaskState, req_id: Optional[str] = None):
+        pass
+
+    def finish(self):
+        pass
+
+
+NOOP_JOURNAL_ENTRY = NoopJournalEntry()
+
+
+class NvidiaTaskJournal:
+    """
+    SQLite journal of the NVCF tasks in flight on the host, shared by every worker process. Each worker owns its rows
+    under a random owner id, rows of owners that are no longer running (also when their pid got reused) are orphans
+    that a starting worker claims, resumes and cleans up. Every access runs in order on a thread of the worker, so
+    waiting on the database lock never blocks the event loop, and a failed write is logged and dropped.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.owner: Optional[str] = None
+        self.pid: Optional[int] = None
+        self.connection: Optional[sqlite3.Connection] = None
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.executor_pid: Optional[int] = None
+        self.recovered = 0
+        self.abandoned = 0
+        self.failed_writes = 0
+
+    def __executor(self) -> ThreadPoolExecutor:
+        # Threads do not survive a fork either
+        if self.executor is None or self.executor_pid != os.getpid():
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="task-journal")
+            self.executor_pid = os.getpid()
+        return self.executor
+
+    def __connect(self) -> sqlite3.Connection:
+        # Connections do not survive a fork, so every worker opens its own and registers as a new owner
+        if self.connection is None or self.pid != os.getpid():
+            self.owner = os.urandom(8).hex()
+            self.pid = os.getpid()
+            self.connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.connection.row_factory = sqlite3.Row
+            # WAL without a sync per commit keeps writes off the disk latency, the rows still survive the worker process
+            # dying, only a crash of the whole host may lose the latest ones
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.executescript(JOURNAL_SCHEMA)
+            self.connection.execute(
+                "INSERT OR REPLACE INTO workers (pid, owner) VALUES (?, ?)", (self.pid, self.owner)
+            )
+        return self.connection
+
+    def __write(self, description: str, write: Callable[[sqlite3.Connection], None]):
+        try:
+            write(self.__connect())
+        except sqlite3.Error as e:
+            # The task itself goes on, it is only not (fully) journaled
+            self.failed_writes += 1
+            logger.error(f"Task journal could not {description} due to {e!r}")
+
+    def submit(self, description: str, write: Callable[[sqlite3.Connection], None]):
+        try:
+            self.__executor().submit(self.__write, description, write)
+        except RuntimeError as e:
+            # Tasks still finishing after the journal was closed on shutdown
+            self.failed_writes += 1
+            logger.error(f"Task journal could not {description} due to {e!r}")
+
+    async def __read(self, read: Callable[[sqlite3.Connection], R]) -> R:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.__executor(), lambda: read(self.__connect()))
+
+    def start(
+        self,
+        task_id: str,
+        nvidia_request: NvidiaRequest,
+        account: str,
+        nvcf_url: str,
+    ) -> NvidiaJournalEntry:
+        now = time.time()
+        request = {
+            "image_output_name": nvidia_request.image_output_name,
+            "profile_output_name": nvidia_request.profile_output_name,
+            "batch_size": nvidia_request.batch_size,
+        }
+        output = json.dumps(nvidia_request.output_target) if nvidia_request.output_target else None
+        entry = NvidiaJournalEntry(self, task_id)
+
+        def write(connection: sqlite3.Connection):
+            cursor = connection.execute(
+                "INSERT INTO tasks (owner, task_id, state, function_id, account, nvcf_url, request, output, "
+                "created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.owner,
+                    task_id,
+                    NvidiaTaskState.SUBMITTING.value,
+                    nvidia_request.function_id,
+                    account,
+                    nvcf_url,
+                    json.dumps(request),
+                    output,
+                    now,
+                    now,
+                ),
+            )
+            entry.entry_id = cursor.lastrowid
+
+        self.submit(f"journal {task_id}", write)
+        return entry
+
+    def finish_entry(self, connection: sqlite3.Connection, entry_id: int):
+        with connection:
+            connection.execute("BEGIN")
+            # Rows with assets left (their delete failed) stay behind, so that the recovery deletes them
+            connection.execute(
+                "UPDATE tasks SET state = ?, updated_at = ? WHERE id = ?",
+                (NvidiaTaskState.FINISHED.value, time.time(), entry_id),
+            )
+            connection.execute(
+                "DELETE FROM tasks WHERE id = ? AND NOT EXISTS (SELECT 1 FROM assets WHERE task = ?)",
+                (entry_id, entry_id),
+            )
+
+    def remove(self, entry_id: int):
+        def write(connection: sqlite3.Connection):
+            with connection:
+                connection.execute("BEGIN")
+                connection.execute("DELETE FROM assets WHERE task = ?", (entry_id,))
+                connection.execute("DELETE FROM tasks WHERE id = ?", (entry_id,))
+
+        self.submit(f"remove the journaled task {entry_id}", write)
+
+    async def claim_orphaned_tasks(self) -> List[NvidiaJournaledTask]:
+        return await self.__read(self.__claim_orphaned_tasks)
+
+    def __claim_orphaned_tasks(self, connection: sqlite3.Connection) -> List[NvidiaJournaledTask]:
+        with connection:
+            # Taken before reading, so two workers starting at once never claim the same rows
+            connection.execute("BEGIN IMMEDIATE")
+            workers = connection.execute("SELECT pid, owner FROM workers").fetchall()
+            live_owners = [worker["owner"] for worker in workers if is_process_alive(worker["pid"])]
+            connection.execute(
+                "DELETE FROM workers WHERE owner NOT IN (SELECT value FROM json_each(?))", (json.dumps(live_owners),)
+            )
+            rows = connection.execute(
+                "SELECT * FROM tasks WHERE owner NOT IN (SELECT value FROM json_each(?))", (json.dumps(live_owners),)
+            ).fetchall()
+            tasks = []
+            for row in rows:
+                connection.execute("UPDATE tasks SET owner = ? WHERE id = ?", (self.owner, row["id"]))
+                assets = connection.execute("SELECT asset_id FROM assets WHERE task = ?", (row["id"],)).fetchall()
+                tasks.append(NvidiaJournaledTask(row, [asset["asset_id"] for asset in assets]))
+        return tasks
+
+    def close(self):
+        # Waits for the queued writes, so a worker shutting down leaves its rows up to date
+        if self.executor is not None and self.executor_pid == os.getpid():
+            self.executor.shutdown(wait=True)
+
+    async def stats(self) -> Dict[str, Any]:
+        return await self.__read(self.__stats)
+
+    def __stats(self, connection: sqlite3.Connection) -> Dict[str, Any]:
+        states = connection.execute("SELECT state, COUNT(*) AS tasks FROM tasks GROUP BY state").fetchall()
+        return {
+            "path": self.path,
+            "owner": self.owner,
+            "in_flight": connection.execute("SELECT COUNT(*) FROM tasks WHERE owner = ?", (self.owner,)).fetchone()[0],
+            "tasks_by_state": {state["state"]: state["tasks"] for state in states},
+            "recovered": self.recovered,
+            "abandoned": self.abandoned,
+            "failed_writes": self.failed_writes,
+        }
+
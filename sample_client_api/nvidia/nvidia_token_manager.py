@@ -1,11 +1,13 @@
+import asyncio
 from datetime import datetime, timezone
 from typing import Optional
 
 import aiohttp
-import jwt
 from aiohttp import BasicAuth
 from pydantic import BaseModel
+from sample_client_api import config
 from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia.nvidia_shared_state import SharedStateDirectory, SharedTokenCache
 
 logger = get_logger_for_file(__name__)
 
@@ -30,21 +32,41 @@ class NvidiaAuthConfig(BaseModel):
 
 class NvidiaAuthTokenManager:
 
-    def __init__(self, nvidia_auth_config: NvidiaAuthConfig):
+    def __init__(
+        self,
+        nvidia_auth_config: NvidiaAuthConfig,
+        shared_state: Optional[SharedStateDirectory] = None,
+    ):
 
         self.nvidia_auth_config = nvidia_auth_config
         self.headers = {
             "Content-Type": "application/x-www-form-urlencoded",
         }
         self.token: Optional[str] = None
+        # Makes concurrent tasks of this worker wait on a single refresh
+        self.refresh_lock = asyncio.Lock()
+        self.shared_token_cache = (
+            SharedTokenCache(
+                shared_state,
+                nvidia_auth_config.auth_url,
+                nvidia_auth_config.nvidia_username,
+            )
+            if shared_state is not None
+            else None
+        )
 
     def validate_token(self) -> bool:
+        return self.is_token_valid(self.token)
+
+    def is_token_valid(self, token: Optional[str]) -> bool:
+        import jwt
+
         # ensure the token is not expired
         try:
-            if self.token is None or self.token == "":
+            if token is None or token == "":
                 return False
             # Decode the JWT
-            decoded_token = jwt.decode(self.token, options={"verify_signature": False})
+            decoded_token = jwt.decode(token, options={"verify_signature": False})
             # Check if the token has expired
             token_expiry_time = decoded_token["exp"]
             curr_time = datetime.now(timezone.utc).timestamp()
@@ -56,7 +78,7 @@ class NvidiaAuthTokenManager:
             return False
         except Exception as e:
             logger.error(
-                f"Error decoding token: {self.token} due to {e}", exc_info=True
+                f"Error decoding token: {token} due to {e}", exc_info=True
             )
             return False
 
@@ -67,9 +89,43 @@ class NvidiaAuthTokenManager:
             self.token = token
         is_valid_token = self.validate_token()
         if not is_valid_token:
-            self.token = await self.get_auth_token(session)
+            async with self.refresh_lock:
+                if not self.validate_token():
+                    if self.shared_token_cache is None:
+                        self.token = await self.get_auth_token(session)
+                    else:
+                        self.token = await self.fetch_shared_token(session)
         return self.token
 
+    async def fetch_shared_token(self, session: aiohttp.ClientSession) -> str:
+        # Another worker (or a previous run of this one) may already hold a valid token for the account
+        loop = asyncio.get_running_loop()
+        token = await loop.run_in_executor(None, self.shared_token_cache.load)
+        if self.is_token_valid(token):
+            return token
+
+        # Only a single worker on the host refreshes, the others wait and pick up its token
+        lock_fd = await self.__acquire_refresh_lock()
+        try:
+            token = await loop.run_in_executor(None, self.shared_token_cache.load)
+            if self.is_token_valid(token):
+                return token
+            token = await self.get_auth_token(session)
+            await loop.run_in_executor(None, self.shared_token_cache.store, token)
+            logger.info("Refreshed the NVCF token shared by the workers on this host")
+            return token
+        finally:
+            self.shared_token_cache.release_refresh_lock(lock_fd)
+
+    async def __acquire_refresh_lock(self) -> int:
+        # Polled without blocking instead of waited on in an executor, so a task cancelled while it waits never
+        # leaves the lock taken by a thread nobody releases it from
+        while True:
+            lock_fd = self.shared_token_cache.try_refresh_lock()
+            if lock_fd is not None:
+                return lock_fd
+            await asyncio.sleep(config.NVCF_SHARED_STATE_POLL_SECONDS)
+
     async def get_auth_token(self, session: aiohttp.ClientSession) -> str:
         request = session.request(
             "POST",
@@ -0,0 +1,138 @@
+import io
+import json
+from collections import defaultdict
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Dict, Optional, Tuple
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.nvidia import MIME_JPEG_CONTENT_TYPE, OPAQUE_FORMATS
+
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
+logger = get_logger_for_file(__name__)
+
+LOSSY_FORMATS = {"JPEG", "WEBP"}
+QUALITY_STEP = 10
+
+
+class NvidiaUploadEncodingPolicy:
+    """
+    How the input images of a function are encoded for the NVCF asset upload, None keeps the original format
+    """
+
+    def __init__(
+        self,
+        image_format: Optional[str] = None,
+        quality: int = config.NVCF_UPLOAD_QUALITY,
+        max_bytes: Optional[int] = None,
+    ):
+        self.image_format = image_format.upper() if image_format else None
+        self.quality = quality
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_json(cls, entry: Dict[str, Any]) -> "NvidiaUploadEncodingPolicy":
+        return cls(
+            entry.get("format"),
+            entry.get("quality", config.NVCF_UPLOAD_QUALITY),
+            entry.get("max_bytes"),
+        )
+
+    def key(self) -> Tuple[Optional[str], int, Optional[int]]:
+        return self.image_format, self.quality, self.max_bytes
+
+
+class NvidiaUploadEncodingStats:
+    def __init__(self):
+        self.encodes = 0
+        self.bytes_before = 0
+        self.bytes_after = 0
+        self.encode_seconds = 0.0
+
+    def record(self, bytes_before: int, bytes_after: int, encode_seconds: float):
+        self.encodes += 1
+        self.bytes_before += bytes_before
+        self.bytes_after += bytes_after
+        self.encode_seconds += encode_seconds
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "encodes": self.encodes,
+            "bytes_before": self.bytes_before,
+            "bytes_after": self.bytes_after,
+            "ratio": self.bytes_after / self.bytes_before if self.bytes_before else 0.0,
+            "encode_seconds": self.encode_seconds,
+            "mean_encode_seconds": self.encode_seconds / self.encodes if self.encodes else 0.0,
+        }
+
+
+DEFAULT_UPLOAD_ENCODING_POLICY = NvidiaUploadEncodingPolicy()
+# Masks are uploaded lossless whatever the policy of their function, compression artifacts would blur their edges
+MASK_UPLOAD_ENCODING_POLICY = NvidiaUploadEncodingPolicy("PNG")
+UPLOAD_ENCODING_STATS: Dict[str, NvidiaUploadEncodingStats] = defaultdict(NvidiaUploadEncodingStats)
+
+
+@lru_cache(maxsize=None)
+def upload_encoding_policies() -> Dict[str, NvidiaUploadEncodingPolicy]:
+    if not config.NVCF_UPLOAD_ENCODING_POLICIES:
+        return {}
+    policies = {
+        function_id: NvidiaUploadEncodingPolicy.from_json(entry)
+        for function_id, entry in json.loads(config.NVCF_UPLOAD_ENCODING_POLICIES).items()
+    }
+    logger.info(f"Upload encoding policies: { {key: policy.key() for key, policy in policies.items()} }")
+    return policies
+
+
+def upload_encoding_policy(function_id: str) -> NvidiaUploadEncodingPolicy:
+    policies = upload_encoding_policies()
+    return policies.get(function_id) or policies.get("default") or DEFAULT_UPLOAD_ENCODING_POLICY
+
+
+def __save(image: "Image", image_format: str, quality: Optional[int]) -> bytes:
+    output = io.BytesIO()
+    if quality is None:
+        image.save(output, format=image_format)
+    elif image_format == "JPEG":
+        image.save(output, format=image_format, quality=quality, optimize=True)
+    else:
+        image.save(output, format=image_format, quality=quality)
+    return output.getvalue()
+
+
+def encode_upload(
+    image: "Image", original_format: str, policy: NvidiaUploadEncodingPolicy
+) -> Tuple[bytes, str]:
+    from PIL.Image import MIME
+
+    image_format = policy.image_format or original_format
+    if image_format in OPAQUE_FORMATS and image.mode not in ("RGB", "L"):
+        # Transparent inputs keep their original format instead
+        if image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info:
+            image_format = original_format
+        else:
+            image = image.convert("RGB")
+
+    if policy.image_format is None or image_format not in LOSSY_FORMATS:
+        return __save(image, image_format, None), MIME.get(image_format, MIME_JPEG_CONTENT_TYPE)
+
+    quality = policy.quality
+    data = __save(image, image_format, quality)
+    while policy.max_bytes and len(data) > policy.max_bytes and quality > config.NVCF_UPLOAD_MIN_QUALITY:
+        quality = max(config.NVCF_UPLOAD_MIN_QUALITY, quality - QUALITY_STEP)
+        data = __save(image, image_format, quality)
+    if policy.max_bytes and len(data) > policy.max_bytes:
+        logger.warning(
+            f"Upload of {len(data)} bytes is still over {policy.max_bytes} bytes at the minimum quality {quality}"
+        )
+    return data, MIME.get(image_format, MIME_JPEG_CONTENT_TYPE)
+
+
+def record_upload_encoding(function_id: str, bytes_before: int, bytes_after: int, encode_seconds: float):
+    UPLOAD_ENCODING_STATS[function_id].record(bytes_before, bytes_after, encode_seconds)
+
+
+def upload_encoding_stats() -> Dict[str, Any]:
+    return {function_id: stats.to_json() for function_id, stats in sorted(UPLOAD_ENCODING_STATS.items())}
@@ -0,0 +1,86 @@
+from typing import Any, List, Dict, Optional
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+
+logger = get_logger_for_file(__name__)
+
+MIME_MJPEG_CONTENT_TYPE = "video/x-motion-jpeg"
+
+
+class S3MultipartFrameSink:
+    """
+    Writes the frames of a video into a Motion JPEG container that is uploaded to S3 as a multipart upload, so at
+    most one part is held in memory no matter how many frames are generated
+    """
+
+    def __init__(
+        self,
+        s3_client: Any,
+        bucket: str,
+        key: str,
+        content_type: str = MIME_MJPEG_CONTENT_TYPE,
+        part_size: int = config.NVCF_VIDEO_UPLOAD_PART_BYTES,
+    ):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.content_type = content_type
+        self.part_size = part_size
+        self.buffer = bytearray()
+        self.parts: List[Dict[str, Any]] = []
+        self.upload_id: Optional[str] = None
+        self.frames_written = 0
+
+    async def write_frame(self, frame: bytes):
+        if self.upload_id is None:
+            response = await self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, ContentType=self.content_type
+            )
+            self.upload_id = response["UploadId"]
+
+        self.buffer += frame
+        self.frames_written += 1
+        if len(self.buffer) >= self.part_size:
+            await self.__upload_part()
+
+    async def __upload_part(self):
+        part_number = len(self.parts) + 1
+        response = await self.s3_client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            PartNumber=part_number,
+            Body=bytes(self.buffer),
+        )
+        self.parts.append({"ETag": response["ETag"], "PartNumber": part_number})
+        self.buffer = bytearray()
+
+    async def finish(self) -> str:
+        if self.upload_id is None:
+            raise ValueError(f"No frames were written to s3://{self.bucket}/{self.key}")
+        if len(self.buffer) > 0:
+            await self.__upload_part()
+        await self.s3_client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts},
+        )
+        s3_uri = f"s3://{self.bucket}/{self.key}"
+        logger.info(f"Uploaded {self.frames_written} frames in {len(self.parts)} parts to {s3_uri}")
+        return s3_uri
+
+    async def abort(self):
+        self.buffer = bytearray()
+        if self.upload_id is None:
+            return
+        try:
+            await self.s3_client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed to abort multipart upload to s3://{self.bucket}/{self.key} due to {e}",
+                exc_info=True,
+            )
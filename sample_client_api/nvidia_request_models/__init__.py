@@ -37,7 +37,7 @@ class BaseTextToImageTask(BaseModel):
     # because it can be used across projects with different s3 buckets. So keep it flexible
     base_generated_image_uri: Optional[str] = None
 
-    @field_validator("watermark")
+    @field_validator("watermark", check_fields=False)
     @classmethod
     def enum_to_value(cls, v):
         # This ensures that the overall task is serializable when converted to dict by the API
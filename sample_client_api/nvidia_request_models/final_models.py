@@ -1,16 +1,48 @@
 from enum import Enum
 from typing import Optional
 
-from pydantic import Field, BaseModel
+from pydantic import Field, BaseModel, model_validator
 
 from sample_client_api.nvidia_request_models import ImageInput, DiffusionStyleParams
 
 
+class NvidiaResponseMode(Enum):
+    S3 = "s3"  # Upload to S3 and respond with the URI
+    BYTES = "bytes"  # Stream the generated image back without touching S3
+    BYTES_AND_S3 = "bytes_and_s3"  # Stream the image back while the S3 upload finishes in the background
+    PROGRESSIVE = "progressive"  # Server-sent events with each stage uploaded to S3 as it is done (txt2img only)
+
+
+class NvidiaPriority(Enum):
+    INTERACTIVE = "interactive"
+    STANDARD = "standard"
+    BULK = "bulk"
+
+
+MAX_BATCH_SIZE = 8
+MAX_VARIANTS = 8
+
+
 class BaseNvidiaClientRequest(BaseModel):
     model: Optional[str] = None
     task_id: str
     s3_output_bucket: Optional[str] = None
     s3_output_key: Optional[str] = None
+    response_mode: NvidiaResponseMode = NvidiaResponseMode.S3
+    # Defaults to the priority of the route when not set
+    priority: Optional[NvidiaPriority] = None
+    # Seconds the caller is willing to wait, the work is abandoned once they are up
+    timeout_seconds: Optional[float] = Field(gt=0, default=None)
+    # Generates this many variants with consecutive seeds, which share a single upload of the input images
+    variants: Optional[int] = Field(ge=1, le=MAX_VARIANTS, default=None)
+    # Responds as soon as this many variants are done (first K wins), all of them when not set
+    variants_required: Optional[int] = Field(ge=1, default=None)
+
+    @model_validator(mode="after")
+    def check_variants_required(self):
+        if self.variants_required is not None and self.variants_required > (self.variants or 1):
+            raise ValueError("variants_required cannot be more than variants")
+        return self
 
 
 class NvidiaClientRequest(BaseNvidiaClientRequest):
@@ -56,7 +88,7 @@ class NoDimensionStepsNvidiaClientRequest(NoDimensionNvidiaClientRequest):
 
 
 class SDXLNvidiaClientRequest(GuidanceNvidiaClientRequest):
-    batch_size: Optional[int] = None
+    batch_size: Optional[int] = Field(ge=1, le=MAX_BATCH_SIZE, default=None)
     base_steps: Optional[int] = 30
     refiner_steps: Optional[int] = 10
     scheduler: Optional[NvidiaScheduler] = None
@@ -0,0 +1,73 @@
+"""
+Measures the peak memory a request needs on top of the NVCF response body to get its images ready for S3 (or for the
+next asset upload), relative to the size of the images, and fails when it goes over the budget, e.g.
+python -m sample_client_api.result_memory_benchmark --images 4 --image-bytes 2000000 --budget-ratio 3
+"""
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import sys
+import tracemalloc
+from typing import List, Tuple
+
+from sample_client_api import config
+from sample_client_api.nvidia import MIME_JPEG_CONTENT_TYPE
+from sample_client_api.nvidia.client.nvidia_request import asset_from_bytes
+from sample_client_api.nvidia.client.nvidia_response_handler import decode_image_output
+
+
+def fulfilled_body(images: int, image_bytes: int) -> bytes:
+    # Random bytes do not compress, just like the JPEGs NVCF returns
+    images_base64 = [base64.b64encode(os.urandom(image_bytes)).decode() for _ in range(images)]
+    return json.dumps(
+        {"outputs": [{"name": "generated_image", "shape": [images], "datatype": "BYTES", "data": images_base64}]}
+    ).encode()
+
+
+async def result_path(body: bytes) -> List[bytes]:
+    # The steps every request takes: parse the body, decode the images and hand each one over to an upload
+    files = await decode_image_output(json.loads(body)["outputs"])
+    for file in files:
+        asset = asset_from_bytes(io.BytesIO(file), MIME_JPEG_CONTENT_TYPE)
+        if asset.data.getvalue() is not file:
+            raise AssertionError("The asset copied the image instead of sharing it")
+    return files
+
+
+def measure_peak(body: bytes) -> Tuple[int, int]:
+    # The body is allocated before tracing starts, like the response aiohttp already holds
+    tracemalloc.start()
+    files = asyncio.run(result_path(body))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return sum(len(file) for file in files), peak
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--images", type=int, default=1)
+    parser.add_argument("--image-bytes", type=int, default=2 * 1024 * 1024)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--budget-ratio", type=float, default=config.RESULT_MEMORY_BUDGET_RATIO)
+    args = parser.parse_args(argv)
+
+    body = fulfilled_body(args.images, args.image_bytes)
+    # The lowest peak over the runs leaves out one-off allocations such as the executor threads
+    measurements = [measure_peak(body) for _ in range(args.runs)]
+    image_bytes = measurements[0][0]
+    peak = min(peak for _, peak in measurements)
+    ratio = peak / image_bytes
+
+    print(f"Response body of {len(body)} bytes with {args.images} images of {args.image_bytes} bytes")
+    print(f"Peak memory of the result path: {peak} bytes, {ratio:.2f}x the images (budget {args.budget_ratio:.2f}x)")
+    if ratio > args.budget_ratio:
+        print(f"FAILED: Peak memory is {ratio:.2f}x the images, over the budget of {args.budget_ratio:.2f}x")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
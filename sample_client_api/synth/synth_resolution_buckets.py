@@ -0,0 +1,110 @@
+from collections import Counter
+from functools import lru_cache
+from math import ceil
+from typing import Tuple, Dict, Any, Optional
+
+import numpy as np
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+from sample_client_api.synth.synth_defaults import DIFFUSION_RES_DIVISOR
+from sample_client_api.synth.synth_spec_resolution_scaling import (
+    ART_MAX_DIM,
+    ART_MIN_DIM,
+    compute_base_dimensions,
+)
+
+logger = get_logger_for_file(__name__)
+
+# The bucket step has to stay a multiple of DIFFUSION_RES_DIVISOR so every bucket is a valid shape
+RESOLUTION_BUCKET_STEP = (
+    ceil(config.RESOLUTION_BUCKET_STEP / DIFFUSION_RES_DIVISOR) * DIFFUSION_RES_DIVISOR
+)
+
+
+def build_resolution_bucket_table(
+    min_dim: int,
+    max_dim: int,
+    step: int,
+    max_aspect_ratio: Optional[float] = None,
+) -> np.ndarray:
+    sides = np.arange(min_dim, max_dim + 1, step)
+    if sides[-1] != max_dim:
+        sides = np.append(sides, max_dim)
+    widths, heights = np.meshgrid(sides, sides, indexing="ij")
+    table = np.stack([widths.ravel(), heights.ravel()], axis=1)
+    if max_aspect_ratio:
+        aspect_ratios = np.maximum(table[:, 0] / table[:, 1], table[:, 1] / table[:, 0])
+        table = table[aspect_ratios <= max_aspect_ratio]
+    return table
+
+
+class ResolutionBucketPlanner:
+    def __init__(self, table: np.ndarray):
+        self.table = table
+        # Distances are measured in log space so that snapping is relative to the size of the image
+        # and roughly preserves both the area and the aspect ratio
+        self.log_table = np.log(table.astype(np.float64))
+        self.bucket_hits: Counter = Counter()
+        self.exact_hits = 0
+        self.total_requests = 0
+
+    def snap(self, widths: np.ndarray, heights: np.ndarray) -> np.ndarray:
+        requested = np.log(
+            np.stack([np.asarray(widths), np.asarray(heights)], axis=-1).astype(np.float64)
+        )
+        distances = np.square(requested[:, None, :] - self.log_table[None, :, :]).sum(axis=-1)
+        indices = distances.argmin(axis=1)
+        snapped = self.table[indices]
+
+        self.total_requests += len(indices)
+        self.exact_hits += int(np.count_nonzero(distances[np.arange(len(indices)), indices] == 0))
+        self.bucket_hits.update(indices.tolist())
+        return snapped
+
+    def snap_base_dimensions(
+        self,
+        should_lower_resolution_drastically: bool,
+        is_sd_xl: bool,
+        final_model: str,
+        final_width: int,
+        final_height: int,
+    ) -> Tuple[int, int]:
+        base_width, base_height = compute_base_dimensions(
+            should_lower_resolution_drastically=should_lower_resolution_drastically,
+            is_sd_xl=is_sd_xl,
+            final_model=final_model,
+            final_width=final_width,
+            final_height=final_height,
+        )
+        snapped_width, snapped_height = self.snap(
+            np.array([base_width]), np.array([base_height])
+        )[0].tolist()
+        logger.info(
+            f"Snapped base_width={base_width}, base_height={base_height} to bucket {snapped_width}x{snapped_height}"
+        )
+        return snapped_width, snapped_height
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "table": self.table.tolist(),
+            "total_requests": self.total_requests,
+            "exact_hits": self.exact_hits,
+            "bucket_hits": {
+                f"{width}x{height}": self.bucket_hits[index]
+                for index, (width, height) in enumerate(self.table.tolist())
+                if self.bucket_hits[index]
+            },
+        }
+
+
+@lru_cache(maxsize=None)
+def get_resolution_bucket_planner() -> ResolutionBucketPlanner:
+    return ResolutionBucketPlanner(
+        build_resolution_bucket_table(
+            ART_MIN_DIM,
+            ART_MAX_DIM,
+            RESOLUTION_BUCKET_STEP,
+            config.ART_MAYBE_MAX_ASPECT_RATIO,
+        )
+    )
@@ -20,6 +20,14 @@ ART_MIN_DIM = (
     ceil(config.ART_MIN_GENERATION_DIMENSION / DIFFUSION_RES_DIVISOR)
     * DIFFUSION_RES_DIVISOR
 )
+SDXL_MAX_DIM = (
+    floor(config.SDXL_MAX_GENERATION_DIMENSION / DIFFUSION_RES_DIVISOR)
+    * DIFFUSION_RES_DIVISOR
+)
+SDXL_MIN_DIM = (
+    ceil(config.SDXL_MIN_GENERATION_DIMENSION / DIFFUSION_RES_DIVISOR)
+    * DIFFUSION_RES_DIVISOR
+)
 SDXL_SCALE = 1.4
 SD_V1_SCALE = 3.0
 V1_MODELS = [SD_V1_4, SD_V1_5, INSTRUCT]
@@ -27,6 +35,10 @@ SD_SUPERRES_SCALE = 2
 
 
 def handle_non_sdxl_resolution(base_width: int, base_height: int) -> Tuple[int, int]:
+    return fit_resolution(base_width, base_height, ART_MIN_DIM, ART_MAX_DIM)
+
+
+def fit_resolution(base_width: int, base_height: int, min_dim: int, max_dim: int) -> Tuple[int, int]:
     # The compiled engines have max and min limits on the sizes they can generate. If both base_height and
     # base_width exceed the max dimension, the bigger of them needs to be adjusted to the max and then
     # the other one is adjusted to preserve the aspect ratio.
@@ -36,22 +48,22 @@ def handle_non_sdxl_resolution(base_width: int, base_height: int) -> Tuple[int,
         # case the height is capped to max and the width scaled since width is lesser) or
         # atleast one of them is lower than min (in which case the width is set to min and
         # height scaled since height is bigger).
-        if base_height > ART_MAX_DIM:
-            base_width = ceil(ART_MAX_DIM * base_width / base_height)
-            base_height = ART_MAX_DIM
-        if base_width < ART_MIN_DIM:
-            base_height = floor(ART_MIN_DIM * base_height / base_width)
-            base_width = ART_MIN_DIM
+        if base_height > max_dim:
+            base_width = ceil(max_dim * base_width / base_height)
+            base_height = max_dim
+        if base_width < min_dim:
+            base_height = floor(min_dim * base_height / base_width)
+            base_width = min_dim
     else:
         # The cases of interest are one of them greater than max (in which case width, which is
         # larger is scaled to the max) or one of them less than min (in which case the height,
         # which is smaller, is set to the min).
-        if base_width > ART_MAX_DIM:
-            base_height = ceil(ART_MAX_DIM * base_height / base_width)
-            base_width = ART_MAX_DIM
-        if base_height < ART_MIN_DIM:
-            base_width = floor(ART_MIN_DIM * base_width / base_height)
-            base_height = ART_MIN_DIM
+        if base_width > max_dim:
+            base_height = ceil(max_dim * base_height / base_width)
+            base_width = max_dim
+        if base_height < min_dim:
+            base_width = floor(min_dim * base_width / base_height)
+            base_height = min_dim
 
     return base_width, base_height
 
@@ -111,6 +123,16 @@ def get_final_resolution_for_diffusion_res(
     return base_width, base_height
 
 
+def get_final_sdxl_resolution(width: int, height: int) -> Tuple[int, int]:
+    # SDXL has no upscale step, the requested size is only fit within the bounds of the model
+    width, height = fit_resolution(width, height, SDXL_MIN_DIM, SDXL_MAX_DIM)
+    width, height = get_final_resolution_for_diffusion_res(True, width, height)
+    # Fitting a very elongated size may still leave a side out of bounds
+    width = min(SDXL_MAX_DIM, max(width, SDXL_MIN_DIM))
+    height = min(SDXL_MAX_DIM, max(height, SDXL_MIN_DIM))
+    return width, height
+
+
 def choose_scaling(
     should_lower_resolution_drastically: bool,
     is_sd_xl: bool,
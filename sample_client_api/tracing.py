@@ -0,0 +1,181 @@
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+from sample_client_api import config
+from sample_client_api.log_handling import get_logger_for_file
+
+logger = get_logger_for_file(__name__)
+
+
+class Span:
+    """
+    A timed stage of a request, spans started while another one is current become its children
+    """
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes: Dict[str, Any] = {}
+        self.start = time.time()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def set_attribute(self, key: str, value: Any):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_exception(self, exception: BaseException):
+        self.error = repr(exception)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration": (self.end or time.time()) - self.start,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class NoopSpan:
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def record_exception(self, exception: BaseException):
+        pass
+
+
+class SpanExporter:
+    """
+    Receives every finished span, subclasses are registered by name with register_span_exporter
+    """
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+    def shutdown(self):
+        pass
+
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self, max_spans: int):
+        self.spans: Deque[Span] = deque(maxlen=max_spans)
+
+    def export(self, span: Span):
+        self.spans.append(span)
+
+    def traces(self) -> List[Dict[str, Any]]:
+        # Most recent first, with the stages of every trace in the order they started
+        traces: "OrderedDict[str, List[Span]]" = OrderedDict()
+        for span in reversed(self.spans):
+            traces.setdefault(span.trace_id, []).append(span)
+        return [
+            {
+                "trace_id": trace_id,
+                "duration": max(span.end for span in spans) - min(span.start for span in spans),
+                "spans": [span.to_json() for span in sorted(spans, key=lambda span: span.start)],
+            }
+            for trace_id, spans in traces.items()
+        ]
+
+
+class FileSpanExporter(SpanExporter):
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "a", buffering=1)
+
+    def export(self, span: Span):
+        # One JSON object per line, so the file can be followed and grepped by trace_id while requests run
+        self.file.write(json.dumps(span.to_json(), default=str) + "\n")
+
+    def shutdown(self):
+        self.file.close()
+
+
+SPAN_EXPORTERS: Dict[str, Callable[[], SpanExporter]] = {
+    "memory": lambda: InMemorySpanExporter(config.TRACING_MEMORY_MAX_SPANS),
+    "file": lambda: FileSpanExporter(config.TRACING_FILE_PATH),
+}
+
+CURRENT_SPAN: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+NOOP_SPAN = NoopSpan()
+
+
+def register_span_exporter(name: str, factory: Callable[[], SpanExporter]):
+    SPAN_EXPORTERS[name] = factory
+
+
+@lru_cache(maxsize=None)
+def opentelemetry_tracer():
+    if config.TRACING_EXPORTER != "otel":
+        return None
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logger.error("TRACING_EXPORTER is otel but opentelemetry-api is not installed, tracing is off")
+        return None
+    # Whatever SDK and exporter the deployment configured (e.g. opentelemetry-instrument) receives the spans
+    return trace.get_tracer("sample_client_api")
+
+
+@lru_cache(maxsize=None)
+def span_exporter() -> Optional[SpanExporter]:
+    factory = SPAN_EXPORTERS.get(config.TRACING_EXPORTER)
+    if factory is None:
+        if config.TRACING_EXPORTER not in ("none", "otel"):
+            logger.error(f"Unknown TRACING_EXPORTER {config.TRACING_EXPORTER}, tracing is off")
+        return None
+    logger.info(f"Exporting spans to the {config.TRACING_EXPORTER} exporter")
+    return factory()
+
+
+def shutdown_tracing():
+    exporter = span_exporter()
+    if exporter is not None:
+        exporter.shutdown()
+
+
+@contextmanager
+def span(name: str, attributes: Optional[Dict[str, Any]] = None) -> Iterator[Any]:
+    attributes = {key: value for key, value in (attributes or {}).items() if value is not None}
+    tracer = opentelemetry_tracer()
+    if tracer is not None:
+        with tracer.start_as_current_span(name, attributes=attributes) as otel_span:
+            yield otel_span
+        return
+
+    exporter = span_exporter()
+    if exporter is None:
+        yield NOOP_SPAN
+        return
+
+    parent = CURRENT_SPAN.get()
+    current = Span(
+        name,
+        parent.trace_id if parent is not None else os.urandom(16).hex(),
+        parent.span_id if parent is not None else None,
+        attributes,
+    )
+    token = CURRENT_SPAN.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        CURRENT_SPAN.reset(token)
+        current.end = time.time()
+        exporter.export(current)
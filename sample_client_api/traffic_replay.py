@@ -0,0 +1,257 @@
+"""
+Replays recorded requests against a running service and summarizes latency percentiles, errors and throughput, e.g.
+python -m sample_client_api.traffic_replay recorded.jsonl --speedup 10
+python -m sample_client_api.traffic_replay recorded.jsonl --rate 2 --poisson --requests 500
+python -m sample_client_api.traffic_replay recorded.jsonl --concurrency 8 --duration 300
+Every line is either {"route": "/txt2img", "body": {...}, "timestamp": 1700000000.0, "headers": {...}} or a request
+logged by the LoggingMiddleware. Without --rate or --concurrency the requests are sent open-loop at their recorded
+times, divided by --speedup.
+"""
+import argparse
+import asyncio
+import json
+import math
+import random
+import re
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+import aiohttp
+
+from sample_client_api import config
+from sample_client_api.nvidia.client.nvidia_deadline import REQUEST_TIMEOUT_HEADER
+
+DISPATCHER_PREFIX = "/api/nvidia_dispatch"
+# Only these recorded headers are sent again, the rest (host, content-length, ...) belong to the original connection
+REPLAYED_HEADERS = {REQUEST_TIMEOUT_HEADER.lower()}
+PERCENTILES = (50, 90, 95, 99)
+# The API reports unexpected exceptions as {"detail": repr(exception)}
+EXCEPTION_DETAIL = re.compile(r"^(\w+)\(")
+
+
+class RecordedRequest:
+    def __init__(self, route: str, body: Any, timestamp: Optional[float], headers: Dict[str, str]):
+        self.route = route if route.startswith(DISPATCHER_PREFIX) else DISPATCHER_PREFIX + route
+        self.body = body
+        self.timestamp = timestamp
+        self.headers = {key: value for key, value in headers.items() if key.lower() in REPLAYED_HEADERS}
+
+    @classmethod
+    def from_json(cls, entry: Dict[str, Any]) -> Optional["RecordedRequest"]:
+        if "route" in entry:
+            return cls(entry["route"], entry.get("body"), entry.get("timestamp"), entry.get("headers") or {})
+        # A LoggingMiddleware line, only the requests that carried a body can be replayed
+        method, _, path = entry.get("path", "").partition("-")
+        if method != "POST" or not entry.get("payload"):
+            return None
+        return cls(path, json.loads(entry["payload"]), entry.get("start_time"), dict(entry.get("headers") or []))
+
+
+class ReplayResult:
+    def __init__(self, route: str, scheduled: float, started: float, latency: float, error: Optional[str]):
+        self.route = route
+        self.scheduled = scheduled
+        self.started = started
+        self.latency = latency
+        self.error = error
+
+
+def read_recording(path: str) -> List[RecordedRequest]:
+    requests = []
+    with open(path) as file:
+        for line in file:
+            # Log lines may carry a prefix before the JSON object
+            start = line.find("{")
+            if start < 0:
+                continue
+            try:
+                request = RecordedRequest.from_json(json.loads(line[start:]))
+            except (ValueError, KeyError):
+                continue
+            if request is not None:
+                requests.append(request)
+    return requests
+
+
+def schedule(
+    requests: List[RecordedRequest], count: int, rate: Optional[float], poisson: bool, speedup: float
+) -> List[float]:
+    # Offsets in seconds from the start of the replay at which every request is sent
+    if rate:
+        offsets, offset = [], 0.0
+        for _ in range(count):
+            offsets.append(offset)
+            offset += random.expovariate(rate) if poisson else 1 / rate
+        return offsets
+
+    timestamps = [request.timestamp for request in requests]
+    first = min(timestamps)
+    span = max(timestamps) - first
+    # Repeated passes over the recording follow each other, one mean gap apart
+    gap = span / (len(timestamps) - 1) if len(timestamps) > 1 else 0.0
+    return [
+        ((index // len(requests)) * (span + gap) + timestamps[index % len(requests)] - first) / speedup
+        for index in range(count)
+    ]
+
+
+def error_class(status: int, body: bytes) -> str:
+    try:
+        detail = json.loads(body).get("detail")
+    except (ValueError, AttributeError):
+        detail = None
+    match = EXCEPTION_DETAIL.match(detail) if isinstance(detail, str) else None
+    return f"HTTP {status} {match.group(1)}" if match else f"HTTP {status}"
+
+
+async def send(
+    session: aiohttp.ClientSession, url: str, request: RecordedRequest, scheduled: float, start: float
+) -> ReplayResult:
+    started = time.monotonic()
+    error = None
+    try:
+        async with session.post(url + request.route, json=request.body, headers=request.headers) as response:
+            body = await response.read()
+            if response.status >= 400:
+                error = error_class(response.status, body)
+    except Exception as e:
+        error = type(e).__name__
+    return ReplayResult(request.route, scheduled, started - start, time.monotonic() - started, error)
+
+
+async def open_loop(
+    session: aiohttp.ClientSession, url: str, requests: List[RecordedRequest], offsets: List[float], duration: float
+) -> List[ReplayResult]:
+    # Requests go out on schedule however many are still running, like independent users would send them
+    start = time.monotonic()
+    tasks = []
+    for index, offset in enumerate(offsets):
+        if duration and offset >= duration:
+            break
+        await asyncio.sleep(max(0.0, start + offset - time.monotonic()))
+        request = requests[index % len(requests)]
+        tasks.append(asyncio.create_task(send(session, url, request, offset, start)))
+    return list(await asyncio.gather(*tasks))
+
+
+async def closed_loop(
+    session: aiohttp.ClientSession,
+    url: str,
+    requests: List[RecordedRequest],
+    count: int,
+    concurrency: int,
+    duration: float,
+) -> List[ReplayResult]:
+    # Every worker sends its next request as soon as its previous one is answered
+    start = time.monotonic()
+    indexes = iter(range(count))
+    results = []
+
+    async def worker():
+        for index in indexes:
+            now = time.monotonic() - start
+            if duration and now >= duration:
+                return
+            results.append(await send(session, url, requests[index % len(requests)], now, start))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def percentile(values: List[float], percent: float) -> float:
+    # Nearest rank on the sorted values
+    if not values:
+        return 0.0
+    rank = max(0, min(len(values) - 1, math.ceil(percent / 100 * len(values)) - 1))
+    return values[rank]
+
+
+def summarize(results: List[ReplayResult]) -> Dict[str, Any]:
+    latencies = sorted(result.latency for result in results if result.error is None)
+    elapsed = max((result.started + result.latency for result in results), default=0.0)
+    successes = len(latencies)
+    return {
+        "requests": len(results),
+        "successes": successes,
+        "errors": dict(Counter(result.error for result in results if result.error is not None).most_common()),
+        "elapsed_seconds": elapsed,
+        "throughput": successes / elapsed if elapsed else 0.0,
+        "latency": {
+            "mean": sum(latencies) / successes if successes else 0.0,
+            **{f"p{percent}": percentile(latencies, percent) for percent in PERCENTILES},
+            "max": latencies[-1] if latencies else 0.0,
+        },
+        # How far behind schedule requests went out, a large lag means the replay itself could not keep up
+        "max_send_lag": max((result.started - result.scheduled for result in results), default=0.0),
+        "routes": dict(Counter(result.route[len(DISPATCHER_PREFIX):] for result in results)),
+    }
+
+
+def print_summary(summary: Dict[str, Any]):
+    print(
+        f"{summary['requests']} requests in {summary['elapsed_seconds']:.1f}s, {summary['successes']} succeeded, "
+        f"{summary['throughput']:.2f} successful requests/s"
+    )
+    print("Latency of successful requests: " + ", ".join(
+        f"{name} {seconds:.3f}s" for name, seconds in summary["latency"].items()
+    ))
+    print(f"Requests per route: {summary['routes']}")
+    print(f"Max send lag: {summary['max_send_lag']:.3f}s")
+    for error, count in summary["errors"].items():
+        print(f"{count:8d}  {error}")
+
+
+async def replay(args: argparse.Namespace, requests: List[RecordedRequest]) -> List[ReplayResult]:
+    count = args.requests or len(requests)
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=args.timeout or None)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        if args.concurrency:
+            return await closed_loop(session, args.url, requests, count, args.concurrency, args.duration)
+        offsets = schedule(requests, count, args.rate, args.poisson, args.speedup)
+        return await open_loop(session, args.url, requests, offsets, args.duration)
+
+
+def main(argv: List[str] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording", help="JSONL file of recorded requests")
+    parser.add_argument("--url", default=config.TRAFFIC_REPLAY_URL)
+    parser.add_argument("--route", help="Only replay the requests of this route, e.g. /txt2img")
+    parser.add_argument("--speedup", type=float, default=1.0, help="Time compression of the recorded arrival times")
+    parser.add_argument("--rate", type=float, help="Open-loop requests per second instead of the recorded times")
+    parser.add_argument("--poisson", action="store_true", help="Exponential gaps between requests at --rate")
+    parser.add_argument("--concurrency", type=int, help="Closed-loop with this many requests in flight")
+    parser.add_argument("--requests", type=int, help="Requests to send, cycling over the recording (default one pass)")
+    parser.add_argument("--duration", type=float, default=0.0, help="Stop sending new requests after this many seconds")
+    parser.add_argument("--timeout", type=float, default=0.0, help="Client timeout per request in seconds")
+    parser.add_argument("--seed", type=int, help="Seed of the --poisson gaps")
+    parser.add_argument("--summary-json", help="Also write the summary as JSON to this file")
+    args = parser.parse_args(argv)
+
+    requests = read_recording(args.recording)
+    if args.route:
+        requests = [request for request in requests if request.route == DISPATCHER_PREFIX + args.route]
+    if not requests:
+        print(f"FAILED: No replayable requests in {args.recording}")
+        return 1
+    if not args.rate and not args.concurrency:
+        if any(request.timestamp is None for request in requests):
+            print("FAILED: Some recorded requests have no timestamp, replay them with --rate or --concurrency")
+            return 1
+        # Log lines of several workers are not necessarily in the order the requests arrived
+        requests.sort(key=lambda request: request.timestamp)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    summary = summarize(asyncio.run(replay(args, requests)))
+    print_summary(summary)
+    if args.summary_json:
+        with open(args.summary_json, "w") as file:
+            json.dump(summary, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())